@@ -0,0 +1,72 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import functools
+import os
+import threading
+
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from synthetic import generate_archive
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        '--bench-scale', type=float, default=1.0,
+        help='scale factor of the size of the generated archives')
+    parser.addoption(
+        '--bench-archives-dir', default=None,
+        help='directory where the generated archives are kept across runs '
+             '(a temporary directory by default)')
+
+
+@pytest.fixture(scope='session')
+def archives_dir(request, tmp_path_factory):
+    directory = request.config.getoption('--bench-archives-dir')
+    if directory is None:
+        return str(tmp_path_factory.mktemp('archives'))
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+@pytest.fixture(scope='session')
+def archive_factory(request, archives_dir):
+    """Return a function generating (once) the archive of a layout and a
+       format, cf. :func:`synthetic.generate_archive`.
+
+    """
+    scale = request.config.getoption('--bench-scale')
+    archives = {}
+
+    def factory(layout, fmt):
+        if (layout, fmt) not in archives:
+            archives[layout, fmt] = generate_archive(
+                archives_dir, layout, fmt, scale=scale)
+        return archives[layout, fmt]
+
+    return factory
+
+
+class QuietHTTPRequestHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='session')
+def archives_url(archives_dir):
+    """Serve the archives over http (so that they are downloaded, and
+       pipelined in the pipeline mode, as remote artifacts are), and return
+       the url of archives_dir.
+
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), functools.partial(
+        QuietHTTPRequestHandler, directory=archives_dir))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:%s' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,197 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Generators of synthetic (reproducible) archives for the benchmarks.
+
+The archives are generated along several axes:
+
+- their layout (cf. :data:`LAYOUTS`): many tiny files, few huge files, a
+  deep tree or many symlinks
+- their format (cf. :data:`FORMATS`): uncompressed, gzip, bzip2, xz or
+  zstd-compressed tarballs (the latter requires the zstd tool), or zip
+  archives
+
+The size of all the layouts is multiplied by a scale factor, so that the
+same benchmarks can be run quickly (e.g. in CI) or on realistic volumes.
+
+"""
+
+import io
+import os
+import random
+import shutil
+import subprocess
+import tarfile
+import zipfile
+
+
+WORDS = [
+    'archive', 'software', 'heritage', 'source', 'code', 'tarball', 'loader',
+    'content', 'directory', 'revision', 'snapshot', 'origin', 'visit',
+    'hash', 'storage', 'release', 'branch', 'license', 'copyright', 'int',
+    'return', 'if', 'else', 'for', 'while', 'def', 'class', 'import', '{',
+    '}', '(', ')', ';', '=', '==', '+', '-', '0', '1', 'NULL', 'self',
+]
+
+TAR_MODES = {
+    'tar': 'w',
+    'gz': 'w:gz',
+    'bz2': 'w:bz2',
+    'xz': 'w:xz',
+}
+
+FORMATS = ['tar', 'gz', 'bz2', 'xz', 'zst', 'zip']
+
+EXTENSIONS = {
+    'tar': '.tar',
+    'gz': '.tar.gz',
+    'bz2': '.tar.bz2',
+    'xz': '.tar.xz',
+    'zst': '.tar.zst',
+    'zip': '.zip',
+}
+
+
+class SymlinkTarget(str):
+    """Target of a generated symlink (as opposed to a file's data)."""
+
+
+def text_data(rng, size):
+    """Generate (compressible) source-like text of about size bytes."""
+    lines = []
+    length = 0
+    while length < size:
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(1, 12)))
+        lines.append(line)
+        length += len(line) + 1
+    return ('\n'.join(lines) + '\n').encode('utf-8')[:size]
+
+
+def binary_data(rng, size):
+    """Generate (incompressible) random bytes."""
+    return rng.getrandbits(8 * size).to_bytes(size, 'little') if size else b''
+
+
+def tiny_files(rng, scale):
+    """Many small text files spread over a hundred directories."""
+    for i in range(int(10000 * scale)):
+        yield ('dir%02d/file%05d.c' % (i % 100, i),
+               text_data(rng, rng.randint(0, 2048)))
+
+
+def huge_files(rng, scale):
+    """A few large binary files."""
+    for i in range(4):
+        yield 'data/blob%d.bin' % i, binary_data(
+            rng, int(32 * 1024 * 1024 * scale))
+
+
+def deep_tree(rng, scale):
+    """A chain of nested directories, with a few files at each level."""
+    path = ''
+    for depth in range(int(200 * scale)):
+        path += 'level%03d/' % depth
+        for i in range(4):
+            yield path + 'file%d.txt' % i, text_data(rng, 512)
+
+
+def symlinks(rng, scale):
+    """Files each targeted by several (relative) symlinks."""
+    count = int(1000 * scale)
+    for i in range(count):
+        yield 'files/file%05d.txt' % i, text_data(rng, 256)
+    for i in range(4 * count):
+        yield ('links/link%05d' % i,
+               SymlinkTarget('../files/file%05d.txt' % (i % count)))
+
+
+LAYOUTS = {
+    'tiny_files': tiny_files,
+    'huge_files': huge_files,
+    'deep_tree': deep_tree,
+    'symlinks': symlinks,
+}
+
+
+def is_supported(fmt):
+    """Return whether archives of format fmt can be generated."""
+    return fmt != 'zst' or shutil.which('zstd') is not None
+
+
+def _write_tar(path, mode, root, members):
+    directories = set()
+    with tarfile.open(path, mode) as tar:
+        for name, data in members:
+            name = '%s/%s' % (root, name)
+            parent = os.path.dirname(name)
+            missing = []
+            while parent and parent not in directories:
+                missing.append(parent)
+                directories.add(parent)
+                parent = os.path.dirname(parent)
+            for directory in reversed(missing):
+                info = tarfile.TarInfo(directory)
+                info.type = tarfile.DIRTYPE
+                info.mode = 0o755
+                tar.addfile(info)
+            info = tarfile.TarInfo(name)
+            if isinstance(data, SymlinkTarget):
+                info.type = tarfile.SYMTYPE
+                info.linkname = data
+                tar.addfile(info)
+            else:
+                info.size = len(data)
+                info.mode = 0o644
+                tar.addfile(info, io.BytesIO(data))
+
+
+def _write_zip(path, root, members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            name = '%s/%s' % (root, name)
+            if isinstance(data, SymlinkTarget):
+                # symlinks are stored as in Info-ZIP: unix mode in the
+                # high bits of the external attributes, target as data
+                info = zipfile.ZipInfo(name)
+                info.external_attr = 0o120777 << 16
+                archive.writestr(info, data)
+            else:
+                archive.writestr(name, data)
+
+
+def generate_archive(directory, layout, fmt, scale=1.0, seed=0):
+    """Generate (once) the archive of the given layout and format in
+       directory.
+
+    Args:
+        directory (str): where the archive is generated
+        layout (str): one of :data:`LAYOUTS`
+        fmt (str): one of :data:`FORMATS`
+        scale (float): scale factor of the layout's size
+        seed (int): seed of the generated data
+
+    Returns:
+        Tuple of (path of the archive, number of files (including the
+        symlinks), total size of the files)
+
+    """
+    rng = random.Random(seed)
+    root = '%s-%s' % (layout, scale)
+    members = list(LAYOUTS[layout](rng, scale))
+    size = sum(len(data) for _, data in members
+               if not isinstance(data, SymlinkTarget))
+    path = os.path.join(directory, root + EXTENSIONS[fmt])
+    if not os.path.exists(path):
+        tmp_path = path + '.tmp'
+        if fmt == 'zip':
+            _write_zip(tmp_path, root, members)
+        elif fmt == 'zst':
+            _write_tar(tmp_path + '.tar', 'w', root, members)
+            subprocess.run(['zstd', '-q', '--rm', '-o', tmp_path,
+                            tmp_path + '.tar'], check=True)
+        else:
+            _write_tar(tmp_path, TAR_MODES[fmt], root, members)
+        os.rename(tmp_path, path)
+    return path, len(members), size
@@ -0,0 +1,117 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""End to end benchmarks of :class:`RemoteTarLoader` against an in-memory
+storage, on synthetic archives.
+
+Each benchmark loads an archive (of a layout and format, cf.
+:mod:`synthetic`) with a loader configuration (cf. :data:`MODES`) in a
+fresh storage, so that all its objects are sent. The archives are
+served over http, as the local (``file://``) artifacts are never
+pipelined. Besides the timings, the throughput (files/s, MB/s) and the
+peak memory allocated by the load (measured in an extra untimed round)
+are reported in the benchmarks' extra info.
+
+"""
+
+import os
+import tempfile
+import tracemalloc
+
+import pytest
+
+from swh.loader.tar.loader import RemoteTarLoader
+
+from synthetic import FORMATS, LAYOUTS, is_supported
+
+pytest.importorskip('pytest_benchmark')
+
+
+BASE_CONFIG = {
+    'storage': {
+        'cls': 'memory',
+        'args': {},
+    },
+    'send_contents': True,
+    'send_directories': True,
+    'send_revisions': True,
+    'send_releases': True,
+    'send_snapshot': True,
+    'content_packet_size': 10000,
+    'content_packet_block_size_bytes': 104857600,
+    'content_packet_size_bytes': 1073741824,
+    'directory_packet_size': 25000,
+    'revision_packet_size': 100,
+    'release_packet_size': 100,
+    'content_size_limit': 1000000000,
+}
+
+# loader configurations benchmarked
+MODES = {
+    'disk': {},
+    'stream': {'stream_archive': True},
+    'pipeline': {'stream_archive': True, 'pipeline_archive': True},
+    'stream-external': {'stream_archive': True,
+                        'external_decompression': True},
+}
+
+ROUNDS = 3
+
+
+def make_loader(working_dir, mode):
+    config = {**BASE_CONFIG, **MODES[mode], 'working_dir': working_dir}
+
+    class BenchRemoteTarLoader(RemoteTarLoader):
+        def parse_config_file(self, *args, **kwargs):
+            return config
+
+    return BenchRemoteTarLoader()
+
+
+def load(loader, url):
+    return loader.load(
+        origin={'url': url, 'type': 'tar'},
+        visit_date='Tue, 3 May 2016 17:16:32 +0200',
+        last_modified='2018-12-05T12:35:23+00:00')
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+@pytest.mark.parametrize('fmt', FORMATS)
+@pytest.mark.parametrize('layout', sorted(LAYOUTS))
+def test_load(benchmark, archive_factory, archives_url, tmp_path, layout,
+              fmt, mode):
+    if not is_supported(fmt):
+        pytest.skip('%s archives cannot be generated' % fmt)
+    if fmt == 'zst' and 'external_decompression' not in MODES[mode]:
+        pytest.skip('zstd is only supported by external decompression')
+    path, files, size = archive_factory(layout, fmt)
+    url = '%s/%s' % (archives_url, os.path.basename(path))
+    working_dir = tempfile.mkdtemp(dir=str(tmp_path))
+
+    def setup():
+        # a fresh storage, so that all the objects are sent
+        return (make_loader(working_dir, mode), url), {}
+
+    result = benchmark.pedantic(load, setup=setup, rounds=ROUNDS)
+    assert result == {'status': 'eventful'}
+    if benchmark.stats is None:
+        # benchmarking is disabled (e.g. --benchmark-disable smoke tests)
+        return
+
+    tracemalloc.start()
+    try:
+        load(*setup()[0])
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    mean = benchmark.stats.stats.mean
+    benchmark.extra_info.update({
+        'files': files,
+        'bytes': size,
+        'files_per_second': files / mean,
+        'mb_per_second': size / mean / 1e6,
+        'peak_memory': peak_memory,
+    })
@@ -47,7 +47,11 @@ setup(
     scripts=[],
     install_requires=parse_requirements() + parse_requirements('swh'),
     setup_requires=['vcversioner'],
-    extras_require={'testing': parse_requirements('test')},
+    extras_require={
+        'async': parse_requirements('async'),
+        'bench': parse_requirements('bench'),
+        'testing': parse_requirements('test'),
+    },
     vcversioner={'version_module_paths': ['swh/loader/tar/_version.py']},
     include_package_data=True,
     classifiers=[
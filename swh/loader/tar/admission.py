@@ -0,0 +1,202 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Admission control of the loads, according to the size of their
+artifacts.
+
+The artifacts loaded concurrently by the processes of a worker (sharing
+its working directory) are limited to a budget of bytes: a load is only
+admitted when its artifacts fit in what is left of the budget (or when
+nothing else is being loaded, so that artifacts exceeding the whole
+budget are loaded alone). Besides, the artifacts larger than a threshold
+can be routed to a dedicated queue (served by workers with more disk and
+memory).
+
+"""
+
+import contextlib
+import fcntl
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+
+from urllib.parse import urlparse
+
+import requests
+
+from .utils import is_alive
+
+
+logger = logging.getLogger(__name__)
+
+# Timeout (in seconds) of the requests of the size of the artifacts
+HEAD_TIMEOUT = 60
+
+
+class ByteBudget:
+    """Budget of bytes shared by the processes using the same path.
+
+    The reservations are kept in a JSON file, locked while it is being
+    updated, along with the pid of their process: the reservations of
+    terminated processes are dropped.
+
+    Args:
+        path (str): path of the file of the reservations
+        budget (int): the budget, in bytes
+
+    """
+    _tokens = itertools.count()
+
+    def __init__(self, path, budget):
+        self.path = path
+        self.budget = budget
+
+    @contextlib.contextmanager
+    def _reservations(self):
+        """Lock and read the reservations, writing them back on exit."""
+        with open(self.path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            reservations = {}
+            if os.path.exists(self.path):
+                with open(self.path) as f:
+                    try:
+                        reservations = json.load(f)
+                    except ValueError:
+                        logger.warning('Resetting the corrupted budget %s',
+                                       self.path)
+            reservations = {
+                token: (pid, size)
+                for token, (pid, size) in reservations.items()
+                if is_alive(pid)
+            }
+            yield reservations
+            tmp_path = '%s.%s' % (self.path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                json.dump(reservations, f)
+            os.rename(tmp_path, self.path)
+
+    def used(self):
+        """Return the bytes currently reserved."""
+        with self._reservations() as reservations:
+            return sum(size for _, size in reservations.values())
+
+    def try_reserve(self, size):
+        """Reserve size bytes of the budget, if they fit in what is left
+           (or if nothing is reserved).
+
+        Returns:
+            the token of the reservation, or None if it does not fit
+
+        """
+        token = '%s-%s-%s' % (os.getpid(), threading.get_ident(),
+                              next(self._tokens))
+        with self._reservations() as reservations:
+            used = sum(size for _, size in reservations.values())
+            if reservations and used + size > self.budget:
+                return None
+            reservations[token] = (os.getpid(), size)
+        return token
+
+    def release(self, token):
+        """Release the reservation token."""
+        with self._reservations() as reservations:
+            reservations.pop(token, None)
+
+
+class AdmissionControl:
+    """Admission control of the loads of a worker.
+
+    Args:
+        budget_path (str): path of the file of the reservations of the
+          budget, shared by the processes of the worker
+        budget (int): bytes of artifacts loaded concurrently by the
+          processes of the worker (0 for no limit)
+        large_size (int): size from which the artifacts are routed to
+          large_queue (0 not to route them)
+        large_queue (str): queue of the large artifacts
+        wait (int): time (in seconds) a load waits for the budget before
+          being deferred
+        retry_delay (int): time (in seconds) after which a deferred load
+          is retried
+        session: http session used to request the size of the artifacts
+        headers (dict): http headers of these requests
+
+    """
+    def __init__(self, budget_path, budget=0, large_size=0, large_queue='',
+                 wait=0, retry_delay=60, session=None, headers=None):
+        self.budget = ByteBudget(budget_path, budget) if budget else None
+        self.large_size = large_size
+        self.large_queue = large_queue
+        self.wait = wait
+        self.retry_delay = retry_delay
+        self.session = session or requests.session()
+        self.headers = headers or {}
+
+    def artifact_size(self, url):
+        """Return the size of the artifact at url (from the file system
+           or a HEAD request), or None if it is unknown.
+
+        """
+        url_parsed = urlparse(url)
+        try:
+            if url_parsed.scheme == 'file':
+                return os.path.getsize(url_parsed.path)
+            response = self.session.head(url, headers=self.headers,
+                                         allow_redirects=True,
+                                         timeout=HEAD_TIMEOUT)
+            if response.status_code != 200:
+                return None
+            return int(response.headers['content-length'])
+        except (OSError, KeyError, ValueError,
+                requests.exceptions.RequestException) as e:
+            logger.debug('Unknown size of %s: %s', url, e)
+            return None
+
+    def artifacts_size(self, urls, size=None):
+        """Return the total size of the artifacts at urls: size if it is
+           known (e.g. by the lister), otherwise the sum of their known
+           sizes.
+
+        """
+        if size is not None:
+            return size
+        return sum(self.artifact_size(url) or 0 for url in urls)
+
+    def is_large(self, size):
+        """Return whether artifacts of size bytes must be routed to the
+           queue of the large artifacts."""
+        return bool(self.large_size and self.large_queue and
+                    size >= self.large_size)
+
+    def reserve(self, size):
+        """Reserve size bytes of the budget, waiting at most `wait`
+           seconds for them to be available.
+
+        Returns:
+            the reservation (a context manager releasing it on exit), or
+            None if the budget is exhausted
+
+        """
+        if self.budget is None:
+            return self._reservation(None)
+        deadline = time.monotonic() + self.wait
+        while True:
+            token = self.budget.try_reserve(size)
+            if token is not None:
+                return self._reservation(token)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(1, self.wait))
+
+    @contextlib.contextmanager
+    def _reservation(self, token):
+        try:
+            yield
+        finally:
+            if token is not None:
+                self.budget.release(token)
@@ -0,0 +1,286 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Asynchronous download of the archives.
+
+All the downloads of a worker process go through a single event loop
+(running in a background thread) and a single aiohttp session, so that
+the connections are pooled across downloads (and loads).
+
+Archives served by servers supporting range requests are downloaded by
+parts, several of them at a time. The parts are hashed in order while the
+next ones are being downloaded.
+
+This requires the optional aiohttp dependency. Unlike the blocking
+:class:`swh.loader.tar.fetcher.ArchiveFetcher`, interrupted downloads are
+not resumed (cf. :mod:`swh.loader.tar.partial`): they fail the load.
+
+"""
+
+import asyncio
+import os
+import re
+import threading
+
+from urllib.parse import urlparse
+
+try:
+    import aiohttp
+except ImportError:
+    HAS_AIOHTTP = False
+else:
+    HAS_AIOHTTP = True
+
+from swh.model.hashutil import MultiHash, HASH_BLOCK_SIZE
+
+from .cache import link_or_copy
+
+
+CONTENT_RANGE_RE = re.compile(r'bytes (\d+)-(\d+)/(\d+)$')
+
+# Time (in seconds) after which a stalled connection is given up
+READ_TIMEOUT = 300
+
+
+class EventLoop:
+    """Event loop running in a background thread, along with its http
+       session, shared by the fetchers of a process.
+
+    """
+    _instance = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.pid = os.getpid()
+        self.loop = asyncio.new_event_loop()
+        self.session = None
+        threading.Thread(target=self.loop.run_forever,
+                         name='swh.loader.tar.event-loop',
+                         daemon=True).start()
+
+    @classmethod
+    def get(cls):
+        """Return the event loop of the current process (started on first
+           use, and again in forked processes).
+
+        """
+        with cls._lock:
+            if cls._instance is None or cls._instance.pid != os.getpid():
+                cls._instance = cls()
+            return cls._instance
+
+    def run(self, coroutine):
+        """Run coroutine in the event loop, waiting for its result."""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    async def get_session(self):
+        """Return the session of the event loop (created on first use)."""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                timeout=aiohttp.ClientTimeout(total=None,
+                                              sock_read=READ_TIMEOUT))
+        return self.session
+
+
+def _hash_range(filepath, start, end, h):
+    """Update h with the bytes of filepath from start to end (included)."""
+    with open(filepath, 'rb') as f:
+        f.seek(start)
+        remaining = end + 1 - start
+        while remaining:
+            chunk = f.read(min(remaining, HASH_BLOCK_SIZE))
+            if not chunk:
+                raise ValueError('Truncated part %s-%s of %s' % (
+                    start, end, filepath))
+            h.update(chunk)
+            remaining -= len(chunk)
+
+
+async def _write_part(response, fd, start, end):
+    """Write the body of response at offset start of fd (from the default
+       executor, not to block the event loop)."""
+    loop = asyncio.get_event_loop()
+    offset = start
+    async for chunk in response.content.iter_chunked(HASH_BLOCK_SIZE):
+        await loop.run_in_executor(None, os.pwrite, fd, chunk, offset)
+        offset += len(chunk)
+    if offset != end + 1:
+        raise ValueError('Error when checking size: %s != %s' % (
+            end + 1 - start, offset - start))
+
+
+class AsyncArchiveFetcher:
+    """Client downloading the remote archives asynchronously, on top of a
+       (blocking) :class:`ArchiveFetcher`.
+
+    Local archives, the (pipelined) :meth:`open` and the configuration
+    (temporary directory, headers, cache) are those of the wrapped
+    fetcher. The interrupted downloads are not resumed.
+
+    Args:
+        fetcher (ArchiveFetcher): the blocking fetcher
+        range_workers (int): maximum number of parts of an archive
+          downloaded concurrently (1 disables the range requests)
+        range_size (int): size of the parts of the archives
+
+    """
+    def __init__(self, fetcher, range_workers=4, range_size=16 * 1024 * 1024):
+        if not HAS_AIOHTTP:
+            raise ValueError('The asynchronous fetcher requires aiohttp')
+        self.fetcher = fetcher
+        self.range_workers = range_workers
+        self.range_size = range_size
+        self.event_loop = EventLoop.get()
+
+    def stream(self, url):
+        """Open the tarball url for streaming (cf.
+           :meth:`ArchiveFetcher.stream`).
+
+        """
+        return self.fetcher.stream(url)
+
+    def download(self, url, directory=None):
+        """Download the tarball url locally (cf.
+           :meth:`ArchiveFetcher.download`).
+
+        Returns:
+            Tuple of local (filepath, hashes of filepath)
+
+        """
+        if urlparse(url).scheme == 'file':
+            return self.fetcher.download(url, directory)
+        filepath = os.path.join(directory or self.fetcher.temp_directory,
+                                os.path.basename(url))
+        return self.event_loop.run(self._download(url, filepath))
+
+    async def _download(self, url, filepath):
+        session = await self.event_loop.get_session()
+        cache = self.fetcher.cache
+        entry = cache.get(url) if cache is not None else None
+        headers = dict(self.fetcher.params['headers'])
+        if entry is not None:
+            headers.update(cache.validators(entry))
+
+        result = None
+        if self.range_workers > 1:
+            result = await self._fetch(session, url, filepath, entry, {
+                **headers, 'Range': 'bytes=0-%s' % (self.range_size - 1)})
+        if result is None:
+            result = await self._fetch(session, url, filepath, entry, headers)
+        hashes, response_headers = result
+
+        if cache is not None and response_headers is not None:
+            cache.add(url, filepath, hashes=hashes, headers=response_headers)
+        return filepath, hashes
+
+    async def _fetch(self, session, url, filepath, entry, headers):
+        """Download url at filepath, by parts if the server answers to a
+           range request.
+
+        Returns:
+            Tuple of (hashes of filepath, response headers or None if the
+            archive comes from the cache), or None if the range request
+            was not satisfiable (e.g. the archive is empty)
+
+        """
+        async with session.get(url, headers=headers) as response:
+            if response.status == 416 and 'Range' in headers:
+                return None
+            if entry is not None and response.status == 304:
+                link_or_copy(entry['path'], filepath)
+                return entry['hashes'], None
+            if response.status == 206:
+                hashes = await self._write_parts(
+                    session, url, response, filepath)
+            elif response.status == 200:
+                hashes = await self._write_whole(response, filepath)
+            else:
+                raise ValueError("Fail to query '%s'. Reason: %s" % (
+                    url, response.status))
+            return hashes, response.headers
+
+    async def _write_whole(self, response, filepath):
+        """Write the whole archive in response at filepath (from the
+           default executor, not to block the event loop)."""
+        loop = asyncio.get_event_loop()
+        length = int(response.headers['content-length'])
+        h = MultiHash(length=length)
+        with open(filepath, 'wb') as f:
+            async for chunk in response.content.iter_chunked(
+                    HASH_BLOCK_SIZE):
+                h.update(chunk)
+                await loop.run_in_executor(None, f.write, chunk)
+
+        actual_length = os.path.getsize(filepath)
+        if length != actual_length:
+            raise ValueError('Error when checking size: %s != %s' % (
+                length, actual_length))
+        return {
+            'length': length,
+            **h.hexdigest()
+        }
+
+    async def _write_parts(self, session, url, response, filepath):
+        """Write the archive at filepath, response holding its first part
+           and the other parts being requested concurrently.
+
+        """
+        match = CONTENT_RANGE_RE.match(
+            response.headers.get('content-range', ''))
+        if not match or int(match.group(1)) != 0:
+            raise ValueError('Invalid range %s for %s' % (
+                response.headers.get('content-range'), url))
+        length = int(match.group(3))
+        parts = [(start, min(start + self.range_size, length) - 1)
+                 for start in range(0, length, self.range_size)]
+        if int(match.group(2)) != parts[0][1]:
+            raise ValueError('Invalid range %s for %s' % (
+                response.headers.get('content-range'), url))
+
+        # the other parts must come from the same version of the archive
+        headers = dict(self.fetcher.params['headers'])
+        validator = response.headers.get('ETag') or \
+            response.headers.get('Last-Modified')
+        if validator:
+            headers['If-Range'] = validator
+        semaphore = asyncio.Semaphore(self.range_workers - 1)
+
+        async def write_part(fd, start, end):
+            async with semaphore:
+                async with session.get(url, headers={
+                        **headers,
+                        'Range': 'bytes=%s-%s' % (start, end)}) as part:
+                    content_range = 'bytes %s-%s/%s' % (start, end, length)
+                    if part.status != 206 or \
+                       part.headers.get('content-range') != content_range:
+                        raise ValueError(
+                            'Archive %s changed during its download' % url)
+                    await _write_part(part, fd, start, end)
+
+        loop = asyncio.get_event_loop()
+        h = MultiHash(length=length)
+        fd = os.open(filepath, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        tasks = [asyncio.ensure_future(write_part(fd, start, end))
+                 for start, end in parts[1:]]
+        try:
+            await _write_part(response, fd, *parts[0])
+            for (start, end), task in zip(parts, [None] + tasks):
+                if task is not None:
+                    await task
+                # hash the part while the next ones are being downloaded
+                await loop.run_in_executor(
+                    None, _hash_range, filepath, start, end, h)
+        except BaseException:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        finally:
+            os.close(fd)
+
+        return {
+            'length': length,
+            **h.hexdigest()
+        }
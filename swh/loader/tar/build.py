@@ -9,6 +9,8 @@ import os
 
 import arrow
 
+from swh.model.identifiers import identifier_to_bytes, snapshot_identifier
+
 
 logger = logging.getLogger(__name__)
 
@@ -106,3 +108,26 @@ def set_original_artifact(*, revision, filepath, nature, hashes):
     }]
 
     return revision
+
+
+def compute_snapshot(branches):
+    """Compute a snapshot targeting revisions.
+
+    Args:
+        branches (dict): branch name (bytes) -> revision id (bytes)
+
+    Returns:
+        Snapshot as dict (with its identifier) with one branch per
+        revision
+
+    """
+    snapshot = {
+        'branches': {
+            name: {
+                'target': revision_id,
+                'target_type': 'revision',
+            } for name, revision_id in branches.items()
+        }
+    }
+    snapshot['id'] = identifier_to_bytes(snapshot_identifier(snapshot))
+    return snapshot
@@ -0,0 +1,155 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""On-disk cache of the downloaded artifacts, shared by the loaders of a
+worker.
+
+Each artifact is stored under the sha1 of its url, next to a json file
+holding its http validators (ETag, Last-Modified) and hashes. The json
+file's mtime tracks the last use of the entry, the least recently used
+ones being evicted once the cache exceeds its size budget.
+
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+
+logger = logging.getLogger(__name__)
+
+
+METADATA_SUFFIX = '.json'
+
+
+def link_or_copy(src, dst):
+    """Hard link src to dst, or copy it if it cannot be linked (e.g. src
+       and dst are not on the same filesystem).
+
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+class ArtifactCache:
+    """Persistent cache of artifacts keyed by url.
+
+    Args:
+        cache_dir (str): directory holding the cached artifacts
+        max_size (int): size budget (in bytes) of the cache
+
+    """
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, url):
+        key = hashlib.sha1(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key)
+
+    def get(self, url):
+        """Retrieve the cache entry of url (and mark it as recently used).
+
+        Returns:
+            dict with keys {url, path, etag, last_modified, hashes} or
+            None if url is not cached.
+
+        """
+        path = self._path(url)
+        try:
+            with open(path + METADATA_SUFFIX) as f:
+                entry = json.load(f)
+            os.utime(path + METADATA_SUFFIX)
+        except (OSError, ValueError):
+            return None
+        if entry.get('url') != url or not os.path.exists(path):
+            return None
+        entry['path'] = path
+        return entry
+
+    @staticmethod
+    def validators(entry):
+        """Compute the http headers revalidating the cache entry."""
+        headers = {}
+        if entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    def add(self, url, filepath, *, hashes, headers):
+        """Add the artifact downloaded from url at filepath to the cache.
+
+        Args:
+            url (str): url the artifact was downloaded from
+            filepath (str): the local copy of the artifact
+            hashes (dict): hashes of the artifact
+            headers (dict): http headers of the artifact's response
+
+        """
+        if hashes['length'] > self.max_size:
+            logger.debug('Not caching %s, too large (%s > %s)',
+                         url, hashes['length'], self.max_size)
+            return
+        entry = {
+            'url': url,
+            'etag': headers.get('ETag'),
+            'last_modified': headers.get('Last-Modified'),
+            'hashes': hashes,
+        }
+        path = self._path(url)
+        # concurrent loaders may share the cache: only expose complete
+        # files, through atomic renames
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp-')
+        try:
+            tmp_path = os.path.join(tmp_dir, 'artifact')
+            link_or_copy(filepath, tmp_path)
+            try:
+                os.unlink(path + METADATA_SUFFIX)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, path)
+            with open(tmp_path + METADATA_SUFFIX, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path + METADATA_SUFFIX, path + METADATA_SUFFIX)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until the cache fits
+           in its size budget.
+
+        """
+        entries = []
+        total_size = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(METADATA_SUFFIX):
+                continue
+            path = os.path.join(self.cache_dir, name[:-len(METADATA_SUFFIX)])
+            try:
+                last_used = os.stat(path + METADATA_SUFFIX).st_mtime
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            entries.append((last_used, size, path))
+            total_size += size
+
+        for _, size, path in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            logger.debug('Evicting %s from the artifact cache', path)
+            for p in (path + METADATA_SUFFIX, path):
+                try:
+                    os.unlink(p)
+                except FileNotFoundError:
+                    pass
+            total_size -= size
@@ -0,0 +1,220 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Decompression backends of the tar loader.
+
+Compressed tarballs can be uncompressed by external (and mostly
+multi-threaded) tools when they are installed on the worker, falling back
+to the Python codecs otherwise.
+
+"""
+
+import bz2
+import contextlib
+import gzip
+import lzma
+import shutil
+import subprocess
+import threading
+
+
+# compression -> magic number
+MAGIC_NUMBERS = {
+    'gz': b'\x1f\x8b',
+    'bz2': b'BZh',
+    'xz': b'\xfd7zXZ\x00',
+    'zst': b'\x28\xb5\x2f\xfd',
+}
+
+# compression -> external commands uncompressing stdin (or the file given
+# as last argument) to stdout, by order of preference
+EXTERNAL_DECOMPRESSORS = {
+    'gz': [['pigz', '-d', '-c'], ['gzip', '-d', '-c']],
+    'bz2': [['lbzip2', '-d', '-c'], ['pbzip2', '-d', '-c'],
+            ['bzip2', '-d', '-c']],
+    'xz': [['xz', '-d', '-c', '-T0']],
+    'zst': [['zstd', '-d', '-c', '-q']],
+}
+
+# compression -> python function opening a compressed file for reading
+PYTHON_DECOMPRESSORS = {
+    'gz': gzip.open,
+    'bz2': bz2.open,
+    'xz': lzma.open,
+}
+
+
+def detect_compression(head):
+    """Detect the compression of a stream from its first bytes.
+
+    Returns:
+        one of the keys of :data:`MAGIC_NUMBERS`, or None if the stream
+        is not compressed (or compressed in an unknown format)
+
+    """
+    for compression, magic in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def detect_file_compression(path):
+    """Detect the compression of the file at path (cf.
+       :func:`detect_compression`).
+
+    """
+    with open(path, 'rb') as f:
+        return detect_compression(f.read(8))
+
+
+def external_command(compression):
+    """Find the external command able to uncompress compression, if any
+       is installed.
+
+    """
+    for command in EXTERNAL_DECOMPRESSORS.get(compression, []):
+        if shutil.which(command[0]):
+            return command
+    return None
+
+
+def is_supported(compression, external=False):
+    """Whether compression can be uncompressed by the available backends.
+    """
+    if compression is None or compression in PYTHON_DECOMPRESSORS:
+        return True
+    return external and external_command(compression) is not None
+
+
+class ExternalDecompressor:
+    """Uncompress a stream through an external command.
+
+    The compressed data is either read from a file, or written to the
+    process' stdin by :meth:`feed` (from another thread than the one
+    reading :attr:`stdout`).
+
+    Args:
+        command (List[str]): the command uncompressing stdin to stdout
+        path (str): the file to uncompress, if None the data is fed to
+          the command
+
+    """
+    def __init__(self, command, path=None):
+        self.command = command
+        args = command + [path] if path is not None else command
+        self.process = subprocess.Popen(
+            args, stdin=subprocess.PIPE if path is None else None,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.stdout = self.process.stdout
+        self.feeder = None
+        self.feed_error = None
+
+    def _feed(self, chunks):
+        try:
+            for chunk in chunks:
+                self.process.stdin.write(chunk)
+        except BrokenPipeError:
+            # the process exited early, its status tells why
+            pass
+        except BaseException as e:
+            self.feed_error = e
+        finally:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def feed(self, chunks):
+        """Write chunks to the process' stdin, in a background thread."""
+        self.feeder = threading.Thread(
+            target=self._feed, args=(chunks,),
+            name='swh.loader.tar.feed', daemon=True)
+        self.feeder.start()
+
+    def close(self, check=True):
+        """Wait for the process to terminate.
+
+        Args:
+            check (bool): whether to check the process was successful
+
+        Raises:
+            ValueError if check is set and the process failed
+
+        """
+        if not check:
+            self.process.kill()
+        # consume the output left so that the process can terminate
+        while self.stdout.read(1024 * 1024):
+            pass
+        if self.feeder is not None:
+            self.feeder.join()
+        returncode = self.process.wait()
+        stderr = self.process.stderr.read()
+        self.stdout.close()
+        self.process.stderr.close()
+        if not check:
+            return
+        if self.feed_error is not None:
+            raise self.feed_error
+        if returncode != 0:
+            raise ValueError('%s failed (%s): %s' % (
+                self.command[0], returncode,
+                stderr.decode('utf-8', 'replace').strip()))
+
+
+@contextlib.contextmanager
+def open_uncompressed(path, external=False, check=True):
+    """Open the file at path, uncompressing it on the fly.
+
+    Args:
+        path (str): the (possibly compressed) file
+        external (bool): whether to use the external decompressors when
+          they are installed
+        check (bool): whether the external decompressor must go through
+          the whole file and succeed; if not set, it is stopped as soon
+          as the file object is closed
+
+    Raises:
+        ValueError if the compression of the file is not supported
+
+    Yields:
+        a readable file object of the uncompressed data
+
+    """
+    compression = detect_file_compression(path)
+    command = external_command(compression) if external else None
+    if command is not None:
+        decompressor = ExternalDecompressor(command, path)
+        try:
+            yield decompressor.stdout
+        except BaseException:
+            decompressor.close(check=False)
+            raise
+        else:
+            decompressor.close(check=check)
+    elif compression is None:
+        with open(path, 'rb') as f:
+            yield f
+    elif compression in PYTHON_DECOMPRESSORS:
+        with PYTHON_DECOMPRESSORS[compression](path, 'rb') as f:
+            yield f
+    else:
+        raise ValueError('Unsupported compression %s for %s' % (
+            compression, path))
+
+
+def uncompress_to(path, dest, external=False):
+    """Uncompress the file at path to dest.
+
+    Args:
+        path (str): the compressed file
+        dest (str): where to write the uncompressed data
+        external (bool): whether to use the external decompressors when
+          they are installed
+
+    """
+    with open_uncompressed(path, external=external) as fsrc, \
+            open(dest, 'wb') as fdst:
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
@@ -0,0 +1,86 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Deduplication of the contents of an archive.
+
+Archives often hold the same file several times (vendored copies,
+generated files, license files, ...): the cache of the hashes of an
+archive recognizes these duplicates so that each distinct content is only
+hashed once with all the algorithms of the archive. (The duplicated
+contents and subtrees are then only handed over once by the
+:class:`swh.loader.tar.stream.DirectoryBuilder`.)
+
+"""
+
+import hashlib
+import threading
+
+from swh.model.hashutil import MultiHash
+
+from .hashcache import MIN_LENGTH
+
+
+class ArchiveHashCache:
+    """In-memory cache of the hashes of the contents of an archive.
+
+    The contents are first told apart by their length: only those whose
+    length was already seen are fingerprinted (by their SHA256, which is
+    one of the hashes computed anyway for the others, and unlike SHA1 not
+    known to collide) to be looked up.
+    The contents seen for the first time are hashed with all the
+    algorithms, or looked up in the persistent cache if provided. It can
+    be used from several threads, as a
+    :class:`swh.loader.tar.hashcache.ContentHashCache`.
+
+    Args:
+        parent (ContentHashCache): optional persistent cache of the
+          hashes of the contents
+
+    """
+    def __init__(self, parent=None):
+        self.parent = parent
+        self.lock = threading.Lock()
+        self.lengths = set()
+        # sha256 -> hashes
+        self.known = {}
+        self.hits = 0
+        self.saved_bytes = 0
+
+    def hashes(self, data):
+        """Compute the hashes of data, or retrieve those of an identical
+           content of the archive.
+
+        Returns:
+            dict of the hashes of data, as :meth:`MultiHash.digest`
+
+        """
+        length = len(data)
+        if length < MIN_LENGTH:
+            return MultiHash.from_data(data).digest()
+        with self.lock:
+            seen = length in self.lengths
+        if seen:
+            hashes = self.known.get(hashlib.sha256(data).digest())
+            if hashes is not None:
+                with self.lock:
+                    self.hits += 1
+                    self.saved_bytes += length
+                return dict(hashes)
+        if self.parent is not None:
+            hashes = self.parent.hashes(data)
+        else:
+            hashes = MultiHash.from_data(data).digest()
+        with self.lock:
+            self.lengths.add(length)
+            self.known.setdefault(hashes['sha256'], dict(hashes))
+        return hashes
+
+    def counters(self):
+        """Return the counters of the duplicates found (cf.
+           :meth:`swh.loader.tar.metrics.Phase.count`)."""
+        return {
+            'duplicate_contents': self.hits,
+            'duplicate_bytes': self.saved_bytes,
+        }
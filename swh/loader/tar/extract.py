@@ -0,0 +1,123 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Extraction of the tarballs holding contents larger than the content
+size limit, or subject to limits.
+
+These contents are only archived as skipped contents (their hashes,
+without their data): they are hashed from the archive stream instead of
+being extracted to disk along with the rest of the tree. The limits of
+the archive (cf. :mod:`swh.loader.tar.limits`) are checked before each
+member is extracted.
+
+"""
+
+import lzma
+import os
+import stat
+import tarfile
+import zlib
+
+from swh.model.from_disk import mode_to_perms
+
+from .decompress import open_uncompressed
+from .stream import (
+    is_oversized, normalize_name, regular_file_mode, skipped_content_data
+)
+
+
+def _remove(path):
+    if os.path.isdir(path) and not os.path.islink(path):
+        raise ValueError('Conflicting archive member %r' % path)
+    if os.path.lexists(path):
+        os.unlink(path)
+
+
+def extract_tarball(tarpath, dest, max_content_size=None,
+                    external_decompression=False, limits=None):
+    """Extract the tarball at tarpath to dest, as
+       :func:`swh.core.tarball.uncompress` does, except for the regular
+       files larger than max_content_size (from their header) which are
+       only hashed.
+
+    Args:
+        tarpath (str): path to the (possibly compressed) tarball
+        dest (str): the directory to extract the tarball to
+        max_content_size (int): size from which the regular files are
+          not extracted
+        external_decompression (bool): whether to use the external
+          decompressors when they are installed
+        limits (ArchiveLimits): optional limits of the archive
+
+    Raises:
+        ValueError when the archive cannot be extracted (e.g. it holds a
+        hard link to a file outside of it, as
+        :func:`swh.loader.tar.stream.directory_from_tarfile` does)
+        (ArchiveLimitExceeded when it exceeds its limits)
+
+    Returns:
+        dict of relative path (bytes) -> data of the skipped contents
+        left out of dest (cf.
+        :func:`swh.loader.tar.hashing.directory_from_disk`)
+
+    """
+    skipped = {}
+    try:
+        with open_uncompressed(
+                tarpath, external=external_decompression) as fobj:
+            with tarfile.open(fileobj=fobj, mode='r|') as tar:
+                for member in tar:
+                    path = normalize_name(member.name)
+                    if not path:
+                        continue
+                    if limits is not None:
+                        limits.add_member(
+                            path, member.size if member.isreg() else 0)
+                    target = os.path.join(os.fsencode(dest), path)
+                    link = None
+                    if member.islnk():
+                        link = normalize_name(member.linkname)
+                        if not link:
+                            # it would link to a file outside of dest
+                            raise ValueError(
+                                'Hard link %r outside of the archive' %
+                                member.name)
+                    if member.isreg() and \
+                       is_oversized(member.size, max_content_size):
+                        _remove(target)
+                        skipped[path] = skipped_content_data(
+                            tar.extractfile(member),
+                            mode=regular_file_mode(member.mode),
+                            length=member.size)
+                    elif link is not None and link in skipped:
+                        _remove(target)
+                        # the mode of a hard link is that of its target
+                        # once extracted
+                        data = dict(skipped[link], perms=mode_to_perms(
+                            regular_file_mode(member.mode)))
+                        skipped[path] = skipped[link] = data
+                    else:
+                        skipped.pop(path, None)
+                        # relative to dest, whatever the archive holds
+                        member.name = os.fsdecode(path)
+                        if link is not None:
+                            member.linkname = os.fsdecode(link)
+                        # directories are left writable until the end
+                        tar.extract(member, dest,
+                                    set_attrs=not member.isdir())
+    except (tarfile.TarError, EOFError, OSError, zlib.error,
+            lzma.LZMAError) as e:
+        raise ValueError('Problem during unpacking %s. Reason: %s' % (
+            tarpath, e))
+
+    # fix the permissions, as swh.core.tarball.uncompress does
+    for dirpath, _, fnames in os.walk(dest):
+        os.chmod(dirpath, 0o755)
+        for fname in fnames:
+            fpath = os.path.join(dirpath, fname)
+            if not os.path.islink(fpath) and \
+               not os.stat(fpath).st_mode & stat.S_IXUSR:
+                os.chmod(fpath, 0o644)
+    return skipped
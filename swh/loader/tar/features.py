@@ -0,0 +1,504 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Optional features of the tar loaders, grouped by concern.
+
+Each mixin declares its settings in its own `ADDITIONAL_CONFIG` (merged
+in :attr:`swh.loader.tar.loader.BaseTarLoader.ADDITIONAL_CONFIG`) and
+reads them in its `configure_*` method, called by the loader once its
+working directories exist. The loader itself only orchestrates the
+phases of the visits (fetching, building, collecting and storing the
+objects), relying on the methods of the mixins.
+
+"""
+
+import contextlib
+import os
+import random
+from typing import Any, Dict, Tuple
+
+from concurrent.futures import ProcessPoolExecutor
+
+from .admission import AdmissionControl
+from .asyncfetcher import AsyncArchiveFetcher
+from .cache import ArtifactCache
+from .dedup import ArchiveHashCache
+from .extract import extract_tarball
+from .fetcher import ArchiveFetcher
+from .hashcache import ContentHashCache
+from .limits import ArchiveLimitExceeded, ArchiveLimits
+from .metrics import VisitMetrics, send_statsd, textfile_exporter
+from .missing import filter_missing_contents
+from .partial import clean_partial_downloads
+from .profiling import VisitProfiler, report_prefix
+from .readers import check_zipfile
+from .scratch import MemoryScratch, ScratchFull, ScratchLimits
+from .sender import BackgroundSender
+from .utils import PacketBuffer
+
+
+HASH_CACHE_FILENAME = 'content-hashes.sqlite'
+PARTIAL_DOWNLOADS_DIRNAME = 'partial-downloads'
+ADMISSION_BUDGET_FILENAME = 'admission-budget.json'
+SCRATCH_BUDGET_FILENAME = 'scratch-budget.json'
+# Time (in seconds) after which an unfinished download is discarded
+PARTIAL_DOWNLOADS_MAX_AGE = 7 * 24 * 3600
+
+
+class FetchingMixin:
+    """Download of the artifacts: cache, resumes, asynchronous fetcher and
+       admission control of the tasks.
+
+    """
+    ADDITIONAL_CONFIG: Dict[str, Tuple[str, Any]] = {
+        # persistent cache of the downloaded artifacts (disabled if empty)
+        'download_cache_dir': ('string', ''),
+        'download_cache_size': ('int', 10 * 1024 * 1024 * 1024),
+        # number of artifacts downloaded concurrently by the batch loader
+        'fetch_workers': ('int', 4),
+        # download the remote archives asynchronously (requires aiohttp),
+        # by parts of range_size bytes, range_workers at a time (if the
+        # server supports range requests); the interrupted downloads are
+        # then not resumed
+        'async_fetcher': ('bool', False),
+        'range_workers': ('int', 4),
+        'range_size': ('int', 16 * 1024 * 1024),
+        # number of times an interrupted download is resumed (with range
+        # requests), and whether the interrupted downloads are kept (in
+        # working_dir) for the next attempt to resume them
+        'download_resumes': ('int', 3),
+        'keep_partial_downloads': ('bool', False),
+        # admission control of the tasks: bytes of artifacts loaded
+        # concurrently by the processes of the worker (sharing its
+        # working_dir, 0 for no limit), loads waiting at most
+        # admission_wait seconds for the budget before being retried
+        # after admission_retry_delay seconds; artifacts of at least
+        # admission_large_size bytes are routed to admission_large_queue
+        'admission_budget': ('int', 0),
+        'admission_wait': ('int', 0),
+        'admission_retry_delay': ('int', 60),
+        'admission_large_size': ('int', 0),
+        'admission_large_queue': ('string', ''),
+    }
+
+    def configure_fetching(self):
+        """Set up the fetcher of the artifacts (:attr:`client`) and the
+           admission control of the tasks, if any.
+
+        """
+        cache = None
+        if self.config.get('download_cache_dir'):
+            cache = ArtifactCache(
+                self.config['download_cache_dir'],
+                max_size=self.config.get('download_cache_size',
+                                         10 * 1024 * 1024 * 1024))
+        partial_directory = None
+        if self.config.get('keep_partial_downloads', False):
+            partial_directory = os.path.join(self.working_dir,
+                                             PARTIAL_DOWNLOADS_DIRNAME)
+            os.makedirs(partial_directory, exist_ok=True)
+            clean_partial_downloads(partial_directory,
+                                    PARTIAL_DOWNLOADS_MAX_AGE)
+        self.archive_fetcher = self.client = ArchiveFetcher(
+            temp_directory=self.temp_directory, cache=cache,
+            partial_directory=partial_directory,
+            max_resumes=self.config.get('download_resumes', 3))
+        if self.config.get('async_fetcher', False):
+            self.client = AsyncArchiveFetcher(
+                self.archive_fetcher,
+                range_workers=self.config.get('range_workers', 4),
+                range_size=self.config.get('range_size', 16 * 1024 * 1024))
+        self.admission = None
+        if self.config.get('admission_budget') or \
+           self.config.get('admission_large_size'):
+            self.admission = AdmissionControl(
+                os.path.join(self.working_dir, ADMISSION_BUDGET_FILENAME),
+                budget=self.config.get('admission_budget', 0),
+                large_size=self.config.get('admission_large_size', 0),
+                large_queue=self.config.get('admission_large_queue', ''),
+                wait=self.config.get('admission_wait', 0),
+                retry_delay=self.config.get('admission_retry_delay', 60),
+                session=self.archive_fetcher.session,
+                headers=self.archive_fetcher.params['headers'])
+
+
+class HashingMixin:
+    """Hashing of the contents: pool of workers, persistent cache of the
+       hashes and deduplication of the contents of an archive.
+
+    """
+    ADDITIONAL_CONFIG: Dict[str, Tuple[str, Any]] = {
+        # number of workers hashing the contents concurrently (0 to hash
+        # them sequentially), either threads or processes
+        'hash_workers': ('int', 0),
+        'hash_executor': ('string', 'thread'),
+        # persistent cache (in working_dir) of the hashes of the contents,
+        # shared by the loads of the worker, and its number of entries
+        'content_hash_cache': ('bool', False),
+        'content_hash_cache_size': ('int', 10 * 1000 * 1000),
+        # hash the contents held several times by an archive only once
+        'dedup_contents': ('bool', False),
+    }
+
+    def configure_hashing(self):
+        self.hash_workers = self.config.get('hash_workers', 0)
+        self.hash_executor = self.config.get('hash_executor', 'thread')
+        self.hash_cache = None
+        if self.config.get('content_hash_cache', False):
+            self.hash_cache = ContentHashCache(
+                os.path.join(self.working_dir, HASH_CACHE_FILENAME),
+                max_entries=self.config.get('content_hash_cache_size',
+                                            10 * 1000 * 1000))
+        self.dedup_contents = self.config.get('dedup_contents', False)
+
+    def executor_hash_cache(self, executor):
+        """Return the hash cache usable along with executor, if any (that
+           of the archive about to be built if `dedup_contents` is set).
+
+        """
+        if isinstance(executor, ProcessPoolExecutor):
+            # the cache cannot be shared with other processes
+            return None
+        if self.dedup_contents:
+            return ArchiveHashCache(parent=self.hash_cache)
+        return self.hash_cache
+
+
+class SendingMixin:
+    """Sending of the contents and directories: only the missing ones,
+       along the way (possibly from a background thread), and reading
+       the lazy contents when they are sent.
+
+    """
+    ADDITIONAL_CONFIG: Dict[str, Tuple[str, Any]] = {
+        # only collect the objects missing from the archive, pruning the
+        # already archived subtrees
+        'filter_missing_objects': ('bool', False),
+        # send the contents and directories while the tree is being built
+        # instead of holding them all in memory (this supersedes
+        # filter_missing_objects)
+        'flush_objects': ('bool', False),
+        # send the objects flushed along the way (cf. flush_objects) from
+        # a background thread while the next ones are being computed, at
+        # most send_queue_size packets waiting to be sent
+        'background_send': ('bool', False),
+        'send_queue_size': ('int', 2),
+    }
+
+    def configure_sending(self):
+        self.filter_missing_objects = self.config.get(
+            'filter_missing_objects', False)
+        self.flush_objects = self.config.get('flush_objects', False)
+        self.sender = None
+        if self.flush_objects and self.config.get('background_send', False):
+            self.sender = BackgroundSender(
+                max_pending=self.config.get('send_queue_size', 2))
+        self.content_packets = PacketBuffer(
+            lambda contents: self.send_packet(self.load_contents, contents),
+            max_count=self.config.get('content_packet_size', 10000),
+            max_size=self.config.get('content_packet_size_bytes'))
+        self.directory_packets = PacketBuffer(
+            lambda directories: self.send_packet(
+                self.maybe_load_directories, directories),
+            max_count=self.config.get('directory_packet_size', 25000))
+
+    def send_packet(self, send, objects):
+        """Send a packet of objects flushed along the way, from the
+           background sender if `background_send` is set.
+
+        """
+        if self.sender is None:
+            send(objects)
+        else:
+            self.sender.submit(send, objects)
+
+    def flush_directory(self, directory):
+        """Directory sink of the tree builders (cf. `flush_objects`).
+
+        The directories are only sent after all the contents produced so
+        far, so that an archived directory always references archived
+        contents.
+
+        """
+        self.content_packets.flush()
+        self.directory_packets.add(directory)
+
+    def sinks(self):
+        """Keyword arguments of the tree builders, handing over the
+           objects as soon as they are computed if `flush_objects` is set.
+
+        """
+        if not self.flush_objects:
+            return {}
+        return {
+            'content_sink': self.content_packets.add,
+            'directory_sink': self.flush_directory,
+        }
+
+    def load_contents(self, contents):
+        """Load contents in swh-storage if need be.
+
+        The data of the contents computed with `lazy_contents` is only
+        read from the archive if they are missing from swh-storage.
+
+        """
+        contents = list(contents)
+        lazy_contents = [c for c in contents if 'archive_offset' in c]
+        if not lazy_contents:
+            self.maybe_load_contents(contents)
+            return
+
+        self.maybe_load_contents(
+            [c for c in contents if 'archive_offset' not in c])
+        missing = filter_missing_contents(
+            self.storage, lazy_contents,
+            batch_size=self.config.get('content_packet_size', 10000))
+        # only hold one packet of data at a time
+        packets = PacketBuffer(
+            self.maybe_load_contents,
+            max_count=self.config.get('content_packet_size', 10000),
+            max_size=self.config.get('content_packet_size_bytes'))
+        for content in self.content_reader.read(missing):
+            packets.add(content)
+        packets.flush()
+
+    def send_missing_directories(self, directories):
+        """Send directories known to be missing from swh-storage, without
+           querying it again (after the contents buffered so far, which
+           they may reference).
+
+        """
+        if self.config['send_directories']:
+            self.send_batch_contents(self.contents.pop())
+            self.send_batch_directories(list(directories))
+
+
+class LimitsMixin:
+    """Extraction of the archives: limits of their expansion, contents too
+       large to be extracted and memory scratch space.
+
+    """
+    ADDITIONAL_CONFIG: Dict[str, Tuple[str, Any]] = {
+        # limits of the expansion of the archives (0 for no limit): bytes
+        # and number of their members, ratio of these bytes to the size
+        # of the archive, depth of their paths; the visit is aborted (with
+        # the 'aborted' load status) as soon as an archive exceeds one
+        'archive_max_bytes': ('int', 0),
+        'archive_max_members': ('int', 0),
+        'archive_max_ratio': ('int', 0),
+        'archive_max_depth': ('int', 0),
+        # extract the tarballs without the contents larger than
+        # content_size_limit, which are only hashed from the archive
+        # (instead of extracting everything with swh.core.tarball)
+        'skip_large_contents': ('bool', False),
+        # memory-backed directory (e.g. /dev/shm) where the archives are
+        # extracted within a budget of memory_scratch_size bytes (shared by
+        # the processes of the worker, 0 to disable it), their uncompressed
+        # size being estimated as memory_scratch_ratio times their size
+        # (the larger ones spill to working_dir)
+        'memory_scratch_dir': ('string', ''),
+        'memory_scratch_size': ('int', 0),
+        'memory_scratch_ratio': ('int', 4),
+    }
+
+    def configure_limits(self):
+        # the larger contents are archived as skipped contents by the
+        # core loader: they are only hashed, and their data never kept
+        self.max_content_size = self.config.get('content_size_limit')
+        self.skip_large_contents = self.config.get(
+            'skip_large_contents', False)
+        self.archive_limits = {
+            'max_bytes': self.config.get('archive_max_bytes', 0),
+            'max_members': self.config.get('archive_max_members', 0),
+            'max_ratio': self.config.get('archive_max_ratio', 0),
+            'max_depth': self.config.get('archive_max_depth', 0),
+        }
+        self.limit_exceeded = None
+        self.scratch = None
+        if self.config.get('memory_scratch_dir') and \
+           self.config.get('memory_scratch_size'):
+            self.scratch = MemoryScratch(
+                self.config['memory_scratch_dir'],
+                os.path.join(self.working_dir, SCRATCH_BUDGET_FILENAME),
+                self.config['memory_scratch_size'])
+        self.scratch_ratio = self.config.get('memory_scratch_ratio', 4)
+
+    def make_limits(self, size):
+        """Return the :class:`ArchiveLimits` of an archive of size bytes,
+           or None if no `archive_max_*` limit is set.
+
+        """
+        if not any(self.archive_limits.values()):
+            return None
+        return ArchiveLimits(compressed_size=size, **self.archive_limits)
+
+    @contextlib.contextmanager
+    def checking_limits(self, phase):
+        """Record the archive limit exceeded in the with block, if any
+           (counted in phase), to abort the visit.
+
+        """
+        try:
+            yield
+        except ArchiveLimitExceeded as e:
+            self.limit_exceeded = e
+            phase.count(limit_exceeded=1)
+            raise
+
+    def extract_archive(self, filepath, nature, size, limits, phase):
+        """Uncompress the archive at filepath (of size bytes) in
+           :attr:`dir_path`, moved to the memory scratch space if set
+           and the archive fits in it.
+
+        The uncompressed size of the archive is estimated as
+        `memory_scratch_ratio` times its size; the archives found to be
+        larger than that while being extracted (or from the central
+        directory of the zip archives) spill to the disk of the
+        `working_dir`.
+
+        Returns:
+            Tuple of (archive nature, dict of the skipped contents or
+            None, cf. :func:`extract_tarball`)
+
+        """
+        if self.scratch is not None:
+            scratch_size = size * self.scratch_ratio
+            path = self.scratch.reserve(scratch_size)
+            if path is not None:
+                disk_path, self.dir_path = self.dir_path, path
+                try:
+                    return self._extract_archive(
+                        filepath, nature, ScratchLimits(
+                            scratch_size, compressed_size=size,
+                            **self.archive_limits))
+                except ScratchFull as e:
+                    self.log.debug('Archive %s spilled to disk: %s',
+                                   filepath, e)
+                    phase.count(scratch_spills=1)
+                    self.scratch.discard(path)
+                    self.dir_path = disk_path
+        return self._extract_archive(filepath, nature, limits)
+
+    def _extract_archive(self, filepath, nature, limits):
+        max_content_size = self.max_content_size \
+            if self.skip_large_contents else None
+        if nature == 'tar' and (max_content_size or limits):
+            # the larger contents are not extracted, the limits are
+            # checked before each member is
+            skipped = extract_tarball(
+                filepath, self.dir_path, max_content_size,
+                external_decompression=self.external_decompression,
+                limits=limits)
+            return nature, skipped
+        if nature == 'zip' and limits is not None:
+            check_zipfile(filepath, limits)
+        return self.uncompress(filepath), None
+
+
+class MetricsMixin:
+    """Per-phase metrics of the visits (cf. :mod:`swh.loader.tar.metrics`).
+
+    """
+    ADDITIONAL_CONFIG: Dict[str, Tuple[str, Any]] = {
+        # per-phase metrics of the visits, sent to a statsd server
+        # (host:port) and/or written in a Prometheus textfile collector
+        # directory (disabled if empty); they are also logged
+        'metrics_statsd': ('string', ''),
+        'metrics_textfile_dir': ('string', ''),
+    }
+
+    def configure_metrics(self):
+        self.metrics_statsd = self.config.get('metrics_statsd', '')
+        self.metrics_textfile_dir = self.config.get('metrics_textfile_dir',
+                                                    '')
+        self.metrics = VisitMetrics()
+
+    def report_metrics(self):
+        """Log the metrics of the visit, and send or write them if
+           `metrics_statsd` or `metrics_textfile_dir` are set.
+
+        """
+        metrics = self.metrics
+        if not metrics.phases:
+            return
+        origin = getattr(self, 'origin', None) or {}
+        self.log.info('Metrics of the visit of %s: %s',
+                      origin.get('url'), metrics.summary(), extra={
+                          'swh_type': 'loader_tar_metrics',
+                          'swh_metrics': metrics.to_dict(),
+                      })
+        if self.metrics_statsd:
+            send_statsd(self.metrics_statsd, metrics)
+        if self.metrics_textfile_dir:
+            textfile_exporter(self.metrics_textfile_dir).export(metrics)
+
+
+class ProfilingMixin:
+    """Profiling of a sample of the visits (cf.
+       :mod:`swh.loader.tar.profiling`).
+
+    """
+    ADDITIONAL_CONFIG: Dict[str, Tuple[str, Any]] = {
+        # profile the visits with cProfile and/or tracemalloc, one visit
+        # out of profile_sampling, keeping the reports (in profile_dir,
+        # working_dir/profiles by default) of the visits lasting at least
+        # profile_min_duration seconds or loading at least
+        # profile_min_size bytes of archives
+        'profile_cpu': ('bool', False),
+        'profile_memory': ('bool', False),
+        'profile_dir': ('string', ''),
+        'profile_sampling': ('int', 1),
+        'profile_min_duration': ('int', 0),
+        'profile_min_size': ('int', 0),
+    }
+
+    def configure_profiling(self):
+        self.profile_cpu = self.config.get('profile_cpu', False)
+        self.profile_memory = self.config.get('profile_memory', False)
+        self.profile_dir = self.config.get('profile_dir') or os.path.join(
+            self.working_dir, 'profiles')
+        self.profile_sampling = self.config.get('profile_sampling', 1)
+        self.profile_min_duration = self.config.get('profile_min_duration',
+                                                    0)
+        self.profile_min_size = self.config.get('profile_min_size', 0)
+        self.profiler = None
+
+    def start_profiler(self):
+        """Return the profiler of the visit about to start, if it is to be
+           profiled (one visit out of `profile_sampling`).
+
+        """
+        if not (self.profile_cpu or self.profile_memory):
+            return None
+        if random.randrange(max(self.profile_sampling, 1)):
+            return None
+        return VisitProfiler(cpu=self.profile_cpu, memory=self.profile_memory)
+
+    def write_profile(self, profiler):
+        """Write the reports of the profiled visit in `profile_dir`, if it
+           lasted at least `profile_min_duration` seconds or loaded at
+           least `profile_min_size` bytes of archives.
+
+        """
+        size = sum(self.metrics.phases[name].counters['bytes_in']
+                   for name in ('download', 'pipeline')
+                   if name in self.metrics.phases)
+        if profiler.duration < self.profile_min_duration and \
+           size < self.profile_min_size:
+            return
+        origin_url = (getattr(self, 'origin', None) or {}).get('url', '')
+        visit = getattr(self, 'visit', None)
+        try:
+            os.makedirs(self.profile_dir, exist_ok=True)
+            paths = profiler.write_reports(
+                report_prefix(self.profile_dir, origin_url, visit),
+                header='Visit %s of %s (%s bytes of archives)' % (
+                    visit, origin_url, size))
+        except OSError as e:
+            self.log.warning('Failed to write the profile of the visit %s '
+                             'of %s: %s', visit, origin_url, e)
+            return
+        self.log.info('Profile of the visit %s of %s written to %s',
+                      visit, origin_url, ', '.join(paths))
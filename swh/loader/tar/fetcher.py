@@ -0,0 +1,323 @@
+# Copyright (C) 2015-2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Download of the remote/local artifacts.
+
+"""
+
+import hashlib
+import os
+import requests
+from typing import Dict
+from urllib.parse import urlparse
+
+from swh.model.hashutil import MultiHash, HASH_BLOCK_SIZE
+
+from .cache import link_or_copy
+from .partial import PartialDownload, range_validator
+
+try:
+    from _version import __version__  # type: ignore
+except ImportError:
+    __version__ = 'devel'
+
+
+# Size of the reads of the local artifacts
+LOCAL_CHUNK_SIZE = 1024 * 1024
+
+
+class LocalResponse:
+    """Local Response class with iter_content api
+
+    """
+    headers: Dict[str, str] = {}
+
+    def __init__(self, path):
+        self.path = path
+
+    def iter_content(self, chunk_size=None):
+        chunk_size = chunk_size or LOCAL_CHUNK_SIZE
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                yield chunk
+
+
+def hash_file(path):
+    """Compute the hashes of the file at path, with fixed-size reads into
+       a single buffer.
+
+    Returns:
+        dict of the hashes of path (along with its length), as
+        :meth:`MultiHash.hexdigest`
+
+    """
+    length = os.path.getsize(path)
+    h = MultiHash(length=length)
+    buffer = bytearray(LOCAL_CHUNK_SIZE)
+    view = memoryview(buffer)
+    read = 0
+    with open(path, 'rb', buffering=0) as f:
+        for size in iter(lambda: f.readinto(buffer), 0):
+            h.update(view[:size])
+            read += size
+    if read != length:
+        raise ValueError('Error when checking size: %s != %s' % (
+            length, read))
+    return {
+        'length': length,
+        **h.hexdigest()
+    }
+
+
+class ArchiveFetcher:
+    """Http/Local client in charge of downloading archives from a
+       remote/local server.
+
+    Args:
+        temp_directory (str): Path to the temporary disk location used
+                              for downloading the release artifacts
+        cache (ArtifactCache): Optional cache of the remote artifacts,
+                               revalidated before being used
+        partial_directory (str): Optional path where the interrupted
+                                 downloads are kept to be resumed later
+        max_resumes (int): Number of times an interrupted download is
+                           resumed before giving up
+
+    """
+    def __init__(self, temp_directory=None, cache=None,
+                 partial_directory=None, max_resumes=3):
+        self.temp_directory = temp_directory
+        self.cache = cache
+        self.partial_directory = partial_directory
+        self.max_resumes = max_resumes
+        self.session = requests.session()
+        self.params = {
+            'headers': {
+                'User-Agent': 'Software Heritage Tar Loader (%s)' % (
+                    __version__
+                )
+            }
+        }
+
+    def _open(self, url, use_cache=True):
+        """Open url, possibly from the cache (if use_cache is set).
+
+        Returns:
+            Tuple of (response, announced length, cache entry if the
+            response comes from the cache)
+
+        """
+        url_parsed = urlparse(url)
+        if url_parsed.scheme == 'file':
+            path = url_parsed.path
+            return LocalResponse(path), os.path.getsize(path), None
+
+        entry = None
+        if self.cache is not None and use_cache:
+            entry = self.cache.get(url)
+        headers = self.params['headers']
+        if entry is not None:
+            headers = {**headers, **self.cache.validators(entry)}
+        response = self.session.get(url, headers=headers, stream=True)
+        if entry is not None and response.status_code == 304:
+            response.close()
+            return (LocalResponse(entry['path']), entry['hashes']['length'],
+                    entry)
+        if response.status_code != 200:
+            raise ValueError("Fail to query '%s'. Reason: %s" % (
+                url, response.status_code))
+        return response, int(response.headers['content-length']), None
+
+    def stream(self, url):
+        """Open the remote tarball url for streaming.
+
+        Transfers interrupted by a connection failure are resumed (at
+        most `max_resumes` times) with range requests, as :meth:`download`
+        does, if the server supports them and the artifact did not change
+        meanwhile.
+
+        Args:
+            url (str): Url (file or http*)
+
+        Raises:
+            ValueError in case of failing to query, or to resume the
+            transfer
+
+        Returns:
+            Tuple of (iterable of the chunks of the tarball, announced
+            length)
+
+        """
+        response, length, _ = self._open(url)
+        return self._iter_chunks(url, response, length), length
+
+    def _iter_chunks(self, url, response, length):
+        validator = range_validator(response.headers)
+        received = 0
+        resumes = 0
+        while True:
+            try:
+                for chunk in response.iter_content(
+                        chunk_size=HASH_BLOCK_SIZE):
+                    received += len(chunk)
+                    yield chunk
+            except requests.exceptions.RequestException as e:
+                if resumes >= self.max_resumes:
+                    raise ValueError('Fail to download %s. Reason: %s' % (
+                        url, e))
+            else:
+                if received >= length or resumes >= self.max_resumes:
+                    return
+            resumes += 1
+            response = self._request_rest(url, received, length, validator)
+            if response is None:
+                # the chunks already streamed cannot be taken back
+                raise ValueError('Fail to resume the download of %s' % url)
+
+    def download(self, url, directory=None):
+        """Download the remote tarball url locally.
+
+        Transfers interrupted by a connection failure are resumed (at
+        most `max_resumes` times) with range requests, if the server
+        supports them and the artifact did not change meanwhile. When
+        `partial_directory` is set, the partial downloads are kept there
+        for a later attempt to resume them.
+
+        Local tarballs (file urls) are not copied: they are only hashed,
+        and used in place.
+
+        Args:
+            url (str): Url (file or http*)
+            directory (str): where to download the (remote) tarball,
+              defaults to :attr:`temp_directory`
+
+        Raises:
+            ValueError in case of failing to query
+
+        Returns:
+            Tuple of local (filepath, hashes of filepath)
+
+        """
+        url_parsed = urlparse(url)
+        if url_parsed.scheme == 'file':
+            return url_parsed.path, hash_file(url_parsed.path)
+
+        filepath = os.path.join(directory or self.temp_directory,
+                                os.path.basename(url))
+        partial = self._partial_download(url, filepath)
+        try:
+            response = None
+            if partial.size and partial.metadata.get('url') == url:
+                response = self._resume(url, partial)
+            if response is not None:
+                length = partial.metadata['length']
+            else:
+                response, length, entry = self._open(url)
+                if entry is not None:
+                    link_or_copy(entry['path'], filepath)
+                    return filepath, entry['hashes']
+                partial.start(url, length, response.headers)
+            hashes = self._write(url, response, length, partial)
+            partial.finish(filepath)
+        finally:
+            partial.close()
+
+        if self.cache is not None:
+            self.cache.add(url, filepath, hashes=hashes,
+                           headers=response.headers)
+        return filepath, hashes
+
+    def _partial_download(self, url, filepath):
+        """Return the partial download of url, kept in `partial_directory`
+           if set (and not locked by another process), or next to
+           filepath otherwise.
+
+        """
+        if self.partial_directory is not None:
+            path = os.path.join(self.partial_directory, hashlib.sha1(
+                url.encode('utf-8')).hexdigest())
+            try:
+                return PartialDownload(path)
+            except BlockingIOError:
+                # the artifact is being downloaded by another process
+                pass
+        return PartialDownload(filepath + '.part')
+
+    def _resume(self, url, partial):
+        """Request the rest of the partially downloaded artifact url.
+
+        Returns:
+            the response to the range request, or None if the download
+            must restart from scratch (the server does not support range
+            requests, or the artifact changed)
+
+        """
+        return self._request_rest(url, partial.size,
+                                  partial.metadata.get('length'),
+                                  partial.metadata.get('validator'))
+
+    def _request_rest(self, url, offset, length, validator):
+        """Request the bytes of the artifact url (of length bytes) from
+           offset, if it is still the version of validator.
+
+        Returns:
+            the response to the range request, or None if the server does
+            not support range requests, or the artifact changed
+
+        """
+        if not validator or offset >= length:
+            return None
+        headers = {
+            **self.params['headers'],
+            'Range': 'bytes=%s-' % offset,
+            'If-Range': validator,
+        }
+        response = self.session.get(url, headers=headers, stream=True)
+        content_range = 'bytes %s-%s/%s' % (offset, length - 1, length)
+        if response.status_code == 206 and \
+           response.headers.get('Content-Range') == content_range:
+            return response
+        response.close()
+        return None
+
+    def _write(self, url, response, length, partial):
+        """Write the artifact url to partial, resuming the transfer of
+           response if it fails.
+
+        Returns:
+            the hashes of the artifact
+
+        """
+        h = MultiHash(length=length)
+        partial.update_hash(h)
+        resumes = 0
+        while True:
+            try:
+                for chunk in response.iter_content(
+                        chunk_size=HASH_BLOCK_SIZE):
+                    h.update(chunk)
+                    partial.write(chunk)
+            except requests.exceptions.RequestException as e:
+                if resumes >= self.max_resumes:
+                    raise ValueError('Fail to download %s. Reason: %s' % (
+                        url, e))
+            else:
+                if partial.size >= length or resumes >= self.max_resumes:
+                    break
+            resumes += 1
+            response = self._resume(url, partial)
+            if response is None:
+                response, length, _ = self._open(url, use_cache=False)
+                partial.start(url, length, response.headers)
+                h = MultiHash(length=length)
+
+        actual_length = partial.size
+        if length != actual_length:
+            raise ValueError('Error when checking size: %s != %s' % (
+                length, actual_length))
+        return {
+            'length': length,
+            **h.hexdigest()
+        }
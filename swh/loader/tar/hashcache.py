@@ -0,0 +1,179 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Persistent cache of the hashes of the contents, shared by the loads
+of a worker.
+
+Consecutive releases of a project share most of their files: the cache
+maps a fingerprint of a content (its length and a single 128-bit BLAKE2b
+digest) to its full set of hashes, so that each of these files is only
+hashed once with all the algorithms of the archive.
+
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+
+from swh.model.hashutil import DEFAULT_ALGORITHMS, MultiHash
+
+
+logger = logging.getLogger(__name__)
+
+# Contents smaller than this are cheaper to hash than to look up
+MIN_LENGTH = 4096
+
+# Number of pending updates of the cache after which they are written, in
+# a single short transaction
+COMMIT_INTERVAL = 1000
+
+# Time (in seconds) waited for the database locked by another worker,
+# after which the cache is skipped
+LOCK_TIMEOUT = 0.1
+
+ALGORITHMS = sorted(DEFAULT_ALGORITHMS)
+
+
+def fingerprint(data):
+    """Compute the key of data in the cache."""
+    return len(data).to_bytes(8, 'big') + hashlib.blake2b(
+        data, digest_size=16).digest()
+
+
+class ContentHashCache:
+    """Persistent (SQLite) cache of the hashes of the contents.
+
+    The cache is best-effort: it can be shared by several workers, and
+    failing to read or update it (e.g. when it is locked by another
+    worker) does not fail the load. The updates (new entries and the
+    last use of the entries found) are kept in memory, then written in
+    a single transaction every COMMIT_INTERVAL updates, so that the
+    database is only locked briefly. It can be used from several threads.
+
+    Args:
+        path (str): path to the SQLite database
+        max_entries (int): number of entries kept (the least recently
+          used ones are evicted by :meth:`flush`)
+
+    """
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # fingerprint -> (hashes, last use) of the new entries
+        self.added = {}
+        # fingerprint -> last use of the entries found
+        self.used = {}
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute(
+            'CREATE TABLE IF NOT EXISTS content_hashes ('
+            'fingerprint BLOB PRIMARY KEY, %s, last_used INTEGER NOT NULL)' %
+            ', '.join('%s BLOB NOT NULL' % algo for algo in ALGORITHMS))
+        self.db.execute(
+            'CREATE INDEX IF NOT EXISTS content_hashes_last_used '
+            'ON content_hashes (last_used)')
+        self.db.commit()
+        # the schema is set up, the cache is now skipped on contention
+        self.db.execute('PRAGMA busy_timeout = %d' % (LOCK_TIMEOUT * 1000))
+
+    def _write(self):
+        """Write the pending updates in a single transaction, dropping
+           them if the database is locked (the lock must be held)."""
+        added, self.added = self.added, {}
+        used, self.used = self.used, {}
+        if not added and not used:
+            return
+        try:
+            self.db.executemany(
+                'INSERT OR REPLACE INTO content_hashes '
+                '(fingerprint, %s, last_used) VALUES (?, %s, ?)' % (
+                    ', '.join(ALGORITHMS), ', '.join('?' * len(ALGORITHMS))),
+                [(key, *(hashes[algo] for algo in ALGORITHMS), last_used)
+                 for key, (hashes, last_used) in added.items()])
+            self.db.executemany(
+                'UPDATE content_hashes SET last_used = ? '
+                'WHERE fingerprint = ?',
+                [(last_used, key) for key, last_used in used.items()])
+            self.db.commit()
+        except sqlite3.OperationalError as e:
+            logger.warning('Failed to update the hash cache %s: %s',
+                           self.path, e)
+            self.db.rollback()
+
+    def _updated(self):
+        """Write the pending updates if there are enough of them (the lock
+           must be held)."""
+        if len(self.added) + len(self.used) >= COMMIT_INTERVAL:
+            self._write()
+
+    def get(self, key):
+        """Return the hashes cached for the fingerprint key, if any."""
+        with self.lock:
+            if key in self.added:
+                hashes, _ = self.added[key]
+                self.added[key] = (hashes, int(time.time()))
+                return dict(hashes)
+            try:
+                row = self.db.execute(
+                    'SELECT %s FROM content_hashes WHERE fingerprint = ?' %
+                    ', '.join(ALGORITHMS), (key,)).fetchone()
+            except sqlite3.OperationalError as e:
+                logger.debug('Failed to read the hash cache %s: %s',
+                             self.path, e)
+                return None
+            if row is None:
+                return None
+            self.used[key] = int(time.time())
+            self._updated()
+        return dict(zip(ALGORITHMS, row))
+
+    def add(self, key, hashes):
+        """Cache the hashes of the content with fingerprint key."""
+        with self.lock:
+            self.added[key] = (dict(hashes), int(time.time()))
+            self._updated()
+
+    def hashes(self, data):
+        """Compute the hashes of data, or retrieve them from the cache.
+
+        Returns:
+            dict of the hashes of data, as :meth:`MultiHash.digest`
+
+        """
+        if len(data) < MIN_LENGTH:
+            return MultiHash.from_data(data).digest()
+        key = fingerprint(data)
+        hashes = self.get(key)
+        if hashes is None:
+            hashes = MultiHash.from_data(data).digest()
+            self.add(key, hashes)
+        return hashes
+
+    def flush(self):
+        """Write the pending updates, and evict the least recently used
+           entries exceeding max_entries.
+
+        """
+        with self.lock:
+            self._write()
+            try:
+                self.db.execute(
+                    'DELETE FROM content_hashes WHERE fingerprint IN ('
+                    'SELECT fingerprint FROM content_hashes '
+                    'ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                    (self.max_entries,))
+                self.db.commit()
+            except sqlite3.OperationalError as e:
+                logger.warning('Failed to flush the hash cache %s: %s',
+                               self.path, e)
+                self.db.rollback()
+
+    def close(self):
+        """Flush the cache and close the database."""
+        self.flush()
+        self.db.close()
@@ -0,0 +1,127 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Concurrent hashing of the files of an uncompressed archive.
+
+:func:`directory_from_disk` computes the same model as
+:meth:`swh.model.from_disk.Directory.from_disk`, but hashes the files in
+a pool of workers: threads (hashlib releases the GIL while hashing large
+buffers) or processes (better suited to trees of many small files).
+
+"""
+
+import os
+import stat
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from swh.model.from_disk import Content, mode_to_perms
+
+from .stream import (
+    SKIPPED_REASON, SKIPPED_STATUS, DirectoryBuilder, is_oversized
+)
+
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+
+def make_executor(kind, workers):
+    """Instantiate the pool of workers hashing the contents.
+
+    Args:
+        kind (str): either 'thread' or 'process'
+        workers (int): number of workers of the pool
+
+    Returns:
+        the :class:`concurrent.futures.Executor`, or None if workers is 0
+        (the contents are then hashed sequentially)
+
+    """
+    if not workers:
+        return None
+    if kind not in EXECUTORS:
+        raise ValueError('Unknown hashing executor %r, expected one of %s' % (
+            kind, ', '.join(sorted(EXECUTORS))))
+    return EXECUTORS[kind](max_workers=workers)
+
+
+def content_data_from_file(path, hash_cache=None, max_content_size=None):
+    """Compute the data of the :class:`Content` at path (without the
+       file's data, but with its path), possibly looking up the hashes of
+       regular files in hash_cache.
+
+    The regular files larger than max_content_size (if set) are marked
+    as skipped contents (and never read at once).
+
+    """
+    file_stat = os.lstat(path)
+    mode = file_stat.st_mode
+    if stat.S_ISREG(mode) and \
+       is_oversized(file_stat.st_size, max_content_size):
+        ret = Content.from_file(path=path, save_path=True).data
+        ret['status'] = SKIPPED_STATUS
+        ret['reason'] = SKIPPED_REASON
+        return ret
+    if hash_cache is None or not stat.S_ISREG(mode):
+        return Content.from_file(path=path, save_path=True).data
+    with open(path, 'rb') as f:
+        data = f.read()
+    ret = hash_cache.hashes(data)
+    ret['path'] = path
+    ret['perms'] = mode_to_perms(mode)
+    ret['length'] = len(data)
+    return ret
+
+
+def directory_from_disk(path, executor=None, content_sink=None,
+                        directory_sink=None, hash_cache=None,
+                        max_content_size=None, contents=None):
+    """Compute the :class:`Directory` model of the tree at path, hashing
+       its files in executor.
+
+    Args:
+        path (bytes): the directory to traverse
+        executor (concurrent.futures.Executor): the pool hashing the
+          files, if None they are hashed sequentially
+        content_sink (callable): called with the data of each content
+        directory_sink (callable): called with the data of each directory
+        hash_cache (ContentHashCache): optional cache of the hashes of
+          the files (it cannot be shared with a pool of processes)
+        max_content_size (int): size from which the files are marked as
+          skipped contents
+        contents (dict): relative path (bytes) -> data of the contents
+          of the tree left out of path (cf.
+          :func:`swh.loader.tar.extract.extract_tarball`)
+
+    Returns:
+        the :class:`Directory` holding the tree
+
+    """
+    builder = DirectoryBuilder(content_sink=content_sink,
+                               directory_sink=directory_sink)
+    path = path.rstrip(b'/')
+    prefix_length = len(path) + 1
+    for root, dentries, fentries in os.walk(path):
+        relative_root = root[prefix_length:]
+        # symbolic links to directories appear in dentries
+        for name in fentries + dentries:
+            entry_path = os.path.join(root, name)
+            relative_path = os.path.join(relative_root, name)
+            if os.path.isdir(entry_path) and not os.path.islink(entry_path):
+                builder.add_directory(relative_path)
+            elif executor is not None:
+                builder.add_content(relative_path, executor.submit(
+                    content_data_from_file, entry_path, hash_cache,
+                    max_content_size))
+            else:
+                builder.add_content(relative_path, Content(
+                    content_data_from_file(entry_path, hash_cache,
+                                           max_content_size)))
+    for relative_path, data in (contents or {}).items():
+        builder.add_content(relative_path, Content(data))
+    return builder.build()
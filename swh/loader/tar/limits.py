@@ -0,0 +1,96 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Limits of the expansion of the archives.
+
+Hostile or broken archives (decompression bombs, archives of millions of
+tiny files or of absurdly deep trees) can expand into much more data or
+inodes than a worker can afford. Their members are accounted for from
+their headers while the archive is read, so that the visit is aborted as
+soon as a limit is exceeded, before the member exceeding it is expanded.
+
+"""
+
+
+# Number of uncompressed bytes below which the compression ratio of an
+# archive is not checked (small archives of repetitive data are common)
+RATIO_MIN_BYTES = 1024 * 1024
+
+
+class ArchiveLimitExceeded(ValueError):
+    """An archive exceeds one of its :class:`ArchiveLimits`.
+
+    Args:
+        limit (str): name of the exceeded limit
+        value (int): value reached by the archive
+        maximum (int): the limit
+
+    """
+    def __init__(self, limit, value, maximum):
+        super().__init__('Archive exceeding its %s limit (%s > %s)' % (
+            limit, value, maximum))
+        self.limit = limit
+        self.value = value
+        self.maximum = maximum
+
+
+class ArchiveLimits:
+    """Limits of the expansion of an archive (0 for no limit).
+
+    Args:
+        max_bytes (int): uncompressed bytes of the members
+        max_members (int): number of members
+        max_ratio (int): ratio of the uncompressed bytes to the size of
+          the (compressed) archive
+        max_depth (int): depth of the members' paths
+        compressed_size (int): size of the archive, if known (for the
+          compression ratio)
+
+    """
+    def __init__(self, max_bytes=0, max_members=0, max_ratio=0, max_depth=0,
+                 compressed_size=None):
+        self.max_bytes = max_bytes
+        self.max_members = max_members
+        self.max_ratio = max_ratio
+        self.max_depth = max_depth
+        self.compressed_size = compressed_size
+        self.bytes = 0
+        self.members = 0
+
+    def add_member(self, path, size=0):
+        """Account for a member of the archive, before it is expanded.
+
+        Args:
+            path (bytes): relative path of the member
+            size (int): uncompressed size of the member (from its header)
+
+        Raises:
+            ArchiveLimitExceeded if the archive exceeds a limit
+
+        """
+        self.members += 1
+        if self.max_members and self.members > self.max_members:
+            raise ArchiveLimitExceeded('members', self.members,
+                                       self.max_members)
+        depth = len(path.split(b'/'))
+        if self.max_depth and depth > self.max_depth:
+            raise ArchiveLimitExceeded('depth', depth, self.max_depth)
+        self.add_bytes(size)
+
+    def add_bytes(self, size):
+        """Account for size more uncompressed bytes.
+
+        Raises:
+            ArchiveLimitExceeded if the archive exceeds a limit
+
+        """
+        self.bytes += size
+        if self.max_bytes and self.bytes > self.max_bytes:
+            raise ArchiveLimitExceeded('bytes', self.bytes, self.max_bytes)
+        if self.max_ratio and self.compressed_size and \
+           self.bytes >= RATIO_MIN_BYTES:
+            ratio = self.bytes // self.compressed_size
+            if ratio > self.max_ratio:
+                raise ArchiveLimitExceeded('ratio', ratio, self.max_ratio)
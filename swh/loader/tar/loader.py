@@ -4,111 +4,62 @@
 # See top-level LICENSE file for more information
 
 
+import collections
 import os
 import tempfile
-import requests
 import shutil
 from urllib.parse import urlparse
 
+from concurrent.futures import ThreadPoolExecutor
 from tempfile import mkdtemp
 
 from swh.core import tarball
 from swh.loader.core.loader import BufferedLoader
 from swh.loader.dir.loader import revision_from, snapshot_from
-from swh.model.hashutil import MultiHash, HASH_BLOCK_SIZE
+from swh.model.hashutil import hash_to_hex
 from swh.model.from_disk import Directory
 
-from .build import compute_revision, set_original_artifact
-
-try:
-    from _version import __version__  # type: ignore
-except ImportError:
-    __version__ = 'devel'
+from .build import compute_revision, compute_snapshot, set_original_artifact
+from .dedup import ArchiveHashCache
+from .decompress import (
+    detect_file_compression, external_command, uncompress_to
+)
+from .features import (
+    FetchingMixin, HashingMixin, LimitsMixin, MetricsMixin, ProfilingMixin,
+    SendingMixin
+)
+from .hashing import directory_from_disk, make_executor
+from .metrics import VisitMetrics
+from .missing import collect_missing
+from .pipeline import directory_from_chunks
+from .readers import find_reader
+from .stream import ContentReader
 
 
 TEMPORARY_DIR_PREFIX_PATTERN = 'swh.loader.tar.'
 DEBUG_MODE = '** DEBUG MODE **'
+# Settings relying on whole downloaded artifacts, which the pipelined
+# archives are not
+PIPELINE_INCOMPATIBLE_CONFIG = [
+    'download_cache_dir', 'skip_known_artifacts', 'keep_partial_downloads',
+]
 
 
-class LocalResponse:
-    """Local Response class with iter_content api
-
-    """
-    def __init__(self, path):
-        self.path = path
-
-    def iter_content(self, chunk_size=None):
-        with open(self.path, 'rb') as f:
-            for chunk in f:
-                yield chunk
-
-
-class ArchiveFetcher:
-    """Http/Local client in charge of downloading archives from a
-       remote/local server.
-
-    Args:
-        temp_directory (str): Path to the temporary disk location used
-                              for downloading the release artifacts
+class ArchivedDirectory:
+    """Stand-in for the :class:`Directory` of an already archived
+       artifact: only its identifier is known, and none of its objects
+       need to be sent again.
 
     """
-    def __init__(self, temp_directory=None):
-        self.temp_directory = temp_directory
-        self.session = requests.session()
-        self.params = {
-            'headers': {
-                'User-Agent': 'Software Heritage Tar Loader (%s)' % (
-                    __version__
-                )
-            }
-        }
-
-    def download(self, url):
-        """Download the remote tarball url locally.
-
-        Args:
-            url (str): Url (file or http*)
+    def __init__(self, hash):
+        self.hash = hash
 
-        Raises:
-            ValueError in case of failing to query
+    def collect(self):
+        return {}
 
-        Returns:
-            Tuple of local (filepath, hashes of filepath)
 
-        """
-        url_parsed = urlparse(url)
-        if url_parsed.scheme == 'file':
-            path = url_parsed.path
-            response = LocalResponse(path)
-            length = os.path.getsize(path)
-        else:
-            response = self.session.get(url, **self.params, stream=True)
-            if response.status_code != 200:
-                raise ValueError("Fail to query '%s'. Reason: %s" % (
-                    url, response.status_code))
-            length = int(response.headers['content-length'])
-
-        filepath = os.path.join(self.temp_directory, os.path.basename(url))
-
-        h = MultiHash(length=length)
-        with open(filepath, 'wb') as f:
-            for chunk in response.iter_content(chunk_size=HASH_BLOCK_SIZE):
-                h.update(chunk)
-                f.write(chunk)
-
-        actual_length = os.path.getsize(filepath)
-        if length != actual_length:
-            raise ValueError('Error when checking size: %s != %s' % (
-                length, actual_length))
-
-        hashes = {
-            'length': length,
-            **h.hexdigest()
-        }
-        return filepath, hashes
-
-
-class BaseTarLoader(BufferedLoader):
+class BaseTarLoader(FetchingMixin, HashingMixin, SendingMixin, LimitsMixin,
+                    MetricsMixin, ProfilingMixin, BufferedLoader):
     """Base Tarball Loader class.
 
     This factorizes multiple loader implementations:
@@ -120,36 +71,171 @@ class BaseTarLoader(BufferedLoader):
          local archive. It also was only passing along objects to
          persist (revision, etc...)
 
+    The optional features (and their settings) are grouped by concern in
+    the mixins of :mod:`swh.loader.tar.features`.
+
     """
     CONFIG_BASE_FILENAME = 'loader/tar'
 
     ADDITIONAL_CONFIG = {
         'working_dir': ('string', '/tmp'),
         'debug': ('bool', False),  # NOT FOR PRODUCTION
+        # compute the tarball's objects without extracting it on disk
+        'stream_archive': ('bool', False),
+        # overlap the download, decompression and hashing of remote
+        # tarballs (local ones are read in place); as they are neither
+        # kept nor known before being read, this cannot be combined with
+        # download_cache_dir, skip_known_artifacts and
+        # keep_partial_downloads
+        'pipeline_archive': ('bool', False),
+        'pipeline_queue_size': ('int', 16),
+        # reuse the directory of an already archived identical artifact
+        'skip_known_artifacts': ('bool', False),
+        # only keep the offset of the tarball members when streaming
+        # archives, their data being read when they are sent (and only if
+        # they are missing from the archive)
+        'lazy_contents': ('bool', False),
+        # uncompress the tarballs with external (multi-threaded) tools
+        # such as pigz, xz or zstd when installed, instead of the python
+        # codecs
+        'external_decompression': ('bool', False),
+        **FetchingMixin.ADDITIONAL_CONFIG,
+        **HashingMixin.ADDITIONAL_CONFIG,
+        **SendingMixin.ADDITIONAL_CONFIG,
+        **LimitsMixin.ADDITIONAL_CONFIG,
+        **MetricsMixin.ADDITIONAL_CONFIG,
+        **ProfilingMixin.ADDITIONAL_CONFIG,
     }
 
     visit_type = 'tar'
+    # whether the archives are fetched by :meth:`fetch_archive`, which
+    # honors `pipeline_archive`
+    can_pipeline_archive = True
 
     def __init__(self, logging_class='swh.loader.tar.TarLoader', config=None):
         super().__init__(logging_class=logging_class, config=config)
         self.local_cache = None
         self.dir_path = None
         working_dir = self.config.get('working_dir', tempfile.gettempdir())
-        os.makedirs(working_dir, exist_ok=True)
+        os.makedirs(working_dir, 0o755, exist_ok=True)
+        self.working_dir = working_dir
+        self.make_temp_directories()
+        self.visits = 0
+        self.debug = self.config.get('debug', False)
+        self.stream_archive = self.config.get('stream_archive', False)
+        self.pipeline_archive = self.can_pipeline_archive and \
+            self.config.get('pipeline_archive', False)
+        if self.pipeline_archive:
+            incompatible = [key for key in PIPELINE_INCOMPATIBLE_CONFIG
+                            if self.config.get(key)]
+            if incompatible:
+                raise ValueError(
+                    'pipeline_archive cannot be combined with %s' % (
+                        ', '.join(incompatible)))
+        self.pipeline_queue_size = self.config.get('pipeline_queue_size', 16)
+        self.skip_known_artifacts = self.config.get(
+            'skip_known_artifacts', False)
+        self.lazy_contents = self.config.get('lazy_contents', False)
+        self.external_decompression = self.config.get(
+            'external_decompression', False)
+        self.content_reader = None
+        self.configure_fetching()
+        self.configure_hashing()
+        self.configure_sending()
+        self.configure_limits()
+        self.configure_metrics()
+        self.configure_profiling()
+
+    def make_temp_directories(self):
+        """Create the temporary directories of a visit (removed by
+           :meth:`cleanup`).
+
+        """
         self.temp_directory = mkdtemp(
             suffix='-%s' % os.getpid(),
             prefix=TEMPORARY_DIR_PREFIX_PATTERN,
-            dir=working_dir)
-        self.client = ArchiveFetcher(temp_directory=self.temp_directory)
-        os.makedirs(working_dir, 0o755, exist_ok=True)
+            dir=self.working_dir)
         self.dir_path = tempfile.mkdtemp(prefix='swh.loader.tar-',
                                          dir=self.temp_directory)
-        self.debug = self.config.get('debug', False)
+
+    def reset(self):
+        """Reset the state left by the previous visit, if any, so that
+           the loader (along with its configuration, storage client, http
+           session, ...) can be reused for another visit (cf.
+           :mod:`swh.loader.tar.pool`).
+
+        """
+        if self.visits:
+            self.make_temp_directories()
+            self.archive_fetcher.temp_directory = self.temp_directory
+            counters = getattr(self, 'counters', None) or {}
+            for key in counters:
+                counters[key] = 0
+            # the objects buffered or seen by the previous visit (which
+            # may have failed before sending them) are forgotten
+            for objects in (self.contents, self.directories,
+                            self.revisions, self.releases):
+                objects.reset()
+            for seen in (self.contents_seen, self.directories_seen,
+                         self.revisions_seen, self.releases_seen):
+                seen.clear()
+            self.snapshot = None
+            self.content_packets.clear()
+            self.directory_packets.clear()
+        self.visits += 1
+        self.content_reader = None
+        self.objects = None
+        self.limit_exceeded = None
+        self.metrics = VisitMetrics()
+
+    def load(self, *args, **kwargs):
+        """Load the origin, profiling the visit if `profile_cpu` or
+           `profile_memory` are set (cf. :meth:`start_profiler`).
+
+        Returns:
+            the load status, whose status is 'aborted' (instead of
+            'failed') if an archive exceeded its limits
+
+        """
+        self.reset()
+        self.profiler = self.start_profiler()
+        if self.profiler is None:
+            result = super().load(*args, **kwargs)
+        else:
+            try:
+                with self.profiler.profile():
+                    result = super().load(*args, **kwargs)
+            finally:
+                self.write_profile(self.profiler)
+                self.profiler = None
+        if self.limit_exceeded is not None:
+            # loading the same archive again would fail the same way
+            return {
+                'status': 'aborted',
+                'reason': str(self.limit_exceeded),
+            }
+        return result
+
+    def flush(self):
+        if self.sender is not None:
+            # packets are still queued if the visit failed while they
+            # were being sent: they are dropped (once the one being sent
+            # is done) before the buffers are sent from this thread
+            self.sender.discard()
+        with self.metrics.phase('store_flush'):
+            super().flush()
 
     def cleanup(self):
         """Clean up temporary disk folders used.
 
         """
+        self.report_metrics()
+        self.content_reader = None
+        if self.hash_cache is not None:
+            self.hash_cache.flush()
+        if self.scratch is not None:
+            # the memory is given back, even in debug mode
+            self.scratch.release()
         if self.debug:
             self.log.warn('%s Will not clean up temp dir %s' % (
                 DEBUG_MODE, self.temp_directory
@@ -180,47 +266,306 @@ class BaseTarLoader(BufferedLoader):
         """
         raise NotImplementedError()
 
-    def fetch_data(self):
-        """Retrieve, uncompress archive and fetch objects from the tarball.
-           The actual ingestion takes place in the :meth:`store_data`
-           implementation below.
+    def build_directory(self, filepath):
+        """Compute the directory model of the archive at filepath.
+
+        When `stream_archive` is set, the archives handled by a reader
+        (cf. :mod:`swh.loader.tar.readers`: tarballs, zip archives and
+        single compressed files) are read without being extracted and
+        their tree is assembled in memory (along with the data of their
+        contents, unless `lazy_contents` is set and the reader supports
+        it). Otherwise, the archive is uncompressed in :attr:`dir_path`
+        which is then walked; single compressed files, which cannot be
+        uncompressed that way, are always read in memory.
+
+        In both cases, the contents are hashed by a pool of
+        `hash_workers` workers if set, and the objects are sent as soon
+        as they are computed if `flush_objects` is set. Their hashes are
+        looked up in the `content_hash_cache` if set, and the contents
+        held several times by the archive are only hashed once if
+        `dedup_contents` is set.
+
+        When `external_decompression` is set, compressed tarballs are
+        uncompressed by an external tool (if one is installed) instead
+        of the python codecs.
+
+        The contents larger than `content_size_limit` (archived as skipped
+        contents) are hashed in a single pass without keeping their data,
+        and are not extracted from the tarballs if `skip_large_contents`
+        is set.
+
+        The `archive_max_*` limits are checked while the archive is read
+        or extracted (from the central directory of the zip archives,
+        before they are extracted).
+
+        The archives are extracted in the `memory_scratch_dir` if set and
+        they fit in its budget (cf. :meth:`extract_archive`).
+
+        Raises:
+            ArchiveLimitExceeded as soon as the archive exceeds its limits
+
+        Returns:
+            Tuple of (archive nature, :class:`Directory`)
 
         """
-        url = self.get_tarball_url_to_retrieve()
-        filepath, hashes = self.client.download(url)
-        nature = tarball.uncompress(filepath, self.dir_path)
+        executor = make_executor(self.hash_executor, self.hash_workers)
+        hash_cache = self.executor_hash_cache(executor)
+        try:
+            external = self.external_decompression
+            size = os.path.getsize(filepath)
+            limits = self.make_limits(size)
+            nature, reader = find_reader(filepath, external)
+            if reader is not None and (self.stream_archive or
+                                       not reader.extractable):
+                lazy = self.lazy_contents and reader.lazy
+                if lazy:
+                    self.content_reader = ContentReader(
+                        filepath, external_decompression=external)
+                with self.metrics.phase('build') as phase, \
+                        self.checking_limits(phase):
+                    phase.count(bytes_in=size)
+                    directory = reader.directory(
+                        filepath, executor=executor, lazy=lazy,
+                        external_decompression=external,
+                        hash_cache=hash_cache,
+                        max_content_size=self.max_content_size,
+                        limits=limits, **self.sinks())
+                    if isinstance(hash_cache, ArchiveHashCache):
+                        phase.count(**hash_cache.counters())
+                    return nature, directory
+
+            with self.metrics.phase('uncompress') as phase, \
+                    self.checking_limits(phase):
+                phase.count(bytes_in=size)
+                nature, skipped = self.extract_archive(
+                    filepath, nature, size, limits, phase)
+                if skipped is not None:
+                    phase.count(skipped_contents=len(skipped))
+            dir_path = self.dir_path.encode('utf-8')
+            with self.metrics.phase('build') as phase:
+                if executor is None and not self.flush_objects and \
+                   hash_cache is None and not skipped:
+                    return nature, Directory.from_disk(path=dir_path,
+                                                       save_path=True)
+                directory = directory_from_disk(
+                    dir_path, executor, hash_cache=hash_cache,
+                    max_content_size=self.max_content_size,
+                    contents=skipped, **self.sinks())
+                if isinstance(hash_cache, ArchiveHashCache):
+                    phase.count(**hash_cache.counters())
+                return nature, directory
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+    def uncompress(self, filepath):
+        """Uncompress the archive at filepath in :attr:`dir_path`.
+
+        Returns:
+            the archive nature
+
+        """
+        archive_path = filepath
+        if self.external_decompression and external_command(
+                detect_file_compression(filepath)):
+            # not next to the archive, which may be a local artifact used
+            # in place
+            archive_path = self.dir_path + '.tar'
+            uncompress_to(filepath, archive_path, external=True)
+        try:
+            return tarball.uncompress(archive_path, self.dir_path)
+        finally:
+            if archive_path != filepath:
+                os.unlink(archive_path)
+
+    def find_known_artifact(self, hashes):
+        """Look for an artifact with the given hashes among the revisions
+           targeted by the latest snapshot of the origin.
+
+        Args:
+            hashes (dict): hashes of the artifact being loaded
+
+        Returns:
+            Tuple of (archive nature, directory id) of the known
+            artifact if its directory is fully archived, None otherwise
+
+        """
+        snapshot = self.storage.snapshot_get_latest(self.origin['url'])
+        if not snapshot:
+            return None
+        revision_ids = [
+            branch['target'] for branch in snapshot['branches'].values()
+            if branch and branch['target_type'] == 'revision'
+        ]
+        for revision in self.storage.revision_get(revision_ids):
+            if not revision:
+                continue
+            metadata = revision.get('metadata') or {}
+            for artifact in metadata.get('original_artifact') or []:
+                if not isinstance(artifact, dict):
+                    continue
+                if artifact.get('sha256') != hashes['sha256'] or \
+                   artifact.get('length') != hashes['length']:
+                    continue
+                directory_id = revision['directory']
+                if list(self.storage.directory_missing([directory_id])):
+                    continue
+                return artifact['archive_type'], directory_id
+        return None
+
+    def fetch_archive(self, url):
+        """Retrieve the archive at url and compute its directory model.
+
+        When `pipeline_archive` is set, remote tarballs are hashed and
+        read while being downloaded (cf. :mod:`swh.loader.tar.pipeline`).
+        Other archives are downloaded first (local ones are used in
+        place), then handled by :meth:`archive_directory`.
+
+        Returns:
+            Tuple of (filepath, hashes of filepath, archive nature,
+            :class:`Directory` or :class:`ArchivedDirectory`)
+
+        """
+        if self.pipeline_archive and urlparse(url).scheme != 'file':
+            chunks, length = self.client.stream(url)
+            filepath = os.path.join(
+                self.temp_directory, os.path.basename(url))
+            executor = make_executor(self.hash_executor, self.hash_workers)
+            hash_cache = self.executor_hash_cache(executor)
+            try:
+                with self.metrics.phase('pipeline') as phase, \
+                        self.checking_limits(phase):
+                    hashes, directory = directory_from_chunks(
+                        chunks, length=length, filepath=filepath,
+                        queue_size=self.pipeline_queue_size,
+                        executor=executor,
+                        external_decompression=self.external_decompression,
+                        hash_cache=hash_cache,
+                        max_content_size=self.max_content_size,
+                        limits=self.make_limits(length), **self.sinks())
+                    phase.count(bytes_in=hashes['length'])
+                    if isinstance(hash_cache, ArchiveHashCache):
+                        phase.count(**hash_cache.counters())
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            if directory is not None:
+                return filepath, hashes, 'tar', directory
+            nature, directory = self.build_directory(filepath)
+        else:
+            with self.metrics.phase('download') as phase:
+                filepath, hashes = self.client.download(url)
+                phase.count(bytes_in=hashes['length'])
+            nature, directory = self.archive_directory(url, filepath, hashes)
+        return filepath, hashes, nature, directory
+
+    def archive_directory(self, url, filepath, hashes):
+        """Compute the directory model of the archive downloaded from url
+           at filepath, with :meth:`build_directory`, unless
+           `skip_known_artifacts` is set and the same artifact is already
+           archived for the origin.
 
-        dir_path = self.dir_path.encode('utf-8')
-        directory = Directory.from_disk(path=dir_path, save_path=True)
-        objects = directory.collect()
+        Returns:
+            Tuple of (archive nature, :class:`Directory` or
+            :class:`ArchivedDirectory`)
+
+        """
+        if self.skip_known_artifacts:
+            known = self.find_known_artifact(hashes)
+            if known:
+                nature, directory_id = known
+                self.log.debug('Artifact %s already archived as directory %s',
+                               url, hash_to_hex(directory_id))
+                return nature, ArchivedDirectory(directory_id)
+        return self.build_directory(filepath)
+
+    def collect_objects(self, directory):
+        """Collect the contents and directories of directory left to send.
+
+        Returns:
+            dict with keys {content, directory}
+
+        """
+        with self.metrics.phase('collect') as phase:
+            objects = self._collect_objects(directory)
+            phase.count(objects=len(objects['content']) +
+                        len(objects['directory']))
+        return objects
+
+    def _collect_objects(self, directory):
+        if self.flush_objects:
+            # the contents and directories were sent along the way
+            self.content_packets.flush()
+            self.directory_packets.flush()
+            if self.sender is not None:
+                with self.metrics.phase('send_wait'):
+                    self.sender.join()
+            objects = {}
+        elif self.filter_missing_objects and \
+                isinstance(directory, Directory):
+            objects = collect_missing(
+                self.storage, directory,
+                directory_batch_size=self.config.get(
+                    'directory_packet_size', 1000))
+        else:
+            objects = directory.collect()
         if 'content' not in objects:
             objects['content'] = {}
         if 'directory' not in objects:
             objects['directory'] = {}
+        return objects
 
-        # compute the full revision (with ids)
-        revision = self.build_revision(filepath, nature, hashes)
-        revision = revision_from(directory.hash, revision)
-        objects['revision'] = {
-            revision['id']: revision,
-        }
+    def fetch_data(self):
+        """Retrieve, uncompress archive and fetch objects from the tarball.
+           The actual ingestion takes place in the :meth:`store_data`
+           implementation below.
 
-        snapshot = self.build_snapshot(revision)
-        objects['snapshot'] = {
-            snapshot['id']: snapshot
-        }
+        """
+        url = self.get_tarball_url_to_retrieve()
+        filepath, hashes, nature, directory = self.fetch_archive(url)
+        objects = self.collect_objects(directory)
+
+        with self.metrics.phase('revision'):
+            # compute the full revision (with ids)
+            revision = self.build_revision(filepath, nature, hashes)
+            revision = revision_from(directory.hash, revision)
+            objects['revision'] = {
+                revision['id']: revision,
+            }
+
+            snapshot = self.build_snapshot(revision)
+            objects['snapshot'] = {
+                snapshot['id']: snapshot
+            }
         self.objects = objects
 
     def store_data(self):
         """Store the objects in the swh archive.
 
         """
+        if self.profiler is not None:
+            # the objects of the archives are all computed
+            self.profiler.checkpoint()
         objects = self.objects
-        self.maybe_load_contents(objects['content'].values())
-        self.maybe_load_directories(objects['directory'].values())
-        self.maybe_load_revisions(objects['revision'].values())
-        snapshot = list(objects['snapshot'].values())[0]
-        self.maybe_load_snapshot(snapshot)
+        contents = objects['content'].values()
+        with self.metrics.phase('store_contents') as phase:
+            phase.count(objects=len(contents),
+                        bytes_out=sum(c.get('length', 0) for c in contents))
+            self.load_contents(contents)
+        with self.metrics.phase('store_directories') as phase:
+            phase.count(objects=len(objects['directory']))
+            if self.filter_missing_objects and not self.flush_objects:
+                # the directories were all found missing by collect_missing
+                self.send_missing_directories(objects['directory'].values())
+            else:
+                self.maybe_load_directories(objects['directory'].values())
+        with self.metrics.phase('store_revisions') as phase:
+            phase.count(objects=len(objects['revision']))
+            self.maybe_load_revisions(objects['revision'].values())
+        with self.metrics.phase('store_snapshot') as phase:
+            phase.count(objects=len(objects['snapshot']))
+            snapshot = list(objects['snapshot'].values())[0]
+            self.maybe_load_snapshot(snapshot)
 
 
 class RemoteTarLoader(BaseTarLoader):
@@ -280,6 +625,152 @@ class RemoteTarLoader(BaseTarLoader):
         return snapshot_from(revision['id'], branch_name)
 
 
+class MultiRemoteTarLoader(BaseTarLoader):
+    """This is able to load many remote/local archives of the same origin
+       into the swh archive, in a single visit.
+
+    This will:
+
+    - create an origin (if it does not exist) and a visit
+    - fetch the tarballs concurrently (`fetch_workers` at a time) in a
+      temporary location
+    - process the content of each tarball as :class:`RemoteTarLoader`
+      does, the objects shared by several tarballs being only sent once
+    - create one revision per tarball and a snapshot with one branch
+      per revision, named after the tarball (or after its url, when
+      several tarballs share a name)
+    - clean up the temporary location
+
+    As the tarballs are downloaded ahead, `pipeline_archive` is ignored.
+    As the contents read lazily must be sent before the next tarball is
+    processed, `lazy_contents` is only honored along with `flush_objects`
+    (which also allows to clean up each tarball once it is processed).
+
+    """
+    can_pipeline_archive = False
+
+    def __init__(self, logging_class='swh.loader.tar.MultiTarLoader',
+                 config=None):
+        super().__init__(logging_class=logging_class, config=config)
+        self.fetch_workers = self.config.get('fetch_workers', 4)
+        if not self.flush_objects:
+            self.lazy_contents = False
+
+    def prepare(self, *, artifacts, **kwargs):
+        """Prepare the artifacts to ingest.
+
+        Args:
+            origin (dict): Dict with keys {url, type}
+            artifacts (list): (url, last_modified) pairs, last_modified
+              being the date of last modification of the archive at url
+            visit_date (str): Date representing the date of the
+              visit. None by default will make it the current time
+              during the loading process.
+
+        Raises:
+            ValueError if an artifact is given twice
+
+        """
+        urls = collections.Counter(url for url, _ in artifacts)
+        duplicates = [url for url, count in urls.items() if count > 1]
+        if duplicates:
+            raise ValueError('Artifacts given twice: %s' % (
+                ', '.join(duplicates)))
+        names = collections.Counter(
+            os.path.basename(url) for url, _ in artifacts)
+        self.artifacts = []
+        for url, last_modified in artifacts:
+            name = os.path.basename(url)
+            # the branches of the artifacts sharing a name would collide
+            branch = name if names[name] == 1 else url
+            self.artifacts.append({
+                'url': url,
+                'last_modified': last_modified,
+                'branch': branch.encode('utf-8'),
+            })
+
+    def fetch_artifacts(self):
+        """Download the artifacts, at most `fetch_workers` of them ahead
+           of the one being processed.
+
+        Yields:
+            Tuple of (artifact, download directory, local filepath, hashes
+            of filepath), in the order of the artifacts (local artifacts
+            are used in place, outside of their download directory)
+
+        """
+        with ThreadPoolExecutor(max(self.fetch_workers, 1)) as executor:
+            downloads = collections.deque()
+            for artifact in self.artifacts:
+                # distinct directories as the artifacts may share a name
+                directory = mkdtemp(dir=self.temp_directory)
+                downloads.append((artifact, directory, executor.submit(
+                    self.client.download, artifact['url'], directory)))
+                if len(downloads) > self.fetch_workers:
+                    yield self.wait_download(*downloads.popleft())
+            while downloads:
+                yield self.wait_download(*downloads.popleft())
+
+    def wait_download(self, artifact, directory, download):
+        """Wait for the download of artifact in directory.
+
+        Returns:
+            Tuple of (artifact, directory, local filepath, hashes of
+            filepath)
+
+        """
+        # only the time spent waiting for the downloads is accounted for
+        with self.metrics.phase('download') as phase:
+            filepath, hashes = download.result()
+            phase.count(bytes_in=hashes['length'])
+        return artifact, directory, filepath, hashes
+
+    def fetch_data(self):
+        """Retrieve, uncompress archives and fetch objects from the
+           tarballs. The actual ingestion takes place in the
+           :meth:`store_data` implementation.
+
+        """
+        objects = {'content': {}, 'directory': {}, 'revision': {}}
+        branches = {}
+        for artifact, download_dir, filepath, hashes in \
+                self.fetch_artifacts():
+            # the extracted tree is read when its objects are sent
+            self.dir_path = tempfile.mkdtemp(prefix='swh.loader.tar-',
+                                             dir=self.temp_directory)
+            nature, directory = self.archive_directory(
+                artifact['url'], filepath, hashes)
+            for obj_type, objs in self.collect_objects(directory).items():
+                objects[obj_type].update(objs)
+
+            with self.metrics.phase('revision'):
+                revision = set_original_artifact(
+                    revision=compute_revision(filepath,
+                                              artifact['last_modified']),
+                    filepath=filepath,
+                    nature=nature,
+                    hashes=hashes,
+                )
+                revision = revision_from(directory.hash, revision)
+                objects['revision'][revision['id']] = revision
+                branches[artifact['branch']] = revision['id']
+
+            if self.flush_objects:
+                # everything was sent along the way
+                self.content_reader = None
+                shutil.rmtree(download_dir)
+                if self.scratch is not None:
+                    self.scratch.discard(self.dir_path)
+                if os.path.exists(self.dir_path):
+                    shutil.rmtree(self.dir_path)
+
+        snapshot = compute_snapshot(branches)
+        objects['snapshot'] = {
+            snapshot['id']: snapshot
+        }
+        self.objects = objects
+
+
 class LegacyLocalTarLoader(BaseTarLoader):
     """This loads local tarball into the swh archive. It's using the
        revision and branch provided by the caller as scaffolding to
@@ -298,6 +789,9 @@ class LegacyLocalTarLoader(BaseTarLoader):
     - clean up the temporary location
 
     """
+    # the tarballs are local
+    can_pipeline_archive = False
+
     def prepare(self, *, tar_path, revision, branch_name, **kwargs):
         """Prepare the data prior to ingest it in SWH archive.
 
@@ -0,0 +1,363 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Per-phase metrics of the visits.
+
+Each phase of a visit (download, decompression, tree building, storage
+writes, ...) records its wall time, its CPU time (of the loader process
+and its children, e.g. external decompressors or hashing processes), the
+peak resident memory of the loader process while it ran and at its end,
+and counters such as the bytes read or written and the objects handled.
+The peak of a phase is measured by resetting the high-water mark of the
+resident memory of the process when it starts (on Linux, cf.
+:func:`reset_peak_rss`); the peak resident memory of the whole life of
+the process (which can load many visits) is reported along with the
+visits.
+
+The metrics of a visit can be sent to a statsd server and/or exposed in
+a file of a Prometheus node exporter's textfile collector.
+
+"""
+
+import collections
+import contextlib
+import glob
+import logging
+import os
+import resource
+import socket
+import tempfile
+import time
+
+from typing import Dict
+
+from .utils import is_alive
+
+
+logger = logging.getLogger(__name__)
+
+METRIC_PREFIX = 'swh_loader_tar'
+
+# Maximum size of the statsd datagrams
+STATSD_PACKET_SIZE = 1024
+
+
+def cpu_time():
+    """Return the CPU time (user and system) of the process and its
+       (terminated) children.
+
+    """
+    times = os.times()
+    return times.user + times.system + \
+        times.children_user + times.children_system
+
+
+# Peak resident memory (in bytes) of the process before the last reset
+# of its high-water mark
+_reset_peak_rss = 0
+
+
+def _hwm():
+    """Return the high-water mark of the resident memory (in bytes) of the
+       process, since it started or since it was last reset, or 0 if it
+       is unknown (without procfs)."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, IndexError, ValueError):
+        pass
+    return 0
+
+
+def reset_peak_rss():
+    """Reset the high-water mark of the resident memory of the process to
+       its current resident memory (Linux >= 4.0).
+
+    Returns:
+        whether it could be reset
+
+    """
+    global _reset_peak_rss
+    _reset_peak_rss = max(_reset_peak_rss, _hwm())
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def peak_rss():
+    """Return the peak resident memory (in bytes) of the process, since
+       it started."""
+    # ru_maxrss is in kilobytes (on Linux), and follows the resets of
+    # the high-water mark
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+               _reset_peak_rss, _hwm())
+
+
+def rss():
+    """Return the current resident memory (in bytes) of the process, or 0
+       if it is unknown (without procfs)."""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0
+    return pages * resource.getpagesize()
+
+
+class Phase:
+    """Metrics of a phase of a visit, accumulated over its runs (e.g. once
+       per artifact of a batch visit).
+
+    """
+    def __init__(self, name):
+        self.name = name
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        # resident memory at the end of its last run
+        self.rss = 0
+        # peak resident memory over its runs (0 if it is unknown)
+        self.peak_rss = 0
+        self.counters = collections.Counter()
+
+    def count(self, **counters):
+        """Increment the counters of the phase (e.g. ``bytes_in``,
+           ``bytes_out``, ``objects``)."""
+        self.counters.update(counters)
+
+    def to_dict(self):
+        return {
+            'wall_time': self.wall_time,
+            'cpu_time': self.cpu_time,
+            'rss': self.rss,
+            'peak_rss': self.peak_rss,
+            **self.counters,
+        }
+
+
+class VisitMetrics:
+    """Metrics of the phases of a visit, in the order they first ran."""
+    def __init__(self):
+        self.phases = collections.OrderedDict()
+        # [phase, peak resident memory so far] of the runs in progress
+        # whose peak is measured (innermost last)
+        self.peaks = []
+
+    def _start_peak(self, phase):
+        """Start measuring the peak resident memory of a run of phase, the
+           peaks of the enclosing runs being saved beforehand.
+
+        Returns:
+            the measure, or None if the peak cannot be measured
+
+        """
+        hwm = _hwm()
+        for measure in self.peaks:
+            measure[1] = max(measure[1], hwm)
+        if not reset_peak_rss():
+            return None
+        measure = [phase, 0]
+        self.peaks.append(measure)
+        return measure
+
+    def _end_peak(self, measure):
+        self.peaks.remove(measure)
+        phase, peak = measure
+        phase.peak_rss = max(phase.peak_rss, peak, _hwm())
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Measure a run of the phase name.
+
+        Yields:
+            the :class:`Phase`, whose counters can be incremented
+
+        """
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = Phase(name)
+        measure = self._start_peak(phase)
+        wall_start, cpu_start = time.monotonic(), cpu_time()
+        try:
+            yield phase
+        finally:
+            phase.wall_time += time.monotonic() - wall_start
+            phase.cpu_time += cpu_time() - cpu_start
+            phase.rss = rss()
+            if measure is not None:
+                self._end_peak(measure)
+
+    def to_dict(self):
+        return {name: phase.to_dict() for name, phase in self.phases.items()}
+
+    def summary(self):
+        """Return a one-line summary of the phases, for the logs."""
+        summaries = []
+        for phase in self.phases.values():
+            summary = '%s=%.3fs/%.3fs cpu' % (
+                phase.name, phase.wall_time, phase.cpu_time)
+            summary += ''.join(' %s=%s' % (counter, value)
+                               for counter, value
+                               in sorted(phase.counters.items()))
+            summaries.append(summary)
+        summaries.append('process_peak_rss=%s' % peak_rss())
+        return ', '.join(summaries)
+
+
+def statsd_lines(metrics, prefix=METRIC_PREFIX):
+    """Format the metrics of a visit as statsd lines (timings in
+       milliseconds, memory as gauges, and counters).
+
+    """
+    lines = []
+    for phase in metrics.phases.values():
+        name = '%s.%s' % (prefix, phase.name)
+        lines.append('%s.wall_time:%d|ms' % (name, phase.wall_time * 1000))
+        lines.append('%s.cpu_time:%d|ms' % (name, phase.cpu_time * 1000))
+        lines.append('%s.rss:%d|g' % (name, phase.rss))
+        lines.append('%s.peak_rss:%d|g' % (name, phase.peak_rss))
+        for counter, value in sorted(phase.counters.items()):
+            lines.append('%s.%s:%d|c' % (name, counter, value))
+    lines.append('%s.process_peak_rss:%d|g' % (prefix, peak_rss()))
+    lines.append('%s.visits:1|c' % prefix)
+    return lines
+
+
+def send_statsd(address, metrics, prefix=METRIC_PREFIX):
+    """Send the metrics of a visit to the statsd server at address
+       (host:port). Failures are only logged.
+
+    """
+    host, _, port = address.rpartition(':')
+    packets, packet = [], ''
+    for line in statsd_lines(metrics, prefix):
+        if packet and len(packet) + len(line) + 1 > STATSD_PACKET_SIZE:
+            packets.append(packet)
+            packet = ''
+        packet = '%s\n%s' % (packet, line) if packet else line
+    packets.append(packet)
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            for packet in packets:
+                sock.sendto(packet.encode('utf-8'), (host, int(port)))
+    except (OSError, ValueError) as e:
+        logger.warning('Failed to send the metrics to %s: %s', address, e)
+
+
+class TextfileExporter:
+    """Exposes the metrics of the visits of the process in a file of a
+       Prometheus node exporter's textfile collector directory.
+
+    Times and counters are totals over the visits of the process (so
+    that their rates can be computed), the resident memory of the phases
+    (at their end and their peak) is that of the last visit, and the
+    process peak resident memory is that of the whole process. As each
+    process of a worker has its file, their series are told apart by a
+    ``pid`` label; the files of the terminated processes are removed.
+
+    Args:
+        directory (str): the textfile collector directory
+        prefix (str): prefix of the metric names
+
+    """
+    def __init__(self, directory, prefix=METRIC_PREFIX):
+        self.directory = directory
+        self.prefix = prefix
+        self.totals = collections.OrderedDict()
+        self.rss = {}
+        self.peak_rss = {}
+        self.visits = 0
+
+    def _path(self, pid):
+        return os.path.join(self.directory, '%s-%s.prom' % (
+            self.prefix, pid))
+
+    @property
+    def path(self):
+        return self._path(os.getpid())
+
+    def add(self, metrics):
+        """Account for the metrics of a visit."""
+        self.visits += 1
+        for phase in metrics.phases.values():
+            totals = self.totals.setdefault(
+                phase.name, collections.Counter())
+            totals.update(wall_time_seconds=phase.wall_time,
+                          cpu_time_seconds=phase.cpu_time,
+                          **phase.counters)
+            self.rss[phase.name] = phase.rss
+            self.peak_rss[phase.name] = phase.peak_rss
+
+    def lines(self):
+        pid = os.getpid()
+        metrics = collections.OrderedDict()
+        for name, totals in self.totals.items():
+            for metric, value in totals.items():
+                metrics.setdefault(('%s_%s_total' % (self.prefix, metric),
+                                    'counter'), []).append((name, value))
+        for name, value in self.rss.items():
+            metrics.setdefault(('%s_rss_bytes' % self.prefix, 'gauge'),
+                               []).append((name, value))
+        for name, value in self.peak_rss.items():
+            metrics.setdefault(('%s_peak_rss_bytes' % self.prefix, 'gauge'),
+                               []).append((name, value))
+        lines = ['# TYPE %s_visits_total counter' % self.prefix,
+                 '%s_visits_total{pid="%s"} %s' % (
+                     self.prefix, pid, self.visits),
+                 '# TYPE %s_process_peak_rss_bytes gauge' % self.prefix,
+                 '%s_process_peak_rss_bytes{pid="%s"} %s' % (
+                     self.prefix, pid, peak_rss())]
+        for (metric, metric_type), values in metrics.items():
+            lines.append('# TYPE %s %s' % (metric, metric_type))
+            for name, value in values:
+                lines.append('%s{phase="%s",pid="%s"} %s' % (
+                    metric, name, pid, value))
+        return lines
+
+    def remove_stale_files(self):
+        """Remove the files of the terminated processes."""
+        for path in glob.glob(self._path('*')):
+            pid = os.path.basename(path)[len(self.prefix) + 1:-len('.prom')]
+            if pid.isdigit() and not is_alive(int(pid)):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def export(self, metrics):
+        """Account for the metrics of a visit, and (atomically) rewrite
+           the file of the process. Failures are only logged.
+
+        """
+        self.add(metrics)
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory,
+                                            prefix='.%s-' % self.prefix)
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(self.lines()) + '\n')
+            os.rename(tmp_path, self.path)
+            self.remove_stale_files()
+        except OSError as e:
+            logger.warning('Failed to write the metrics to %s: %s',
+                           self.directory, e)
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+
+
+_textfile_exporters: Dict[str, TextfileExporter] = {}
+
+
+def textfile_exporter(directory):
+    """Return the exporter of the metrics of the process to directory."""
+    exporter = _textfile_exporters.get(directory)
+    if exporter is None:
+        exporter = _textfile_exporters[directory] = TextfileExporter(
+            directory)
+    return exporter
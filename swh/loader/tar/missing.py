@@ -0,0 +1,83 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Compute the objects of a directory tree which are missing from the
+archive.
+
+The tree is walked top-down, one level at a time, querying the storage
+for the directories of each level in bulk: the subtrees of the
+directories already archived are pruned, as everything they reference
+is archived as well. The contents of the missing directories are left to
+the filtering of the core loader when they are sent.
+
+"""
+
+from swh.core.utils import grouper
+from swh.model.from_disk import Directory
+from swh.model.hashutil import DEFAULT_ALGORITHMS
+
+
+def _missing(query, objects, batch_size):
+    """Call query on batches of objects, yielding its results"""
+    for batch in grouper(objects, batch_size):
+        yield from query(list(batch))
+
+
+def collect_missing(storage, directory, *, directory_batch_size=1000):
+    """Collect the directories of directory missing from the storage,
+       along with their contents (which may be archived already).
+
+    Args:
+        storage: the storage to query
+        directory (Directory): the root of the tree to collect
+        directory_batch_size (int): number of directories per
+          `directory_missing` query
+
+    Returns:
+        dict with keys {content, directory}, as :meth:`Directory.collect`
+
+    """
+    directories = {}
+    contents = {}
+    level = {directory.hash: directory}
+    while level:
+        next_level = {}
+        for dir_id in _missing(storage.directory_missing, level,
+                               directory_batch_size):
+            node = level[dir_id]
+            directories[dir_id] = node.get_data()
+            for child in node.values():
+                if isinstance(child, Directory):
+                    if child.hash not in directories:
+                        next_level[child.hash] = child
+                else:
+                    contents[child.hash] = child.data
+        level = next_level
+    return {
+        'content': contents,
+        'directory': directories,
+    }
+
+
+def filter_missing_contents(storage, contents, *, batch_size=1000):
+    """Filter the contents missing from the storage.
+
+    Only the hashes of the contents are sent to the storage, not their
+    data.
+
+    Args:
+        storage: the storage to query
+        contents (Iterable[dict]): the contents to filter
+        batch_size (int): number of contents per `content_missing` query
+
+    Returns:
+        the list of the missing contents
+
+    """
+    by_sha1 = {c['sha1']: c for c in contents}
+    query = [{algo: c[algo] for algo in DEFAULT_ALGORITHMS}
+             for c in by_sha1.values()]
+    return [by_sha1[sha1] for sha1 in _missing(storage.content_missing,
+                                               query, batch_size)]
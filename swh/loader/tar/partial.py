@@ -0,0 +1,128 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Partially downloaded artifacts, resumed with range requests.
+
+The bytes received so far are kept along with the validator (strong ETag
+or Last-Modified date) of the artifact's version, so that the rest of the
+same version of the artifact can be requested with ``Range`` and
+``If-Range`` headers.
+
+"""
+
+import fcntl
+import json
+import os
+import shutil
+import time
+
+from swh.model.hashutil import HASH_BLOCK_SIZE
+
+
+def range_validator(headers):
+    """Return the validator of the version of an artifact usable in an
+       ``If-Range`` header (weak ETags are not), if any.
+
+    """
+    etag = headers.get('ETag')
+    if etag and not etag.startswith('W/'):
+        return etag
+    return headers.get('Last-Modified')
+
+
+class PartialDownload:
+    """Partially downloaded artifact, locked while it is being
+       downloaded.
+
+    Args:
+        path (str): where the artifact is downloaded; its metadata is
+          kept at path.json
+
+    Raises:
+        BlockingIOError if the artifact is being downloaded by another
+        process
+
+    """
+    def __init__(self, path):
+        self.path = path
+        self.metadata_path = path + '.json'
+        self.file = open(path, 'ab')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            raise
+        self.metadata = {}
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path) as f:
+                self.metadata = json.load(f)
+
+    @property
+    def size(self):
+        """Number of bytes downloaded so far"""
+        self.file.flush()
+        return os.fstat(self.file.fileno()).st_size
+
+    def start(self, url, length, headers):
+        """(Re)start the download of url from scratch.
+
+        Args:
+            url (str): the artifact's url
+            length (int): the artifact's length
+            headers (dict): http headers of the artifact's response
+
+        """
+        self.file.truncate(0)
+        self.metadata = {
+            'url': url,
+            'length': length,
+            'validator': range_validator(headers),
+        }
+        with open(self.metadata_path, 'w') as f:
+            json.dump(self.metadata, f)
+
+    def write(self, chunk):
+        self.file.write(chunk)
+
+    def update_hash(self, h):
+        """Update h with the bytes downloaded so far."""
+        self.file.flush()
+        with open(self.path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                h.update(chunk)
+
+    def finish(self, filepath):
+        """Move the downloaded artifact to filepath."""
+        self.file.close()
+        shutil.move(self.path, filepath)
+        os.unlink(self.metadata_path)
+
+    def close(self):
+        """Release the partial download, keeping it for a later attempt."""
+        self.file.close()
+
+
+def clean_partial_downloads(directory, max_age):
+    """Remove the partial downloads of directory untouched for max_age
+       seconds.
+
+    """
+    limit = time.time() - max_age
+    for name in os.listdir(directory):
+        if name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) >= limit:
+                continue
+            partial = PartialDownload(path)
+        except (BlockingIOError, FileNotFoundError):
+            continue
+        try:
+            os.unlink(path)
+            if os.path.exists(partial.metadata_path):
+                os.unlink(partial.metadata_path)
+        finally:
+            partial.close()
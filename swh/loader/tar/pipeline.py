@@ -0,0 +1,366 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Pipelined ingestion of a tarball while it is being downloaded.
+
+Three stages run concurrently, connected by bounded queues of chunks:
+
+- the fetch thread pulls the archive chunks, hashes them (for the
+  original artifact metadata) and checks the archive length,
+- the decompression thread uncompresses them (gzip, bzip2 or xz,
+  detected from the archive's magic number), or feeds them to an external
+  decompressor (cf. :mod:`swh.loader.tar.decompress`),
+- the calling thread reads the tar members from the uncompressed stream
+  and hashes them into the directory model.
+
+"""
+
+import bz2
+import itertools
+import lzma
+import queue
+import tarfile
+import threading
+import zlib
+
+from swh.model.hashutil import MultiHash
+
+from .decompress import (
+    ExternalDecompressor, detect_compression, external_command
+)
+from .stream import directory_from_tarfile
+
+
+# Time (in seconds) after which a blocked producer checks whether the
+# consumer gave up
+PUT_TIMEOUT = 1
+
+
+class _EndOfStream:
+    def __init__(self, error=None):
+        self.error = error
+
+
+class ChunkPipe:
+    """Bounded single-producer/single-consumer pipe of bytes chunks.
+
+    The consumer side offers a file-like :meth:`read` api so that it can
+    be handed over to :mod:`tarfile`.
+
+    Args:
+        maxsize (int): maximum number of chunks held in the pipe
+
+    """
+    def __init__(self, maxsize):
+        self.queue = queue.Queue(maxsize)
+        self.aborted = threading.Event()
+        self.buffer = b''
+        self.eof = False
+
+    def _put(self, item):
+        while not self.aborted.is_set():
+            try:
+                self.queue.put(item, timeout=PUT_TIMEOUT)
+                return
+            except queue.Full:
+                continue
+
+    def write(self, chunk):
+        """Producer side: push a (non empty) chunk."""
+        if chunk:
+            self._put(chunk)
+
+    def close(self, error=None):
+        """Producer side: signal the end of the stream, possibly because
+           of an error which is then raised on the consumer side.
+
+        """
+        self._put(_EndOfStream(error))
+
+    def abort(self):
+        """Consumer side: stop accepting chunks, unblocking the producer."""
+        self.aborted.set()
+
+    def next_chunk(self):
+        """Consumer side: return the next chunk, b'' at the end of stream.
+
+        """
+        if self.buffer:
+            chunk, self.buffer = self.buffer, b''
+            return chunk
+        if self.eof:
+            return b''
+        item = self.queue.get()
+        if isinstance(item, _EndOfStream):
+            self.eof = True
+            if item.error is not None:
+                raise item.error
+            return b''
+        return item
+
+    def read(self, size=-1):
+        """Consumer side: file-like read of at most size bytes."""
+        if size is None or size < 0:
+            return b''.join(iter(self.next_chunk, b''))
+        data = self.buffer
+        while len(data) < size:
+            self.buffer = b''
+            chunk = self.next_chunk()
+            if not chunk:
+                break
+            data += chunk
+        data, self.buffer = data[:size], data[size:]
+        return data
+
+    def drain(self):
+        """Consumer side: consume (and ignore) the rest of the stream."""
+        while self.next_chunk():
+            pass
+
+
+class _Identity:
+    """Decompressor api for uncompressed streams"""
+    eof = False
+    unused_data = b''
+
+    def decompress(self, data):
+        return data
+
+
+# compression -> decompressor factory
+DECOMPRESSORS = {
+    'gz': lambda: zlib.decompressobj(16 + zlib.MAX_WBITS),
+    'bz2': bz2.BZ2Decompressor,
+    'xz': lzma.LZMADecompressor,
+}
+
+
+def decompressor_factory(head):
+    """Find out how to uncompress a stream starting with head.
+
+    Returns:
+        a callable instantiating the decompressor of the stream, or None
+        if the stream is neither a supported compressed stream nor an
+        uncompressed (ustar) tarball.
+
+    """
+    compression = detect_compression(head)
+    if compression in DECOMPRESSORS:
+        return DECOMPRESSORS[compression]
+    if head[257:262] == b'ustar':
+        return _Identity
+    return None
+
+
+def _probe_tarball(factory, head, source):
+    """Check whether the compressed stream starting with head (and going
+       on in source) holds a tarball, from its first uncompressed block.
+
+    Returns:
+        Tuple of (whether the stream holds a tarball, head extended with
+        the chunks read from source to uncompress that block)
+
+    """
+    decompressor = factory()
+    block = decompressor.decompress(head)
+    while len(block) < tarfile.BLOCKSIZE and not decompressor.eof:
+        chunk = source.next_chunk()
+        if not chunk:
+            break
+        head += chunk
+        block += decompressor.decompress(chunk)
+    block = block[:tarfile.BLOCKSIZE]
+    if len(block) < tarfile.BLOCKSIZE:
+        return False, head
+    if not block.strip(b'\x00'):
+        # end-of-archive marker of an empty tarball
+        return True, head
+    try:
+        tarfile.TarInfo.frombuf(block, tarfile.ENCODING, 'surrogateescape')
+    except tarfile.HeaderError:
+        return False, head
+    return True, head
+
+
+def _run_stage(target, output, *args):
+    """Run target(*args), closing output with target's error if any."""
+    try:
+        target(*args)
+    except BaseException as e:
+        output.close(error=e)
+    else:
+        output.close()
+
+
+def _fetch(chunks, length, output, hashes):
+    h = MultiHash(length=length)
+    actual_length = 0
+    for chunk in chunks:
+        if output.aborted.is_set():
+            return
+        h.update(chunk)
+        actual_length += len(chunk)
+        output.write(chunk)
+    if length != actual_length:
+        raise ValueError('Error when checking size: %s != %s' % (
+            length, actual_length))
+    hashes.update({
+        'length': length,
+        **h.hexdigest()
+    })
+
+
+def _decompress(factory, head, source, output):
+    decompressor = factory()
+    chunk = head
+    while chunk:
+        while chunk:
+            if decompressor.eof:
+                # concatenated streams (e.g. multi-member gzip), possibly
+                # followed by some padding
+                if not chunk.strip(b'\x00'):
+                    break
+                decompressor = factory()
+            output.write(decompressor.decompress(chunk))
+            chunk = decompressor.unused_data if decompressor.eof else b''
+        if output.aborted.is_set():
+            source.abort()
+            return
+        chunk = source.next_chunk()
+    if factory is not _Identity and not decompressor.eof:
+        raise EOFError('Compressed stream ended before the end-of-stream '
+                       'marker was reached')
+
+
+def _directory_from_command(command, head, source, filepath, **kwargs):
+    """Compute the directory model of the tarball uncompressed by command,
+       fed with head and the chunks left in source.
+
+    """
+    decompressor = ExternalDecompressor(command)
+    decompressor.feed(itertools.chain([head], iter(source.next_chunk, b'')))
+    try:
+        with tarfile.open(fileobj=decompressor.stdout, mode='r|') as tar:
+            directory = directory_from_tarfile(tar, **kwargs)
+    except (tarfile.TarError, EOFError, OSError) as e:
+        decompressor.close(check=False)
+        raise ValueError('Problem during streaming %s. Reason: %s' % (
+            filepath, e))
+    except BaseException:
+        decompressor.close(check=False)
+        raise
+    # the archive must be fully fetched to be hashed and checked
+    decompressor.close()
+    return directory
+
+
+def directory_from_chunks(chunks, *, length, filepath, queue_size=16,
+                          executor=None, content_sink=None,
+                          directory_sink=None, external_decompression=False,
+                          hash_cache=None, max_content_size=None,
+                          limits=None):
+    """Compute the directory model of a tarball while it is being fetched.
+
+    Archives which cannot be streamed (e.g. zip archives, or compressed
+    files which are not tarballs) are written to filepath instead, for the
+    caller to uncompress them from disk.
+
+    Args:
+        chunks (Iterable[bytes]): the archive's content
+        length (int): the announced length of the archive
+        filepath (str): where to write archives which cannot be streamed
+        queue_size (int): maximum number of chunks buffered between two
+          stages
+        executor (concurrent.futures.Executor): optional pool hashing
+          the tar members concurrently
+        content_sink (callable): called with the data of each content
+        directory_sink (callable): called with the data of each directory
+        external_decompression (bool): whether to uncompress the archive
+          with an external decompressor, when one is installed
+        hash_cache (ContentHashCache): optional cache of the hashes of
+          the tar members
+        max_content_size (int): size from which the tar members are only
+          hashed, as skipped contents
+        limits (ArchiveLimits): optional limits of the tarball, whose
+          fetch is stopped as soon as it exceeds them
+
+    Raises:
+        ValueError in case the fetched length does not match length
+        (ArchiveLimitExceeded if the tarball exceeds its limits)
+
+    Returns:
+        Tuple of (hashes of the archive, :class:`Directory` or None if
+        the archive was written to filepath)
+
+    """
+    hashes = {}
+    raw = ChunkPipe(queue_size)
+    fetcher = threading.Thread(
+        target=_run_stage, args=(_fetch, raw, chunks, length, raw, hashes),
+        name='swh.loader.tar.fetch', daemon=True)
+    fetcher.start()
+
+    try:
+        head = b''
+        while len(head) < tarfile.BLOCKSIZE:
+            chunk = raw.next_chunk()
+            if not chunk:
+                break
+            head += chunk
+
+        factory = decompressor_factory(head)
+        tarball = True
+        if factory is not None and factory is not _Identity:
+            # single compressed files are not streamed either
+            try:
+                tarball, head = _probe_tarball(factory, head, raw)
+            except (EOFError, OSError, zlib.error, lzma.LZMAError) as e:
+                raise ValueError('Problem during streaming %s. Reason: %s' % (
+                    filepath, e))
+
+        command = external_command(detect_compression(head)) \
+            if external_decompression and tarball else None
+        if command is not None:
+            directory = _directory_from_command(
+                command, head, raw, filepath, executor=executor,
+                content_sink=content_sink, directory_sink=directory_sink,
+                hash_cache=hash_cache, max_content_size=max_content_size,
+                limits=limits)
+            return hashes, directory
+
+        if factory is None or not tarball:
+            with open(filepath, 'wb') as f:
+                f.write(head)
+                for chunk in iter(raw.next_chunk, b''):
+                    f.write(chunk)
+            return hashes, None
+
+        uncompressed = ChunkPipe(queue_size)
+        decompressor = threading.Thread(
+            target=_run_stage,
+            args=(_decompress, uncompressed, factory, head, raw,
+                  uncompressed),
+            name='swh.loader.tar.decompress', daemon=True)
+        decompressor.start()
+        try:
+            with tarfile.open(fileobj=uncompressed, mode='r|') as tar:
+                directory = directory_from_tarfile(
+                    tar, executor=executor, content_sink=content_sink,
+                    directory_sink=directory_sink, hash_cache=hash_cache,
+                    max_content_size=max_content_size, limits=limits)
+            # the archive must be fully fetched to be hashed and checked
+            uncompressed.drain()
+        except (tarfile.TarError, EOFError, OSError, zlib.error,
+                lzma.LZMAError) as e:
+            raise ValueError('Problem during streaming %s. Reason: %s' % (
+                filepath, e))
+        finally:
+            uncompressed.abort()
+            decompressor.join()
+    finally:
+        raw.abort()
+        fetcher.join()
+
+    return hashes, directory
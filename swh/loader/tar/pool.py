@@ -0,0 +1,62 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Pool of the loaders of a worker process, reused across its tasks.
+
+Instantiating a loader parses its configuration and sets up its storage
+client, http session, caches, ... which is a significant part of the
+load of a small tarball: the tasks rather borrow an idle loader of the
+process, which resets the state of its previous visit (its temporary
+directories being removed at the end of each visit).
+
+"""
+
+import collections
+import contextlib
+import os
+import threading
+
+
+class LoaderPool:
+    """Idle loaders of the process, by class.
+
+    The pool is emptied in forked processes, so that the loaders (and
+    their connections) are not shared with the parent process.
+
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.idle = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def loader(self, loader_class):
+        """Borrow an idle loader of loader_class, or a new one if none is
+           idle.
+
+        The loader is given back to the pool unless its use raised an
+        exception (as it may be left in an inconsistent state).
+
+        """
+        with self.lock:
+            if self.pid != os.getpid():
+                self.idle.clear()
+                self.pid = os.getpid()
+            idle = self.idle[loader_class]
+            loader = idle.pop() if idle else None
+        if loader is None:
+            loader = loader_class()
+        yield loader
+        with self.lock:
+            if self.pid == os.getpid():
+                self.idle[loader_class].append(loader)
+
+    def clear(self):
+        """Drop the idle loaders."""
+        with self.lock:
+            self.idle.clear()
+
+
+loaders = LoaderPool()
@@ -0,0 +1,130 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Profiling of the visits, to diagnose the pathological archives.
+
+The CPU profile (cProfile) only covers the thread running the visit:
+the time spent in other threads (e.g. hashing or download workers) shows
+up as the time spent waiting for them. The memory profile (tracemalloc)
+covers all the threads of the process, and reports the allocations
+alive at the checkpoint (e.g. once the objects of the archives are
+computed, or at the end of the visit) holding the most memory.
+
+"""
+
+import contextlib
+import cProfile
+import io
+import os
+import pstats
+import time
+import tracemalloc
+
+
+# Number of entries of the reports
+REPORT_LIMIT = 50
+
+# Number of frames kept for the memory allocations
+MEMORY_FRAMES = 16
+
+
+class VisitProfiler:
+    """Profiler of a visit.
+
+    Args:
+        cpu (bool): whether to profile the CPU time, with cProfile
+        memory (bool): whether to profile the memory allocations, with
+          tracemalloc (if it is not already tracing them)
+
+    """
+    def __init__(self, cpu=False, memory=False):
+        self.cpu_profile = cProfile.Profile() if cpu else None
+        self.memory = memory and not tracemalloc.is_tracing()
+        self.memory_snapshot = None
+        self.memory_peak = 0
+        self.start_time = time.monotonic()
+
+    @contextlib.contextmanager
+    def profile(self):
+        """Profile the visit, with a checkpoint at its end."""
+        if self.memory:
+            tracemalloc.start(MEMORY_FRAMES)
+        if self.cpu_profile is not None:
+            self.cpu_profile.enable()
+        try:
+            yield
+        finally:
+            if self.cpu_profile is not None:
+                self.cpu_profile.disable()
+            self.checkpoint()
+            if self.memory:
+                tracemalloc.stop()
+
+    def checkpoint(self):
+        """Snapshot the memory allocations, if they are being traced and
+           use more memory than at the previous checkpoints.
+
+        """
+        if not (self.memory and tracemalloc.is_tracing()):
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        self.memory_peak = max(self.memory_peak, peak)
+        if self.memory_snapshot is None or \
+           current > self.memory_snapshot[0]:
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__)])
+            self.memory_snapshot = (current, snapshot)
+
+    @property
+    def duration(self):
+        """Time (in seconds) elapsed since the start of the visit."""
+        return time.monotonic() - self.start_time
+
+    def write_reports(self, path_prefix, header):
+        """Write the reports of the profiles.
+
+        The CPU profile is dumped in path_prefix.prof (to be read with
+        :mod:`pstats` or tools such as snakeviz), and summarized along
+        with the memory profile in path_prefix.txt.
+
+        Args:
+            path_prefix (str): path of the reports, without extension
+            header (str): first line of the text report
+
+        Returns:
+            list of the paths of the reports
+
+        """
+        paths = []
+        report = io.StringIO()
+        report.write('%s\nDuration: %.3fs\n' % (header, self.duration))
+        if self.cpu_profile is not None:
+            paths.append(path_prefix + '.prof')
+            self.cpu_profile.dump_stats(paths[-1])
+            report.write('\nCPU profile:\n')
+            stats = pstats.Stats(self.cpu_profile, stream=report)
+            stats.sort_stats('cumulative').print_stats(REPORT_LIMIT)
+        if self.memory_snapshot is not None:
+            current, snapshot = self.memory_snapshot
+            report.write('\nMemory profile: %s bytes at peak, %s bytes '
+                         'allocated at the largest snapshot\n' % (
+                             self.memory_peak, current))
+            for stat in snapshot.statistics('traceback')[:REPORT_LIMIT]:
+                report.write('\n%s\n' % stat)
+                report.write('\n'.join(
+                    '    %s' % line for line in stat.traceback.format()))
+                report.write('\n')
+        paths.append(path_prefix + '.txt')
+        with open(paths[-1], 'w') as f:
+            f.write(report.getvalue())
+        return paths
+
+
+def report_prefix(directory, origin_url, visit):
+    """Return the path prefix of the reports of a visit of origin_url."""
+    name = os.path.basename(origin_url.rstrip('/')) or 'origin'
+    name = ''.join(c if c.isalnum() or c in '.-_' else '_' for c in name)
+    return os.path.join(directory, 'visit-%s-%s-%s-%s' % (
+        visit, name[:64], time.strftime('%Y%m%dT%H%M%S'), os.getpid()))
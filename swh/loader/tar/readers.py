@@ -0,0 +1,296 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Readers computing the directory model of the archives without
+extracting them to disk.
+
+Each kind of archive has its reader, detecting the archives it handles
+(and their nature) and assembling their tree in memory with the
+:class:`swh.loader.tar.stream.DirectoryBuilder`:
+
+- tarballs (possibly compressed), read in stream
+- zip archives, whose members are found through their central directory
+  (and read concurrently when hashed by threads)
+- single compressed files (e.g. a ``.gz`` or ``.xz`` artifact which is
+  not a tarball), loaded as a directory holding the uncompressed file
+
+Other readers can be added with :func:`register_reader`.
+
+"""
+
+import collections
+import lzma
+import os
+import stat
+import tempfile
+import zipfile
+import zlib
+
+from concurrent.futures import ThreadPoolExecutor
+
+from .decompress import (
+    detect_file_compression, is_supported, open_uncompressed
+)
+from .stream import (
+    DirectoryBuilder, content_data, content_from_stream,
+    directory_from_tarball, is_oversized, is_tarball, normalize_name,
+    skipped_content_data
+)
+
+
+# Data of the uncompressed single files beyond which they are spooled to
+# disk while being uncompressed
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# compression -> extensions of the compressed single files
+COMPRESSED_FILE_EXTENSIONS = {
+    'gz': ['.gz', '.z'],
+    'bz2': ['.bz2'],
+    'xz': ['.xz'],
+    'zst': ['.zst'],
+}
+
+# extensions of compressed tarballs, which are not single files
+COMPRESSED_TARBALL_EXTENSIONS = ('.tar', '.tgz', '.tbz', '.tbz2', '.txz',
+                                 '.tzst')
+
+
+ArchiveReader = collections.namedtuple('ArchiveReader', [
+    # callable(path, external_decompression) returning the nature of the
+    # archive at path if the reader handles it, None otherwise
+    'detect',
+    # callable(path, executor=None, content_sink=None, directory_sink=None,
+    # lazy=False, external_decompression=False, hash_cache=None,
+    # max_content_size=None, limits=None) returning the Directory of the
+    # archive
+    'directory',
+    # whether the reader honors lazy (keeping the offsets of the contents
+    # in the uncompressed archive, read back by the ContentReader)
+    'lazy',
+    # whether the archives can also be extracted to disk by
+    # swh.core.tarball.uncompress
+    'extractable',
+])
+
+
+def _zip_members(archive, limits=None):
+    """Yield the (info, relative path) of the members of the zip archive
+       extracted by ``shutil.unpack_archive``, checking limits.
+
+    """
+    for info in archive.infolist():
+        name = info.filename
+        if name.startswith('/') or '..' in name:
+            continue
+        member_path = normalize_name(name)
+        if not member_path:
+            continue
+        if limits is not None:
+            limits.add_member(member_path, info.file_size)
+        yield info, member_path
+
+
+def check_zipfile(path, limits):
+    """Check the zip archive at path against its limits, from its central
+       directory (before it is extracted).
+
+    Raises:
+        ValueError when the archive cannot be read (ArchiveLimitExceeded
+        when it exceeds its limits)
+
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for _ in _zip_members(archive, limits):
+                pass
+    except (zipfile.BadZipFile, OSError) as e:
+        raise ValueError('Problem during reading %s. Reason: %s' % (path, e))
+
+
+def _zip_content_data(archive, info, mode, hash_cache=None,
+                      max_content_size=None):
+    with archive.open(info) as f:
+        if is_oversized(info.file_size, max_content_size):
+            return skipped_content_data(f, mode=mode, length=info.file_size)
+        return content_data(f.read(), mode=mode, hash_cache=hash_cache)
+
+
+def directory_from_zipfile(path, executor=None, content_sink=None,
+                           directory_sink=None, hash_cache=None,
+                           max_content_size=None, limits=None, **kwargs):
+    """Compute the :class:`Directory` model of the zip archive at path,
+       without extracting it.
+
+    The tree is the one extracted by ``shutil.unpack_archive`` (and thus
+    by :func:`swh.core.tarball.uncompress`): the members with absolute
+    paths or ``..`` in them are ignored, the symlinks and permissions are
+    not restored (the files are regular, non executable ones).
+
+    Args:
+        path (str): path to the zip archive
+        executor (concurrent.futures.Executor): optional pool hashing
+          the members concurrently (thread pools also read them)
+        content_sink (callable): called with the data of each content
+        directory_sink (callable): called with the data of each directory
+        hash_cache (ContentHashCache): optional cache of the hashes of
+          the members
+        max_content_size (int): size (from the central directory) from
+          which the members are only hashed, as skipped contents
+        limits (ArchiveLimits): optional limits of the archive
+
+    Raises:
+        ValueError when the archive cannot be read (ArchiveLimitExceeded
+        when it exceeds its limits)
+
+    Returns:
+        the :class:`Directory` holding the archive's tree
+
+    """
+    builder = DirectoryBuilder(content_sink=content_sink,
+                               directory_sink=directory_sink)
+    mode = stat.S_IFREG | 0o644
+    try:
+        with zipfile.ZipFile(path) as archive:
+            for info, member_path in _zip_members(archive, limits):
+                if info.filename.endswith('/'):
+                    builder.add_directory(member_path)
+                elif isinstance(executor, ThreadPoolExecutor):
+                    # the zip file can be read concurrently
+                    builder.add_content(member_path, executor.submit(
+                        _zip_content_data, archive, info, mode,
+                        hash_cache, max_content_size))
+                else:
+                    with archive.open(info) as f:
+                        builder.add_content(member_path, content_from_stream(
+                            f, mode=mode, length=info.file_size,
+                            executor=executor, hash_cache=hash_cache,
+                            max_content_size=max_content_size))
+            return builder.build()
+    except (zipfile.BadZipFile, zlib.error, EOFError, OSError) as e:
+        raise ValueError('Problem during reading %s. Reason: %s' % (path, e))
+
+
+def compressed_file_name(path, compression):
+    """Return the name of the file compressed at path (with compression),
+       its name without the compression extension.
+
+    """
+    name = os.path.basename(path)
+    for extension in COMPRESSED_FILE_EXTENSIONS[compression]:
+        if name.lower().endswith(extension) and len(name) > len(extension):
+            return name[:-len(extension)]
+    return name
+
+
+def detect_compressed_file(path, external_decompression=False):
+    """Return the compression of the single compressed file at path, if it
+       is one (compressed tarballs are not, even when they are broken).
+
+    """
+    compression = detect_file_compression(path)
+    if compression is None or \
+       not is_supported(compression, external_decompression):
+        return None
+    name = compressed_file_name(path, compression)
+    if name.lower().endswith(COMPRESSED_TARBALL_EXTENSIONS) or \
+       os.path.basename(path).lower().endswith(
+           COMPRESSED_TARBALL_EXTENSIONS):
+        return None
+    return compression
+
+
+def directory_from_compressed_file(path, executor=None, content_sink=None,
+                                   directory_sink=None,
+                                   external_decompression=False,
+                                   hash_cache=None, max_content_size=None,
+                                   limits=None, **kwargs):
+    """Compute the :class:`Directory` model of the single compressed file
+       at path: a directory holding the uncompressed file (named after
+       path, without its compression extension).
+
+    The file is uncompressed in memory, then spooled to disk beyond
+    SPOOL_SIZE bytes. Its data is not kept if it is larger than
+    max_content_size. The uncompression stops as soon as the file
+    exceeds the limits, if any.
+
+    Raises:
+        ValueError when the file cannot be uncompressed
+        (ArchiveLimitExceeded when it exceeds its limits)
+
+    """
+    compression = detect_file_compression(path)
+    name = os.fsencode(compressed_file_name(path, compression))
+    builder = DirectoryBuilder(content_sink=content_sink,
+                               directory_sink=directory_sink)
+    if limits is not None:
+        limits.add_member(name)
+    try:
+        with tempfile.SpooledTemporaryFile(
+                max_size=SPOOL_SIZE, dir=os.path.dirname(path)) as spool:
+            with open_uncompressed(
+                    path, external=external_decompression) as fobj:
+                for chunk in iter(lambda: fobj.read(1024 * 1024), b''):
+                    if limits is not None:
+                        limits.add_bytes(len(chunk))
+                    spool.write(chunk)
+            length = spool.tell()
+            spool.seek(0)
+            content = content_from_stream(
+                spool, mode=stat.S_IFREG | 0o644, length=length,
+                executor=executor, hash_cache=hash_cache,
+                max_content_size=max_content_size)
+            builder.add_content(name, content)
+            return builder.build()
+    except (EOFError, OSError, zlib.error, lzma.LZMAError) as e:
+        raise ValueError('Problem during uncompressing %s. Reason: %s' % (
+            path, e))
+
+
+# readers, by order of detection
+READERS = [
+    ArchiveReader(
+        detect=lambda path, external: 'tar' if is_tarball(
+            path, external) else None,
+        directory=directory_from_tarball,
+        lazy=True,
+        extractable=True),
+    ArchiveReader(
+        detect=lambda path, external: 'zip' if zipfile.is_zipfile(
+            path) else None,
+        directory=directory_from_zipfile,
+        lazy=False,
+        extractable=True),
+    ArchiveReader(
+        detect=detect_compressed_file,
+        directory=directory_from_compressed_file,
+        lazy=False,
+        extractable=False),
+]
+
+
+def register_reader(reader, first=False):
+    """Register a new :class:`ArchiveReader`, detected after (or before
+       if first is set) the already registered ones.
+
+    """
+    if first:
+        READERS.insert(0, reader)
+    else:
+        READERS.append(reader)
+
+
+def find_reader(path, external_decompression=False):
+    """Find the reader of the archive at path.
+
+    Returns:
+        Tuple of (nature of the archive, :class:`ArchiveReader`), or
+        (None, None) if no reader handles it
+
+    """
+    for reader in READERS:
+        nature = reader.detect(path, external_decompression)
+        if nature:
+            return nature, reader
+    return None, None
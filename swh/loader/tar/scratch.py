@@ -0,0 +1,124 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Memory-backed scratch space for the extraction of the archives.
+
+Most archives are small enough to be extracted (and read back) in memory,
+e.g. in a tmpfs such as ``/dev/shm``, instead of on the disk of the
+working directory. The room they take is reserved beforehand within a
+budget of bytes shared by the processes of the worker (from an estimate
+of their uncompressed size), and checked while they are extracted: the
+archives found to be larger than their reservation spill to disk.
+
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+from .admission import ByteBudget
+from .limits import ArchiveLimits
+
+
+logger = logging.getLogger(__name__)
+
+
+class ScratchFull(Exception):
+    """An archive does not fit in its reservation of the scratch space."""
+    pass
+
+
+class ScratchLimits(ArchiveLimits):
+    """:class:`ArchiveLimits` of an archive extracted in the scratch
+       space, also checking that it fits in its reservation.
+
+    Args:
+        scratch_size (int): bytes reserved for the archive
+        kwargs: the limits of the archive
+
+    """
+    def __init__(self, scratch_size, **kwargs):
+        super().__init__(**kwargs)
+        self.scratch_size = scratch_size
+
+    def add_bytes(self, size):
+        """Account for size more uncompressed bytes.
+
+        Raises:
+            ArchiveLimitExceeded if the archive exceeds a limit,
+            ScratchFull if it does not fit in its reservation
+
+        """
+        super().add_bytes(size)
+        if self.bytes > self.scratch_size:
+            raise ScratchFull('%s bytes > %s bytes reserved' % (
+                self.bytes, self.scratch_size))
+
+
+class MemoryScratch:
+    """Scratch space in a memory-backed directory, within a budget of bytes
+       shared by the processes of the worker.
+
+    Args:
+        directory (str): the memory-backed directory (e.g. /dev/shm)
+        budget_path (str): path of the file of the reservations of the
+          budget
+        budget (int): bytes of the scratch space
+
+    """
+    def __init__(self, directory, budget_path, budget):
+        self.directory = directory
+        self.budget = ByteBudget(budget_path, budget)
+        self.temp_directory = None
+        # directory -> token of its reservation
+        self.reservations = {}
+
+    def reserve(self, size):
+        """Reserve size bytes of the scratch space for a new directory.
+
+        Returns:
+            the path of the new directory, or None if size bytes do not
+            fit in what is left of the budget
+
+        """
+        if size > self.budget.budget:
+            return None
+        token = self.budget.try_reserve(size)
+        if token is None:
+            return None
+        try:
+            if self.temp_directory is None:
+                self.temp_directory = tempfile.mkdtemp(
+                    suffix='-%s' % os.getpid(), prefix='swh.loader.tar.',
+                    dir=self.directory)
+            path = tempfile.mkdtemp(prefix='swh.loader.tar-',
+                                    dir=self.temp_directory)
+        except OSError as e:
+            logger.warning('Cannot use the scratch space %s: %s',
+                           self.directory, e)
+            self.budget.release(token)
+            return None
+        self.reservations[path] = token
+        return path
+
+    def discard(self, path):
+        """Remove the directory at path and release its reservation (if it
+           is in the scratch space).
+
+        """
+        token = self.reservations.pop(path, None)
+        if token is None:
+            return
+        shutil.rmtree(path, ignore_errors=True)
+        self.budget.release(token)
+
+    def release(self):
+        """Remove all the directories and release their reservations."""
+        for path in list(self.reservations):
+            self.discard(path)
+        if self.temp_directory is not None:
+            shutil.rmtree(self.temp_directory, ignore_errors=True)
+            self.temp_directory = None
@@ -0,0 +1,93 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Background sending of the objects to the storage, overlapping the
+storage writes with the computation of the next objects.
+
+"""
+
+import logging
+import queue
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundSender:
+    """Send packets of objects from a background thread.
+
+    The packets are sent in the order they were submitted, so that a
+    packet (e.g. of directories) is only sent once the packets submitted
+    before it (e.g. of the contents they reference) were acknowledged by
+    the storage. Once sending a packet failed, the next ones are dropped
+    and the error is raised in the submitting thread.
+
+    Args:
+        max_pending (int): number of packets waiting to be sent beyond
+          which :meth:`submit` blocks, bounding the memory they hold
+
+    """
+    def __init__(self, max_pending=2):
+        self.queue = queue.Queue(max(1, max_pending))
+        self.error = None
+        self.discarding = False
+        self.thread = None
+
+    def _run(self):
+        while True:
+            send, objects = self.queue.get()
+            try:
+                if self.error is None and not self.discarding:
+                    send(objects)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """Raise the error of a failed packet, if any."""
+        if self.error is not None:
+            raise self.error
+
+    def submit(self, send, objects):
+        """Call send with objects from the background thread, waiting for
+           a slot in the queue if it is full.
+
+        Raises:
+            the error of a packet previously submitted, if it failed
+
+        """
+        self.check()
+        if self.thread is None:
+            self.thread = threading.Thread(
+                target=self._run, name='swh-loader-tar-sender', daemon=True)
+            self.thread.start()
+        self.queue.put((send, objects))
+
+    def join(self):
+        """Wait for all the submitted packets to be sent.
+
+        Raises:
+            the error of the first packet which failed, if any (the
+            sender can then be used again)
+
+        """
+        self.queue.join()
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def discard(self):
+        """Drop the packets not sent yet, once the one being sent (if any)
+           is done, along with the error of a failed packet."""
+        self.discarding = True
+        try:
+            self.queue.join()
+        finally:
+            self.discarding = False
+        if self.error is not None:
+            logger.debug('Discarded the error of the sender: %s', self.error)
+            self.error = None
@@ -0,0 +1,515 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+"""Build the directory representation of a tarball without extracting it
+to disk.
+
+The members are read sequentially from the (possibly compressed) archive
+stream, hashed on the fly and assembled in memory into the same
+:class:`swh.model.from_disk.Directory` Merkle DAG as the one computed by
+:meth:`Directory.from_disk` on the uncompressed tree.
+
+"""
+
+import collections
+import hashlib
+import lzma
+import os
+import stat
+import tarfile
+import zlib
+
+from concurrent.futures import Future
+
+from swh.model.from_disk import Content, Directory, mode_to_perms
+from swh.model.hashutil import MultiHash, HASH_BLOCK_SIZE
+
+from .decompress import open_uncompressed
+
+
+# Maximum number of contents being hashed concurrently while their data
+# is handed over to a sink (cf. DirectoryBuilder)
+MAX_PENDING_CONTENTS = 256
+
+# Keys of the content dicts holding (or referencing) the content's data
+DATA_KEYS = ('data', 'path', 'archive_offset')
+
+# Status and reason of the contents larger than the content size limit,
+# archived as skipped contents (as swh.loader.core.converters does)
+SKIPPED_STATUS = 'absent'
+SKIPPED_REASON = 'Content too large'
+
+
+def normalize_name(name):
+    """Normalize an archive member name into a relative bytes path.
+
+    Args:
+        name (str): member name as read from the archive
+
+    Returns:
+        the relative path (bytes) of the member, b'' for the root, or
+        None if the member points outside the archive root.
+
+    """
+    parts = [p for p in name.split('/') if p not in ('', '.')]
+    if '..' in parts:
+        return None
+    return os.fsencode('/'.join(parts))
+
+
+def regular_file_mode(mode):
+    """Return the mode of a regular file of mode once extracted, as
+       normalized by :func:`swh.core.tarball.uncompress` (0o644 unless it
+       is executable by its owner), so that the streamed and extracted
+       tarballs have the same perms.
+
+    """
+    if not mode & stat.S_IXUSR:
+        mode = 0o644
+    return stat.S_IFREG | mode
+
+
+def content_data(data, *, mode, hash_cache=None):
+    """Compute the data of a :class:`Content` holding data.
+
+    Args:
+        data (bytes): the content's data
+        mode (int): mode of the content (used to compute its perms)
+        hash_cache (ContentHashCache): optional cache of the hashes
+
+    Returns:
+        dict holding the hashes, length, perms and data of the content
+
+    """
+    if hash_cache is not None:
+        ret = hash_cache.hashes(data)
+    else:
+        ret = MultiHash.from_data(data).digest()
+    ret['length'] = len(data)
+    ret['perms'] = mode_to_perms(mode)
+    ret['data'] = data
+    return ret
+
+
+def lazy_content_data(data, *, mode, offset, hash_cache=None):
+    """Compute the data of a :class:`Content` holding the offset of data in
+       its archive instead of data itself (cf. :class:`ContentReader`).
+
+    """
+    ret = content_data(data, mode=mode, hash_cache=hash_cache)
+    del ret['data']
+    ret['archive_offset'] = offset
+    return ret
+
+
+def skipped_content_data(fobj, *, mode, length):
+    """Compute the data of a :class:`Content` larger than the content size
+       limit: it is hashed in a single pass over fobj, without keeping its
+       data, and marked as skipped.
+
+    """
+    h = MultiHash(length=length)
+    for chunk in iter(lambda: fobj.read(HASH_BLOCK_SIZE), b''):
+        h.update(chunk)
+    ret = h.digest()
+    ret['length'] = length
+    ret['perms'] = mode_to_perms(mode)
+    ret['status'] = SKIPPED_STATUS
+    ret['reason'] = SKIPPED_REASON
+    return ret
+
+
+def is_oversized(length, max_content_size):
+    """Whether a content of length bytes exceeds max_content_size (if
+       set)."""
+    return bool(max_content_size) and length > max_content_size
+
+
+def content_from_stream(fobj, *, mode, length, executor=None, offset=None,
+                        hash_cache=None, max_content_size=None):
+    """Hash the content read from fobj by HASH_BLOCK_SIZE chunks.
+
+    Args:
+        fobj: file-like object to read the content from
+        mode (int): mode of the content (used to compute its perms)
+        length (int): expected length of the content
+        executor (concurrent.futures.Executor): if provided, the
+          content is read right away but hashed in the executor
+        offset (int): if provided, the offset of the content in its
+          archive, kept in place of the content's data
+        hash_cache (ContentHashCache): if provided, the content is read
+          at once and its hashes looked up in the cache
+        max_content_size (int): if provided, the contents larger than
+          this are hashed right away without keeping their data (cf.
+          :func:`skipped_content_data`)
+
+    Returns:
+        :class:`Content` holding the hashes and data of the content, or
+        a future of its data if an executor was provided
+
+    """
+    if is_oversized(length, max_content_size):
+        return Content(skipped_content_data(fobj, mode=mode, length=length))
+    if executor is not None:
+        if offset is not None:
+            return executor.submit(lazy_content_data, fobj.read(),
+                                   mode=mode, offset=offset,
+                                   hash_cache=hash_cache)
+        return executor.submit(content_data, fobj.read(), mode=mode,
+                               hash_cache=hash_cache)
+    if hash_cache is not None:
+        if offset is not None:
+            return Content(lazy_content_data(
+                fobj.read(), mode=mode, offset=offset, hash_cache=hash_cache))
+        return Content(content_data(fobj.read(), mode=mode,
+                                    hash_cache=hash_cache))
+
+    h = MultiHash(length=length)
+    chunks = []
+    while True:
+        chunk = fobj.read(HASH_BLOCK_SIZE)
+        if not chunk:
+            break
+        h.update(chunk)
+        if offset is None:
+            chunks.append(chunk)
+    data = h.digest()
+    data['length'] = length
+    data['perms'] = mode_to_perms(mode)
+    if offset is None:
+        data['data'] = b''.join(chunks)
+    else:
+        data['archive_offset'] = offset
+    return Content(data)
+
+
+class DirectoryBuilder:
+    """Assemble a :class:`Directory` from a flat sequence of paths.
+
+    Intermediate directories which are not explicitly declared are
+    created on the fly, as an archive extraction would.
+
+    Contents can be declared as futures (of their :class:`Content`
+    data) while they are being hashed: they are only waited for when
+    the directory is built.
+
+    When sinks are provided, the objects are handed over to them as soon
+    as they are computed: the contents once hashed, the directories once
+    built. The builder then only keeps the contents' hashes, not their
+    data, and at most `max_pending` contents being hashed.
+
+    The identical contents and subtrees of the tree share the same node,
+    and are only handed over once to the sinks (and collected once).
+
+    Args:
+        content_sink (callable): called with the data of each content
+        directory_sink (callable): called with the data of each directory
+        max_pending (int): maximum number of contents being hashed when
+          a content_sink is provided
+
+    """
+    def __init__(self, content_sink=None, directory_sink=None,
+                 max_pending=MAX_PENDING_CONTENTS):
+        # directory path -> {entry name: Content (or Future of its data),
+        # or None for a sub-directory}
+        self.dirs = {b'': {}}
+        self.content_sink = content_sink
+        self.directory_sink = directory_sink
+        self.max_pending = max_pending
+        self.pending = collections.deque()
+        # sha1_git of the contents handed over
+        self.sunk = set()
+
+    def _parent(self, path):
+        """Return the entries of path's parent directory, creating it (and
+           its own parents) if need be.
+
+        """
+        parent, _, name = path.rpartition(b'/')
+        if parent not in self.dirs:
+            self.add_directory(parent)
+        return self.dirs[parent], name
+
+    def _sink_content(self, path, content):
+        """Hand over content to the content sink, only keeping its hashes
+           at path (unless it was replaced meanwhile).
+
+        """
+        data = content.result() if isinstance(content, Future) \
+            else content.data
+        # hard links to contents already handed over carry no data
+        if (any(key in data for key in DATA_KEYS) or
+                data.get('status') == SKIPPED_STATUS) and \
+           data['sha1_git'] not in self.sunk:
+            self.sunk.add(data['sha1_git'])
+            self.content_sink(data)
+        entries, name = self._parent(path)
+        if entries.get(name) is content:
+            entries[name] = Content(
+                {k: v for k, v in data.items() if k != 'data'})
+
+    def add_directory(self, path):
+        """Declare the directory path (no-op if it already exists)."""
+        if path in self.dirs:
+            return
+        entries, name = self._parent(path)
+        if entries.get(name) is not None:
+            raise ValueError('Conflicting archive member %r' % path)
+        entries[name] = None
+        self.dirs[path] = {}
+
+    def add_content(self, path, content):
+        """Declare the content at path (the last declaration wins)."""
+        if path in self.dirs:
+            raise ValueError('Conflicting archive member %r' % path)
+        entries, name = self._parent(path)
+        entries[name] = content
+        if self.content_sink is None:
+            return
+        if isinstance(content, Future):
+            self.pending.append((path, content))
+            while len(self.pending) > self.max_pending:
+                self._sink_content(*self.pending.popleft())
+        else:
+            self._sink_content(path, content)
+
+    def get(self, path):
+        """Return the content previously declared at path, if any."""
+        parent, _, name = path.rpartition(b'/')
+        content = self.dirs.get(parent, {}).get(name)
+        if isinstance(content, Future):
+            content = Content(content.result())
+        return content
+
+    def build(self):
+        """Compute the :class:`Directory` model of the whole tree.
+
+        Directories are built bottom-up so that no recursion is involved,
+        whatever the depth of the tree.
+
+        """
+        while self.pending:
+            self._sink_content(*self.pending.popleft())
+
+        def depth(path):
+            return path.count(b'/') + 1 if path else 0
+
+        nodes = {}
+        # (sha1_git, perms) -> Content, id -> Directory
+        contents = {}
+        directories = {}
+        for path in sorted(self.dirs, key=depth, reverse=True):
+            entries = {}
+            for name, child in self.dirs[path].items():
+                if child is None:
+                    child = nodes.pop(path + b'/' + name if path else name)
+                else:
+                    if isinstance(child, Future):
+                        child = Content(child.result())
+                    child = contents.setdefault(
+                        (child.hash, child.data['perms']), child)
+                entries[name] = child
+            directory = Directory({'name': os.path.basename(path)})
+            directory.update(entries)
+            known = directories.get(directory.hash)
+            if known is not None:
+                # an identical subtree was already built (and handed over)
+                directory = known
+            else:
+                directories[directory.hash] = directory
+                if self.directory_sink is not None:
+                    self.directory_sink(directory.get_data())
+            nodes[path] = directory
+        return nodes[b'']
+
+
+def directory_from_tarfile(tar, executor=None, content_sink=None,
+                           directory_sink=None, lazy=False, hash_cache=None,
+                           max_content_size=None, limits=None):
+    """Compute the :class:`Directory` model of an opened tarfile.
+
+    The tarfile is consumed sequentially so that it can be opened in
+    stream mode (e.g. ``r|*``).
+
+    Args:
+        tar (tarfile.TarFile): the archive to read members from
+        executor (concurrent.futures.Executor): optional pool hashing
+          the regular files concurrently
+        content_sink (callable): called with the data of each content
+        directory_sink (callable): called with the data of each directory
+        lazy (bool): whether to keep the offset of the regular files in
+          the uncompressed archive instead of their data
+        hash_cache (ContentHashCache): optional cache of the hashes of
+          the regular files
+        max_content_size (int): size (from their header) from which the
+          regular files are only hashed, as skipped contents
+        limits (ArchiveLimits): optional limits of the archive, checked
+          before each member is read
+
+    Raises:
+        ArchiveLimitExceeded if the archive exceeds its limits
+
+    Returns:
+        the :class:`Directory` holding the archive's tree
+
+    """
+    builder = DirectoryBuilder(content_sink=content_sink,
+                               directory_sink=directory_sink)
+    for member in tar:
+        path = normalize_name(member.name)
+        if path is None or path == b'':
+            continue
+        if limits is not None:
+            limits.add_member(path, member.size if member.isreg() else 0)
+        if member.isdir():
+            builder.add_directory(path)
+        elif member.issym():
+            content = Content.from_bytes(
+                mode=stat.S_IFLNK | member.mode,
+                data=os.fsencode(member.linkname))
+            builder.add_content(path, content)
+        elif member.islnk():
+            # hard links can only target an already read member
+            target = builder.get(normalize_name(member.linkname) or b'')
+            if not isinstance(target, Content):
+                raise ValueError('Dangling hard link %r' % member.name)
+            data = target.data.copy()
+            data['perms'] = mode_to_perms(regular_file_mode(member.mode))
+            builder.add_content(path, Content(data))
+        elif member.isreg():
+            # the data of sparse files is not contiguous in the archive
+            offset = member.offset_data \
+                if lazy and not member.issparse() else None
+            content = content_from_stream(
+                tar.extractfile(member), mode=regular_file_mode(member.mode),
+                length=member.size, executor=executor, offset=offset,
+                hash_cache=hash_cache, max_content_size=max_content_size)
+            builder.add_content(path, content)
+        else:
+            # fifo and devices are materialized as empty contents
+            content = Content.from_bytes(mode=member.mode, data=b'')
+            builder.add_content(path, content)
+    return builder.build()
+
+
+def is_tarball(tarpath, external_decompression=False):
+    """Check whether tarpath is a (possibly compressed) tarball.
+
+    Args:
+        tarpath (str): path to the file to check
+        external_decompression (bool): whether to use the external
+          decompressors when they are installed
+
+    """
+    try:
+        with open_uncompressed(tarpath, external=external_decompression,
+                               check=False) as fobj:
+            with tarfile.open(fileobj=fobj, mode='r|'):
+                return True
+    except (tarfile.TarError, EOFError, OSError, ValueError, zlib.error,
+            lzma.LZMAError):
+        return False
+
+
+def directory_from_tarball(tarpath, executor=None, content_sink=None,
+                           directory_sink=None, lazy=False,
+                           external_decompression=False, hash_cache=None,
+                           max_content_size=None, limits=None):
+    """Compute the :class:`Directory` model of the tarball at tarpath,
+       without extracting it.
+
+    Args:
+        tarpath (str): path to the (possibly compressed) tarball
+        executor (concurrent.futures.Executor): optional pool hashing
+          the regular files concurrently
+        content_sink (callable): called with the data of each content
+        directory_sink (callable): called with the data of each directory
+        lazy (bool): whether to keep the offset of the regular files in
+          the uncompressed archive instead of their data
+        external_decompression (bool): whether to use the external
+          decompressors when they are installed
+        hash_cache (ContentHashCache): optional cache of the hashes of
+          the regular files
+        max_content_size (int): size from which the regular files are
+          only hashed, as skipped contents
+        limits (ArchiveLimits): optional limits of the archive
+
+    Raises:
+        ValueError when the archive cannot be read (ArchiveLimitExceeded
+        when it exceeds its limits)
+
+    Returns:
+        the :class:`Directory` holding the archive's tree
+
+    """
+    try:
+        with open_uncompressed(
+                tarpath, external=external_decompression) as fobj:
+            with tarfile.open(fileobj=fobj, mode='r|') as tar:
+                return directory_from_tarfile(
+                    tar, executor=executor, content_sink=content_sink,
+                    directory_sink=directory_sink, lazy=lazy,
+                    hash_cache=hash_cache, max_content_size=max_content_size,
+                    limits=limits)
+    except (tarfile.TarError, EOFError, OSError, zlib.error,
+            lzma.LZMAError) as e:
+        raise ValueError('Problem during streaming %s. Reason: %s' % (
+            tarpath, e))
+
+
+class ContentReader:
+    """Read the data of contents from the tarball they were computed from
+       with ``lazy=True``.
+
+    The contents are read in the order of their offset in the archive, so
+    that the archive is only uncompressed once per batch of contents.
+
+    Args:
+        tarpath (str): path to the (possibly compressed) tarball
+        external_decompression (bool): whether to use the external
+          decompressors when they are installed
+
+    """
+    def __init__(self, tarpath, external_decompression=False):
+        self.tarpath = tarpath
+        self.external_decompression = external_decompression
+
+    def read(self, contents):
+        """Yield contents along with their data.
+
+        Args:
+            contents (Iterable[dict]): contents holding an archive_offset
+
+        Raises:
+            ValueError if the data read does not match the content
+
+        Yields:
+            the contents holding their data instead of archive_offset
+
+        """
+        contents = sorted(contents, key=lambda c: c['archive_offset'])
+        if not contents:
+            return
+        with open_uncompressed(self.tarpath,
+                               external=self.external_decompression,
+                               check=False) as fobj:
+            position = 0
+            for content in contents:
+                content = content.copy()
+                offset = content.pop('archive_offset')
+                # forward seek (the file object may be a pipe)
+                while position < offset:
+                    skipped = fobj.read(min(offset - position,
+                                            HASH_BLOCK_SIZE))
+                    if not skipped:
+                        break
+                    position += len(skipped)
+                content['data'] = fobj.read(content['length'])
+                position += len(content['data'])
+                if hashlib.sha1(content['data']).digest() != \
+                   content['sha1']:
+                    raise ValueError('Mismatched content at offset %s in %s'
+                                     % (offset, self.tarpath))
+                yield content
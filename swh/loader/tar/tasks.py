@@ -1,17 +1,76 @@
-# Copyright (C) 2015-2018  The Software Heritage developers
+# Copyright (C) 2015-2019  The Software Heritage developers
 # See the AUTHORS file at the top-level directory of this distribution
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
 from celery import current_app as app
 
-from swh.loader.tar.loader import RemoteTarLoader
+from swh.loader.tar.loader import MultiRemoteTarLoader, RemoteTarLoader
+from swh.loader.tar.pool import loaders
 
 
-@app.task(name=__name__ + '.LoadTarRepository')
-def load_tar(origin, visit_date, last_modified):
+def admit_and_load(task, loader_class, urls, size, **kwargs):
+    """Load with a loader of loader_class, subject to its admission
+       control (if configured) according to the size of the artifacts:
+
+    - the task is routed to the queue of the large artifacts if they are
+      large (and it is not already served from that queue)
+    - the task is retried later if the artifacts do not fit in the byte
+      budget of the worker
+
+    Args:
+        task: the bound celery task
+        loader_class (type): class of the loader
+        urls (callable): returns the urls of the artifacts
+        size (int): total size of the artifacts, if known (e.g. by the
+          lister), otherwise it is requested
+        kwargs: arguments of the load
+
+    """
+    with loaders.loader(loader_class) as loader:
+        admission = loader.admission
+        if admission is None:
+            return loader.load(**kwargs)
+        size = admission.artifacts_size(urls(), size)
+        delivery_info = task.request.delivery_info or {}
+        reroute = admission.is_large(size) and \
+            delivery_info.get('routing_key') != admission.large_queue
+        if not reroute:
+            reservation = admission.reserve(size)
+            if reservation is not None:
+                with reservation:
+                    return loader.load(**kwargs)
+    # the loader is given back to the pool before the task is deferred
+    if reroute:
+        return task.replace(task.signature(
+            task.request.args, task.request.kwargs,
+            queue=admission.large_queue))
+    raise task.retry(countdown=admission.retry_delay, max_retries=None)
+
+
+@app.task(name=__name__ + '.LoadTarRepository', bind=True)
+def load_tar(self, origin, visit_date, last_modified, size=None):
     """Import a remote or local archive to Software Heritage
+
+    The size of the archive (if known) spares a request for the
+    admission control of the task.
+
     """
-    loader = RemoteTarLoader()
-    return loader.load(
+    return admit_and_load(
+        self, RemoteTarLoader, lambda: [origin['url']], size,
         origin=origin, visit_date=visit_date, last_modified=last_modified)
+
+
+@app.task(name=__name__ + '.LoadTarArtifacts', bind=True)
+def load_tar_artifacts(self, origin, visit_date, artifacts, size=None):
+    """Import many remote or local archives of the same origin to Software
+       Heritage, in a single visit
+
+    The total size of the archives (if known) spares requests for the
+    admission control of the task.
+
+    """
+    return admit_and_load(
+        self, MultiRemoteTarLoader,
+        lambda: [url for url, _ in artifacts], size,
+        origin=origin, visit_date=visit_date, artifacts=artifacts)
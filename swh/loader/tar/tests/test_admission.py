@@ -0,0 +1,107 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import json
+
+import requests_mock
+
+from swh.loader.tar.admission import AdmissionControl, ByteBudget
+
+
+URL = 'https://nowhere.org/some-tarball.tar.gz'
+
+
+def _budget(tmpdir, budget=100):
+    return ByteBudget(str(tmpdir.join('budget.json')), budget)
+
+
+def test_budget(tmpdir):
+    budget = _budget(tmpdir)
+
+    token = budget.try_reserve(60)
+    assert token is not None
+    assert budget.try_reserve(60) is None
+    token2 = budget.try_reserve(40)
+    assert token2 is not None
+    assert budget.used() == 100
+
+    budget.release(token)
+    assert budget.used() == 40
+    # another process using the same file shares the budget
+    assert _budget(tmpdir).try_reserve(61) is None
+    assert _budget(tmpdir).try_reserve(60) is not None
+
+
+def test_budget_exceeded_alone(tmpdir):
+    budget = _budget(tmpdir)
+
+    token = budget.try_reserve(1000)
+
+    assert token is not None
+    assert budget.try_reserve(1) is None
+    budget.release(token)
+    assert budget.try_reserve(1) is not None
+
+
+def test_budget_dead_process(tmpdir):
+    budget = _budget(tmpdir)
+    budget.try_reserve(100)
+    with open(budget.path) as f:
+        reservations = json.load(f)
+    # a process which no longer exists
+    reservations = {token: (2 ** 22 + 1, size)
+                    for token, (_, size) in reservations.items()}
+    with open(budget.path, 'w') as f:
+        json.dump(reservations, f)
+
+    assert budget.used() == 0
+    assert budget.try_reserve(100) is not None
+
+
+def test_artifact_size(tmpdir):
+    path = tmpdir.join('archive.tar.gz')
+    path.write_binary(b'some data')
+    admission = AdmissionControl(str(tmpdir.join('budget.json')))
+
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.head(URL, headers={'content-length': '1234'})
+        mock_requests.head(URL + '.missing', status_code=404)
+
+        assert admission.artifact_size('file://%s' % path) == 9
+        assert admission.artifact_size(URL) == 1234
+        assert admission.artifact_size(URL + '.missing') is None
+    assert admission.artifact_size('file:///nowhere') is None
+
+    # the size given by the lister spares the requests
+    assert admission.artifacts_size([URL], 42) == 42
+    assert admission.artifacts_size(['file://%s' % path] * 2) == 18
+
+
+def test_is_large(tmpdir):
+    admission = AdmissionControl(str(tmpdir.join('budget.json')),
+                                 large_size=100, large_queue='large')
+
+    assert admission.is_large(100)
+    assert not admission.is_large(99)
+    assert not AdmissionControl(
+        str(tmpdir.join('budget.json'))).is_large(2 ** 40)
+
+
+def test_reserve(tmpdir):
+    admission = AdmissionControl(str(tmpdir.join('budget.json')),
+                                 budget=100)
+
+    with admission.reserve(60):
+        assert admission.budget.used() == 60
+        assert admission.reserve(60) is None
+    assert admission.budget.used() == 0
+
+
+def test_reserve_without_budget(tmpdir):
+    admission = AdmissionControl(str(tmpdir.join('budget.json')))
+
+    with admission.reserve(2 ** 40):
+        with admission.reserve(2 ** 40):
+            pass
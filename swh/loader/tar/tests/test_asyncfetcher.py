@@ -0,0 +1,158 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import re
+import threading
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import pytest
+
+from swh.model.hashutil import MultiHash
+
+from swh.loader.tar.cache import ArtifactCache
+from swh.loader.tar.fetcher import ArchiveFetcher
+
+pytest.importorskip('aiohttp')
+
+from swh.loader.tar.asyncfetcher import AsyncArchiveFetcher  # noqa
+
+
+DATA = bytes(range(256)) * 40
+
+
+class ArchiveServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    data = DATA
+    etag = '"v1"'
+    accept_ranges = True
+
+
+class ArchiveHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if self.path != '/archive.tar.gz':
+            self.send_error(404)
+            return
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+        data = server.data
+        match = re.match(r'bytes=(\d+)-(\d+)', self.headers.get('Range', ''))
+        if_range = self.headers.get('If-Range')
+        if server.accept_ranges and match and \
+           (if_range is None or if_range == server.etag):
+            start, end = int(match.group(1)), int(match.group(2))
+            if start >= len(data):
+                self.send_error(416)
+                return
+            end = min(end, len(data) - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes %s-%s/%s' % (
+                start, end, len(data)))
+            data = data[start:end + 1]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('ETag', server.etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server():
+    server = ArchiveServer(('127.0.0.1', 0), ArchiveHandler)
+    server.requests = []
+    thread = threading.Thread(target=server.serve_forever,
+                              kwargs={'poll_interval': 0.01}, daemon=True)
+    thread.start()
+    server.url = 'http://127.0.0.1:%s/archive.tar.gz' % server.server_port
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _fetcher(tmpdir, cache=None, **kwargs):
+    fetcher = ArchiveFetcher(temp_directory=str(tmpdir), cache=cache)
+    return AsyncArchiveFetcher(fetcher, **kwargs)
+
+
+def _check_download(filepath, hashes, data):
+    with open(filepath, 'rb') as f:
+        assert f.read() == data
+    assert hashes == {'length': len(data),
+                      **MultiHash.from_data(data).hexdigest()}
+
+
+def test_download_by_parts(tmpdir, server):
+    fetcher = _fetcher(tmpdir, range_workers=3, range_size=1000)
+
+    filepath, hashes = fetcher.download(server.url)
+
+    _check_download(filepath, hashes, DATA)
+    assert len(server.requests) == 11
+    assert all(r.get('If-Range') == server.etag for r in server.requests[1:])
+
+
+def test_download_without_range_support(tmpdir, server):
+    server.accept_ranges = False
+    fetcher = _fetcher(tmpdir, range_workers=3, range_size=1000)
+
+    filepath, hashes = fetcher.download(server.url)
+
+    _check_download(filepath, hashes, DATA)
+    assert len(server.requests) == 1
+
+
+def test_download_empty(tmpdir, server):
+    server.data = b''
+    fetcher = _fetcher(tmpdir)
+
+    filepath, hashes = fetcher.download(server.url)
+
+    _check_download(filepath, hashes, b'')
+
+
+def test_download_changed(tmpdir, server, monkeypatch):
+    fetcher = _fetcher(tmpdir, range_workers=3, range_size=1000)
+    original_do_get = ArchiveHandler.do_GET
+
+    def do_get(handler):
+        # the archive is replaced once its first part was served
+        if len(server.requests) == 1:
+            server.etag = '"v2"'
+        original_do_get(handler)
+
+    monkeypatch.setattr(ArchiveHandler, 'do_GET', do_get)
+
+    with pytest.raises(ValueError, match='changed during its download'):
+        fetcher.download(server.url)
+
+
+def test_download_failure(tmpdir, server):
+    fetcher = _fetcher(tmpdir)
+
+    with pytest.raises(ValueError, match='Fail to query'):
+        fetcher.download(server.url.replace('archive', 'missing'))
+
+
+def test_download_revalidates_cache(tmpdir, server):
+    cache = ArtifactCache(str(tmpdir.join('cache')), max_size=100000)
+    first = tmpdir.mkdir('first')
+    filepath, hashes = _fetcher(first, cache).download(server.url)
+    assert cache.get(server.url)['hashes'] == hashes
+
+    second = tmpdir.mkdir('second')
+    filepath, hashes = _fetcher(second, cache).download(server.url)
+
+    assert server.requests[-1]['If-None-Match'] == server.etag
+    assert filepath.startswith(str(second))
+    _check_download(filepath, hashes, DATA)
@@ -56,3 +56,26 @@ class TestBuildUtils(unittest.TestCase):
             'seconds': 1445348286,
             'microseconds': 0
         })
+
+    def test_compute_snapshot(self):
+        revision_ids = [b'\x01' * 20, b'\x02' * 20]
+
+        actual_snapshot = build.compute_snapshot({
+            b'foo-1.0.tar.gz': revision_ids[0],
+            b'foo-1.1.tar.gz': revision_ids[1],
+        })
+
+        self.assertEqual(actual_snapshot['branches'], {
+            b'foo-1.0.tar.gz': {
+                'target': revision_ids[0],
+                'target_type': 'revision',
+            },
+            b'foo-1.1.tar.gz': {
+                'target': revision_ids[1],
+                'target_type': 'revision',
+            },
+        })
+        self.assertEqual(len(actual_snapshot['id']), 20)
+        self.assertNotEqual(
+            actual_snapshot['id'],
+            build.compute_snapshot({b'foo-1.0.tar.gz': revision_ids[0]})['id'])
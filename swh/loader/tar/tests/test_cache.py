@@ -0,0 +1,94 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import os
+
+import requests_mock
+
+from swh.loader.tar.cache import ArtifactCache
+from swh.loader.tar.fetcher import ArchiveFetcher
+
+
+URL = 'https://nowhere.org/some-tarball.tar.gz'
+DATA = b'some tarball content'
+
+
+def _add(cache, tmpdir, url, data, mtime=None, **headers):
+    filepath = str(tmpdir.join('downloaded'))
+    with open(filepath, 'wb') as f:
+        f.write(data)
+    cache.add(url, filepath, hashes={'length': len(data)}, headers=headers)
+    os.unlink(filepath)
+    if mtime is not None:
+        entry = cache.get(url)
+        os.utime(entry['path'] + '.json', (mtime, mtime))
+
+
+def test_cache_get_add(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), max_size=100)
+    assert cache.get(URL) is None
+
+    _add(cache, tmpdir, URL, DATA, ETag='"abc"', **{'Last-Modified': 'lm'})
+
+    entry = cache.get(URL)
+    assert entry['hashes'] == {'length': len(DATA)}
+    with open(entry['path'], 'rb') as f:
+        assert f.read() == DATA
+    assert cache.validators(entry) == {
+        'If-None-Match': '"abc"',
+        'If-Modified-Since': 'lm',
+    }
+
+
+def test_cache_lru_eviction(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), max_size=25)
+
+    _add(cache, tmpdir, URL + '1', b'1' * 10, mtime=1)
+    _add(cache, tmpdir, URL + '2', b'2' * 10, mtime=3)
+    # exceeds the budget, the least recently used entry gets evicted
+    _add(cache, tmpdir, URL + '3', b'3' * 10)
+
+    assert cache.get(URL + '1') is None
+    assert cache.get(URL + '2') is not None
+    assert cache.get(URL + '3') is not None
+
+
+def test_cache_too_large(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), max_size=5)
+
+    _add(cache, tmpdir, URL, DATA)
+
+    assert cache.get(URL) is None
+
+
+def test_fetcher_revalidates_cache(tmpdir):
+    cache = ArtifactCache(str(tmpdir.join('cache')), max_size=100)
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(URL, content=DATA, headers={
+            'content-length': str(len(DATA)),
+            'ETag': '"abc"',
+        })
+        mock_requests.get(URL, status_code=304,
+                          request_headers={'If-None-Match': '"abc"'})
+
+        temp_directory = tmpdir.mkdir('first')
+        fetcher = ArchiveFetcher(temp_directory=str(temp_directory),
+                                 cache=cache)
+        filepath, hashes = fetcher.download(URL)
+        assert cache.get(URL)['hashes'] == hashes
+
+        temp_directory = tmpdir.mkdir('second')
+        fetcher = ArchiveFetcher(temp_directory=str(temp_directory),
+                                 cache=cache)
+        filepath2, hashes2 = fetcher.download(URL)
+
+        assert mock_requests.call_count == 2
+        last_headers = mock_requests.last_request.headers
+        assert last_headers['If-None-Match'] == '"abc"'
+
+    assert hashes2 == hashes
+    assert filepath2.startswith(str(temp_directory))
+    with open(filepath2, 'rb') as f:
+        assert f.read() == DATA
@@ -0,0 +1,90 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import gzip
+import lzma
+
+import pytest
+
+from swh.loader.tar import decompress
+
+
+DATA = b'some data to compress\n' * 1000
+
+
+def _write(tmpdir, name, data):
+    path = tmpdir.join(name)
+    path.write_binary(data)
+    return str(path)
+
+
+def test_detect_compression():
+    assert decompress.detect_compression(gzip.compress(b'')) == 'gz'
+    assert decompress.detect_compression(lzma.compress(b'')) == 'xz'
+    assert decompress.detect_compression(b'BZh91AY') == 'bz2'
+    assert decompress.detect_compression(b'\x28\xb5\x2f\xfd\x00') == 'zst'
+    assert decompress.detect_compression(b'plain data') is None
+
+
+def test_is_supported():
+    assert decompress.is_supported(None)
+    assert decompress.is_supported('gz')
+    assert not decompress.is_supported('zst')
+    assert not decompress.is_supported('unknown', external=True)
+
+
+@pytest.mark.parametrize('external', [False, True])
+@pytest.mark.parametrize('name,compress', [
+    ('plain', lambda data: data),
+    ('data.gz', gzip.compress),
+    ('data.xz', lzma.compress),
+])
+def test_open_uncompressed(tmpdir, external, name, compress):
+    path = _write(tmpdir, name, compress(DATA))
+
+    with decompress.open_uncompressed(path, external=external) as f:
+        assert f.read() == DATA
+
+
+@pytest.mark.skipif(not decompress.external_command('gz'),
+                    reason='gzip not installed')
+def test_open_uncompressed_external_failure(tmpdir):
+    path = _write(tmpdir, 'truncated.gz', gzip.compress(DATA)[:100])
+
+    with pytest.raises(ValueError, match='failed'):
+        with decompress.open_uncompressed(path, external=True) as f:
+            f.read()
+
+
+def test_open_uncompressed_unsupported(tmpdir, monkeypatch):
+    monkeypatch.setitem(decompress.EXTERNAL_DECOMPRESSORS, 'zst', [])
+    path = _write(tmpdir, 'data.zst', b'\x28\xb5\x2f\xfd' + DATA)
+
+    with pytest.raises(ValueError, match='Unsupported compression'):
+        with decompress.open_uncompressed(path, external=True):
+            pass
+
+
+@pytest.mark.skipif(not decompress.external_command('gz'),
+                    reason='gzip not installed')
+def test_external_decompressor_feed():
+    decompressor = decompress.ExternalDecompressor(
+        decompress.external_command('gz'))
+    compressed = gzip.compress(DATA)
+    decompressor.feed(compressed[i:i + 100]
+                      for i in range(0, len(compressed), 100))
+
+    assert decompressor.stdout.read() == DATA
+    decompressor.close()
+
+
+def test_uncompress_to(tmpdir):
+    path = _write(tmpdir, 'data.xz', lzma.compress(DATA))
+    dest = str(tmpdir.join('data'))
+
+    decompress.uncompress_to(path, dest, external=True)
+
+    with open(dest, 'rb') as f:
+        assert f.read() == DATA
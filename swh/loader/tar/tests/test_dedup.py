@@ -0,0 +1,136 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import hashlib
+import io
+import tarfile
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+from swh.model.hashutil import MultiHash
+
+from swh.loader.tar import dedup, hashcache
+from swh.loader.tar.stream import directory_from_tarball
+
+DATA = b'some data\n' * 1000
+LICENSE = b'license terms\n' * 1000
+
+
+def _add_file(tar, name, data):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mode = 0o644
+    tar.addfile(info, io.BytesIO(data))
+
+
+def _make_tarball(path):
+    with tarfile.open(path, 'w') as tar:
+        for project in ('project', 'project/vendor/lib1',
+                        'project/vendor/lib2'):
+            _add_file(tar, project + '/LICENSE', LICENSE)
+            _add_file(tar, project + '/src/data.txt', DATA)
+        _add_file(tar, 'project/other.txt', DATA[::-1])
+
+
+def test_hashes_duplicates():
+    cache = dedup.ArchiveHashCache()
+    expected = MultiHash.from_data(DATA).digest()
+
+    assert cache.hashes(DATA) == expected
+    with patch.object(dedup, 'MultiHash') as multihash:
+        assert cache.hashes(DATA) == expected
+    multihash.from_data.assert_not_called()
+    assert cache.counters() == {
+        'duplicate_contents': 1,
+        'duplicate_bytes': len(DATA),
+    }
+
+
+def test_hashes_same_length():
+    cache = dedup.ArchiveHashCache()
+    other = DATA[::-1]
+
+    cache.hashes(DATA)
+    assert cache.hashes(other) == MultiHash.from_data(other).digest()
+    assert cache.hits == 0
+
+
+def test_hashes_sha1_collision():
+    """Contents of the same length whose SHA1s collide are told apart"""
+    cache = dedup.ArchiveHashCache()
+    other = DATA[::-1]
+    collision = SimpleNamespace(digest=lambda: b'\x00' * 20)
+
+    def colliding_hashes(data):
+        hashes = MultiHash.from_data(data).digest()
+        hashes['sha1'] = collision.digest()
+        return SimpleNamespace(digest=lambda: hashes)
+
+    with patch.object(dedup, 'MultiHash',
+                      SimpleNamespace(from_data=colliding_hashes)), \
+            patch.object(dedup, 'hashlib', SimpleNamespace(
+                sha1=lambda data: collision, sha256=hashlib.sha256)):
+        cache.hashes(DATA)
+        hashes = cache.hashes(other)
+
+    assert hashes['sha256'] == hashlib.sha256(other).digest()
+    assert cache.hits == 0
+
+
+def test_hashes_small_contents():
+    cache = dedup.ArchiveHashCache()
+    data = b'small'
+
+    assert cache.hashes(data) == cache.hashes(data) == \
+        MultiHash.from_data(data).digest()
+    assert cache.hits == 0
+
+
+def test_hashes_returns_copies():
+    cache = dedup.ArchiveHashCache()
+    cache.hashes(DATA)['length'] = 0
+
+    assert 'length' not in cache.hashes(DATA)
+
+
+def test_hashes_parent(tmpdir):
+    parent = hashcache.ContentHashCache(str(tmpdir.join('hashes.sqlite')),
+                                        max_entries=100)
+    cache = dedup.ArchiveHashCache(parent=parent)
+
+    cache.hashes(DATA)
+
+    assert parent.get(hashcache.fingerprint(DATA)) == \
+        MultiHash.from_data(DATA).digest()
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_directory_from_tarball_dedup(tmpdir, workers):
+    tarpath = str(tmpdir.join('archive.tar'))
+    _make_tarball(tarpath)
+    expected = directory_from_tarball(tarpath)
+    cache = dedup.ArchiveHashCache()
+    contents, directories = [], []
+
+    executor = ThreadPoolExecutor(workers) if workers else None
+    actual = directory_from_tarball(
+        tarpath, executor=executor, hash_cache=cache,
+        content_sink=contents.append, directory_sink=directories.append)
+    if executor:
+        executor.shutdown()
+
+    assert actual.hash == expected.hash
+    # LICENSE and data.txt are hashed once (and sent once)
+    assert cache.hits == 4
+    assert sorted(c['data'] for c in contents) == sorted(
+        [LICENSE, DATA, DATA[::-1]])
+    # the identical src directories and vendored projects are sent once:
+    # src, a vendored project, vendor, project and the root
+    assert len(directories) == len({d['id'] for d in directories}) == 5
+    assert directories[-1]['id'] == actual.hash
@@ -0,0 +1,99 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import io
+import os
+import tarfile
+
+import pytest
+
+from swh.core import tarball
+from swh.model.from_disk import Directory
+
+from swh.loader.tar.extract import extract_tarball
+from swh.loader.tar.hashing import directory_from_disk
+
+
+SAMPLE_TARBALL = os.path.join(
+    os.path.dirname(__file__), 'resources', 'sample-folder.tgz')
+
+LARGE = b'large data\n' * 1000
+
+
+def _add_member(tar, name, data=None, **kwargs):
+    info = tarfile.TarInfo(name)
+    for k, v in kwargs.items():
+        setattr(info, k, v)
+    if data is not None:
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    else:
+        tar.addfile(info)
+
+
+def _make_tarball(path):
+    with tarfile.open(path, 'w') as tar:
+        _add_member(tar, 'top/', type=tarfile.DIRTYPE, mode=0o555)
+        _add_member(tar, 'top/small', b'small data\n', mode=0o644)
+        _add_member(tar, 'top/images/disk.img', LARGE, mode=0o755)
+        _add_member(tar, 'top/copy.img', type=tarfile.LNKTYPE,
+                    linkname='top/images/disk.img', mode=0o644)
+        _add_member(tar, 'top/link', type=tarfile.SYMTYPE,
+                    linkname='images/disk.img')
+
+
+def test_extract_tarball_same_as_uncompress(tmpdir):
+    tarball.uncompress(SAMPLE_TARBALL, str(tmpdir.join('expected')))
+    expected = Directory.from_disk(
+        path=str(tmpdir.join('expected')).encode('utf-8'))
+
+    skipped = extract_tarball(SAMPLE_TARBALL, str(tmpdir.join('actual')),
+                              max_content_size=1000)
+    actual = Directory.from_disk(
+        path=str(tmpdir.join('actual')).encode('utf-8'))
+
+    assert skipped == {}
+    assert actual.hash == expected.hash
+
+
+def test_extract_tarball_skips_large_contents(tmpdir):
+    tarpath = str(tmpdir.join('archive.tar'))
+    _make_tarball(tarpath)
+    tarball.uncompress(tarpath, str(tmpdir.join('expected')))
+    expected = Directory.from_disk(
+        path=str(tmpdir.join('expected')).encode('utf-8'))
+
+    dest = str(tmpdir.join('actual'))
+    skipped = extract_tarball(tarpath, dest, max_content_size=1000)
+
+    assert sorted(skipped) == [b'top/copy.img', b'top/images/disk.img']
+    assert not os.path.exists(os.path.join(dest, 'top/images/disk.img'))
+    assert not os.path.exists(os.path.join(dest, 'top/copy.img'))
+    for data in skipped.values():
+        assert data['status'] == 'absent'
+        assert data['length'] == len(LARGE)
+        assert 'data' not in data
+    # the hard link's mode applies to its target too
+    assert skipped[b'top/images/disk.img']['perms'] == 0o100644
+    assert skipped[b'top/copy.img']['perms'] == 0o100644
+
+    actual = directory_from_disk(dest.encode('utf-8'), contents=skipped)
+    assert actual.hash == expected.hash
+
+
+def test_extract_tarball_hard_link_outside(tmpdir):
+    outside = tmpdir.join('outside')
+    outside.write(b'secret')
+    tarpath = str(tmpdir.join('archive.tar'))
+    with tarfile.open(tarpath, 'w') as tar:
+        _add_member(tar, 'top/small', b'small data\n', mode=0o644)
+        _add_member(tar, 'top/leak', type=tarfile.LNKTYPE,
+                    linkname='../outside', mode=0o644)
+    dest = str(tmpdir.join('actual'))
+
+    with pytest.raises(ValueError, match='outside of the archive'):
+        extract_tarball(tarpath, dest, max_content_size=1000)
+
+    assert not os.path.exists(os.path.join(dest, 'top/leak'))
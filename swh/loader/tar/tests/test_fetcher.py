@@ -0,0 +1,46 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import os
+
+from swh.model import hashutil
+
+from swh.loader.tar.fetcher import (
+    LOCAL_CHUNK_SIZE, ArchiveFetcher, LocalResponse, hash_file
+)
+
+
+def test_local_response_chunks(tmpdir):
+    path = tmpdir.join('archive')
+    path.write_binary(b'line\n' * 1000)
+
+    chunks = list(LocalResponse(str(path)).iter_content(chunk_size=1024))
+
+    assert [len(chunk) for chunk in chunks] == [1024] * 4 + [904]
+    assert b''.join(chunks) == b'line\n' * 1000
+
+
+def test_hash_file(tmpdir):
+    data = os.urandom(3 * LOCAL_CHUNK_SIZE // 2)
+    path = tmpdir.join('archive')
+    path.write_binary(data)
+
+    assert hash_file(str(path)) == {
+        'length': len(data),
+        **hashutil.MultiHash.from_data(data).hexdigest()
+    }
+
+
+def test_download_local_artifact_in_place(tmpdir):
+    path = tmpdir.join('archive.tar.gz')
+    path.write_binary(b'some data')
+    temp_directory = tmpdir.mkdir('temp')
+    fetcher = ArchiveFetcher(temp_directory=str(temp_directory))
+
+    filepath, hashes = fetcher.download('file://%s' % path)
+
+    assert filepath == str(path)
+    assert hashes == hash_file(str(path))
+    assert temp_directory.listdir() == []
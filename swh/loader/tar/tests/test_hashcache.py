@@ -0,0 +1,124 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import io
+import sqlite3
+import tarfile
+import time
+
+from unittest.mock import patch
+
+from swh.core import tarball
+from swh.model.from_disk import Directory
+from swh.model.hashutil import MultiHash
+
+from swh.loader.tar import hashcache
+from swh.loader.tar.hashing import directory_from_disk
+from swh.loader.tar.stream import directory_from_tarball
+
+DATA = b'some data\n' * 1000
+
+
+def _cache(tmpdir, max_entries=100):
+    return hashcache.ContentHashCache(
+        str(tmpdir.join('hashes.sqlite')), max_entries=max_entries)
+
+
+def test_hashes(tmpdir):
+    cache = _cache(tmpdir)
+    expected = MultiHash.from_data(DATA).digest()
+
+    assert cache.hashes(DATA) == expected
+    with patch.object(hashcache, 'MultiHash') as multihash:
+        assert cache.hashes(DATA) == expected
+    multihash.from_data.assert_not_called()
+
+
+def test_hashes_persistent(tmpdir):
+    cache = _cache(tmpdir)
+    cache.hashes(DATA)
+    cache.close()
+
+    cache = _cache(tmpdir)
+    assert cache.get(hashcache.fingerprint(DATA)) == \
+        MultiHash.from_data(DATA).digest()
+
+
+def test_hashes_small_contents_not_cached(tmpdir):
+    cache = _cache(tmpdir)
+    data = b'small'
+
+    assert cache.hashes(data) == MultiHash.from_data(data).digest()
+    assert cache.get(hashcache.fingerprint(data)) is None
+
+
+def test_flush_evicts_least_recently_used(tmpdir):
+    cache = _cache(tmpdir, max_entries=2)
+    contents = [bytes([i]) * hashcache.MIN_LENGTH for i in range(3)]
+    with patch.object(hashcache.time, 'time') as time:
+        for i, data in enumerate(contents):
+            time.return_value = i
+            cache.hashes(data)
+        time.return_value = 3
+        cache.hashes(contents[0])
+    cache.flush()
+
+    assert cache.get(hashcache.fingerprint(contents[0])) is not None
+    assert cache.get(hashcache.fingerprint(contents[1])) is None
+    assert cache.get(hashcache.fingerprint(contents[2])) is not None
+
+
+def test_updates_written_in_batches(tmpdir):
+    cache = _cache(tmpdir)
+    contents = [bytes([i]) * hashcache.MIN_LENGTH for i in range(3)]
+    with patch.object(hashcache, 'COMMIT_INTERVAL', 3):
+        cache.hashes(contents[0])
+        cache.hashes(contents[1])
+        # pending updates are found, but not written yet
+        assert cache.get(hashcache.fingerprint(contents[0])) is not None
+        assert _cache(tmpdir).get(hashcache.fingerprint(contents[0])) is None
+
+        cache.hashes(contents[2])
+
+    assert _cache(tmpdir).get(hashcache.fingerprint(contents[0])) is not None
+
+
+def test_locked_database_is_skipped(tmpdir):
+    cache = _cache(tmpdir)
+    cache.hashes(DATA)
+    cache.flush()
+    other = sqlite3.connect(str(tmpdir.join('hashes.sqlite')))
+    other.execute('BEGIN IMMEDIATE')
+
+    start = time.monotonic()
+    # read hits do not write to the database
+    assert cache.get(hashcache.fingerprint(DATA)) is not None
+    cache.hashes(DATA[::-1])
+    cache.flush()
+
+    assert time.monotonic() - start < 5
+    other.rollback()
+    assert cache.get(hashcache.fingerprint(DATA[::-1])) is None
+
+
+def test_directory_with_hash_cache(tmpdir):
+    cache = _cache(tmpdir)
+    tarpath = str(tmpdir.join('archive.tar'))
+    with tarfile.open(tarpath, 'w') as tar:
+        info = tarfile.TarInfo('top/file')
+        info.size = len(DATA)
+        tar.addfile(info, io.BytesIO(DATA))
+    extracted = tmpdir.join('extracted')
+    tarball.uncompress(tarpath, str(extracted))
+    path = str(extracted).encode('utf-8')
+    expected = Directory.from_disk(path=path, save_path=True)
+
+    for _ in range(2):
+        assert directory_from_disk(path, hash_cache=cache).hash == \
+            expected.hash
+        assert directory_from_tarball(
+            tarpath, hash_cache=cache).hash == expected.hash
+
+    assert cache.get(hashcache.fingerprint(DATA)) is not None
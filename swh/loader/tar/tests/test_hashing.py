@@ -0,0 +1,71 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from swh.core import tarball
+from swh.model.from_disk import Content, Directory
+
+from swh.loader.tar import hashing
+from swh.loader.tar.stream import directory_from_tarball
+
+
+SAMPLE_TARBALL = os.path.join(
+    os.path.dirname(__file__), 'resources', 'sample-folder.tgz')
+
+
+def test_make_executor():
+    assert hashing.make_executor('thread', 0) is None
+
+    executor = hashing.make_executor('thread', 2)
+    assert isinstance(executor, ThreadPoolExecutor)
+    executor.shutdown()
+
+    with pytest.raises(ValueError, match='Unknown hashing executor'):
+        hashing.make_executor('gpu', 2)
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_directory_from_disk(tmpdir, kind):
+    tarball.uncompress(SAMPLE_TARBALL, str(tmpdir))
+    path = str(tmpdir).encode('utf-8')
+    expected = Directory.from_disk(path=path, save_path=True)
+
+    executor = hashing.make_executor(kind, 2)
+    try:
+        actual = hashing.directory_from_disk(path, executor)
+    finally:
+        executor.shutdown()
+
+    assert actual.hash == expected.hash
+    assert actual.collect() == expected.collect()
+
+
+def test_directory_from_tarball_with_executor():
+    expected = directory_from_tarball(SAMPLE_TARBALL)
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        actual = directory_from_tarball(SAMPLE_TARBALL, executor=executor)
+
+    assert actual.hash == expected.hash
+    assert actual.collect() == expected.collect()
+
+
+def test_content_data_from_file_max_content_size(tmpdir):
+    path = tmpdir.join('disk.img')
+    path.write_binary(b'large data\n' * 1000)
+    expected = Content.from_file(path=str(path).encode('utf-8')).data
+
+    data = hashing.content_data_from_file(
+        str(path).encode('utf-8'), hash_cache=object(),
+        max_content_size=1000)
+
+    assert data['status'] == 'absent'
+    assert data['sha1_git'] == expected['sha1_git']
+    assert 'data' not in data
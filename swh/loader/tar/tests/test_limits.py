@@ -0,0 +1,117 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import gzip
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from swh.loader.tar import limits as limits_module, readers
+from swh.loader.tar.extract import extract_tarball
+from swh.loader.tar.limits import ArchiveLimitExceeded, ArchiveLimits
+from swh.loader.tar.stream import directory_from_tarball
+
+
+def _make_tarball(path, members):
+    with tarfile.open(path, 'w:gz') as tar:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+
+
+def test_add_member():
+    limits = ArchiveLimits(max_bytes=100, max_members=3, max_depth=2)
+
+    limits.add_member(b'a', 50)
+    limits.add_member(b'a/b', 50)
+    with pytest.raises(ArchiveLimitExceeded) as excinfo:
+        limits.add_member(b'a/c', 1)
+
+    assert excinfo.value.limit == 'bytes'
+    assert limits.members == 3
+    with pytest.raises(ArchiveLimitExceeded, match='members limit'):
+        limits.add_member(b'a/d')
+    with pytest.raises(ArchiveLimitExceeded, match='depth limit'):
+        ArchiveLimits(max_depth=2).add_member(b'a/b/c')
+
+
+def test_add_bytes_ratio(monkeypatch):
+    monkeypatch.setattr(limits_module, 'RATIO_MIN_BYTES', 1000)
+    limits = ArchiveLimits(max_ratio=10, compressed_size=50)
+
+    limits.add_bytes(500)
+    with pytest.raises(ArchiveLimitExceeded) as excinfo:
+        limits.add_bytes(500)
+
+    assert (excinfo.value.limit, excinfo.value.value) == ('ratio', 20)
+
+
+def test_no_limits():
+    limits = ArchiveLimits(compressed_size=1)
+
+    limits.add_member(b'a/b/c/d', 10 ** 12)
+
+
+@pytest.mark.parametrize('extract', [False, True])
+def test_tarball_limits(tmpdir, extract):
+    tarpath = str(tmpdir.join('bomb.tar.gz'))
+    _make_tarball(tarpath, [('top/small', b'small'),
+                            ('top/zeros', b'\0' * 100000),
+                            ('top/after', b'never read')])
+    limits = ArchiveLimits(max_bytes=1000)
+    dest = str(tmpdir.join('dest'))
+    os.mkdir(dest)
+
+    with pytest.raises(ArchiveLimitExceeded):
+        if extract:
+            extract_tarball(tarpath, dest, limits=limits)
+        else:
+            directory_from_tarball(tarpath, limits=limits)
+
+    # aborted before the exceeding member was expanded
+    assert limits.members == 2
+    if extract:
+        assert sorted(os.listdir(os.path.join(dest, 'top'))) == ['small']
+
+
+def test_tarball_within_limits(tmpdir):
+    tarpath = str(tmpdir.join('archive.tar.gz'))
+    _make_tarball(tarpath, [('top/small', b'small')])
+    limits = ArchiveLimits(max_bytes=1000, max_members=2, max_depth=2)
+
+    directory = directory_from_tarball(tarpath, limits=limits)
+
+    assert directory.hash == directory_from_tarball(tarpath).hash
+    assert (limits.members, limits.bytes) == (1, 5)
+
+
+def test_zipfile_limits(tmpdir):
+    zippath = str(tmpdir.join('archive.zip'))
+    with zipfile.ZipFile(zippath, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('top/a', b'a')
+        archive.writestr('top/b', b'b')
+        archive.writestr('../outside', b'ignored')
+
+    readers.check_zipfile(zippath, ArchiveLimits(max_members=2))
+    with pytest.raises(ArchiveLimitExceeded, match='members limit'):
+        readers.directory_from_zipfile(zippath,
+                                       limits=ArchiveLimits(max_members=1))
+
+
+def test_compressed_file_limits(tmpdir, monkeypatch):
+    monkeypatch.setattr(limits_module, 'RATIO_MIN_BYTES', 1000)
+    path = str(tmpdir.join('zeros.bin.gz'))
+    with gzip.open(path, 'wb') as f:
+        f.write(b'\0' * 1000000)
+    limits = ArchiveLimits(max_ratio=100,
+                           compressed_size=os.path.getsize(path))
+
+    with pytest.raises(ArchiveLimitExceeded, match='ratio limit'):
+        readers.directory_from_compressed_file(path, limits=limits)
@@ -3,18 +3,30 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+import gzip
 import os
 import pytest
 import requests_mock
+import shutil
+import tempfile
+import threading
+import unittest
+
+from typing import Any, Dict, Type
+from unittest.mock import patch
 
 from swh.model import hashutil
 
+from swh.loader.core.loader import BufferedLoader
 from swh.loader.core.tests import BaseLoaderTest
 from swh.loader.tar.build import SWH_PERSON
-from swh.loader.tar.loader import RemoteTarLoader, LegacyLocalTarLoader
+from swh.loader.tar.loader import (
+    LegacyLocalTarLoader, MultiRemoteTarLoader, RemoteTarLoader
+)
+from swh.loader.tar.pool import LoaderPool
 
 
-TEST_CONFIG = {
+TEST_CONFIG: Dict[str, Any] = {
     'working_dir': '/tmp/tests/loader-tar/',  # where to extract the tarball
     'debug': False,
     'storage': {  # we instantiate it but we don't use it in test context
@@ -39,7 +51,7 @@ TEST_CONFIG = {
 
 class RemoteTarLoaderForTest(RemoteTarLoader):
     def parse_config_file(self, *args, **kwargs):
-        return TEST_CONFIG
+        return dict(TEST_CONFIG)
 
 
 @pytest.mark.fs
@@ -92,9 +104,11 @@ class TestRemoteTarLoader(PrepareDataForTestLoader):
     """Test the remote loader scenario (local/remote)
 
     """
+    loader_class: Type[RemoteTarLoader] = RemoteTarLoaderForTest
+
     def setUp(self):
         super().setUp()
-        self.loader = RemoteTarLoaderForTest()
+        self.loader = self.loader_class()
         self.storage = self.loader.storage
 
     def test_load_local(self):
@@ -116,6 +130,156 @@ class TestRemoteTarLoader(PrepareDataForTestLoader):
         # then
         self.assert_data_ok()
 
+    def test_reuse_loader(self):
+        """A loader can be reused for another visit, in new temporary
+           directories
+
+        """
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+        self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+        temp_directory = self.loader.temp_directory
+        self.assertFalse(os.path.exists(temp_directory))
+
+        # when
+        self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+
+        # then
+        self.assertNotEqual(self.loader.temp_directory, temp_directory)
+        self.assertFalse(os.path.exists(self.loader.temp_directory))
+        self.assertLessEqual(self.loader.counters['contents'], 8)
+        self.assertCountContents(8)
+        self.assertCountDirectories(6)
+        self.assertCountRevisions(1)
+        # the branch of the snapshot is named after the temporary directory
+        # of the visit
+        self.assertCountSnapshots(2)
+
+    def test_reuse_loader_after_failure(self):
+        """A pooled loader reused after a failed visit sends the objects
+           of the failed visit again
+
+        """
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+        pool = LoaderPool()
+        with pool.loader(self.loader_class) as loader:
+            self.loader, self.storage = loader, loader.storage
+            with patch.object(self.storage, 'content_add',
+                              side_effect=RuntimeError('storage failure')):
+                r = self.loader.load(origin=origin, visit_date=visit_date,
+                                     last_modified=last_modified)
+        self.assertEqual(r, {'status': 'failed'})
+        self.assertCountContents(0)
+
+        # when
+        with pool.loader(self.loader_class) as loader:
+            self.assertIs(loader, self.loader)
+            r = self.loader.load(origin=origin, visit_date=visit_date,
+                                 last_modified=last_modified)
+
+        # then
+        self.assertEqual(r, {'status': 'eventful'})
+        self.assertCountContents(8)
+        self.assertCountDirectories(6)
+        self.assertCountRevisions(1)
+
+    def test_load_content_size_limit(self):
+        """The contents larger than the limit are skipped, without changing
+           the directories
+
+        """
+        # given
+        self.loader.config['content_size_limit'] = 1
+        self.loader.max_content_size = 1
+        self.loader.skip_large_contents = True
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+
+        # when
+        self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+
+        # then
+        self.assertLess(self.loader.counters['contents'], 8)
+        self.assertCountDirectories(6)
+        self.assertCountRevisions(1)
+        rev_id = hashutil.hash_to_bytes(
+            '67a7d7dda748f9a86b56a13d9218d16f5cc9ab3d')
+        self.assertIsNotNone(next(self.storage.revision_get([rev_id])))
+
+    def test_load_archive_limits(self):
+        """Exceeding a limit of the archive aborts the visit
+
+        """
+        # given
+        self.loader.archive_limits['max_members'] = 2
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+
+        # when
+        r = self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+
+        # then
+        self.assertEqual(r['status'], 'aborted')
+        self.assertIn('members limit', r['reason'])
+        self.assertCountRevisions(0)
+        self.assertCountSnapshots(0)
+
+    def test_load_compressed_file(self):
+        """A single compressed file is loaded as a directory holding the
+           uncompressed file
+
+        """
+        # given
+        tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_path)
+        compressed_path = os.path.join(tmp_path, 'NEWS.txt.gz')
+        with gzip.open(compressed_path, 'wb') as f:
+            f.write(b'release notes\n')
+        origin = {
+            'url': 'file://' + compressed_path,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+
+        # when
+        self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+
+        # then
+        self.assertCountContents(1)
+        self.assertCountDirectories(1)
+        self.assertCountRevisions(1)
+        revision_id = list(self.loader.objects['revision'])[0]
+        revision = next(self.storage.revision_get([revision_id]))
+        self.assertEqual(
+            revision['metadata']['original_artifact'][0]['archive_type'],
+            'gz')
+        directory = list(self.storage.directory_ls(revision['directory']))
+        self.assertEqual([entry['name'] for entry in directory],
+                         [b'NEWS.txt'])
+
     @requests_mock.Mocker()
     def test_load_remote(self, mock_requests):
         """Load a remote tarball should result in persisted swh data
@@ -144,6 +308,45 @@ class TestRemoteTarLoader(PrepareDataForTestLoader):
 
         self.assert_data_ok()
 
+    @requests_mock.Mocker()
+    def test_load_remote_compressed_file(self, mock_requests):
+        """A remote single compressed file is loaded as a directory holding
+           the uncompressed file
+
+        """
+        # setup the mock to stream the compressed file
+        url = 'https://nowhere.org/NEWS.txt.gz'
+        data = gzip.compress(b'release notes\n')
+        mock_requests.get(url, content=data, headers={
+            'content-length': str(len(data))
+        })
+
+        # given
+        origin = {
+            'url': url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+
+        # when
+        r = self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+
+        # then
+        self.assertEqual(r, {'status': 'eventful'})
+        self.assertCountContents(1)
+        self.assertCountDirectories(1)
+        self.assertCountRevisions(1)
+        revision_id = list(self.loader.objects['revision'])[0]
+        revision = next(self.storage.revision_get([revision_id]))
+        self.assertEqual(
+            revision['metadata']['original_artifact'][0]['archive_type'],
+            'gz')
+        directory = list(self.storage.directory_ls(revision['directory']))
+        self.assertEqual([entry['name'] for entry in directory],
+                         [b'NEWS.txt'])
+
     @requests_mock.Mocker()
     def test_load_remote_download_failure(self, mock_requests):
         """Load a remote tarball with download failure should result in no data
@@ -179,9 +382,650 @@ class TestRemoteTarLoader(PrepareDataForTestLoader):
         self.assertCountSnapshots(0)
 
 
+# Meaningful combinations of the settings of the remote loader: how the
+# archives are read (extracted, streamed or pipelined while downloaded),
+# how their contents are hashed and how the objects are sent
+CONFIG_COMBINATIONS: Dict[str, Dict[str, Any]] = {
+    'extract_filter_missing': {
+        'filter_missing_objects': True, 'content_hash_cache': True,
+        'external_decompression': True, 'skip_large_contents': True,
+    },
+    'extract_flush_scratch': {
+        'flush_objects': True, 'background_send': True,
+        'send_queue_size': 1, 'hash_workers': 2, 'dedup_contents': True,
+        'memory_scratch_dir': TEST_CONFIG['working_dir'],
+        'memory_scratch_size': 1024 * 1024,
+    },
+    'extract_hash_processes': {
+        'hash_workers': 2, 'hash_executor': 'process',
+        'content_hash_cache': True, 'flush_objects': True,
+    },
+    'stream_filter_missing': {
+        'stream_archive': True, 'filter_missing_objects': True,
+        'content_hash_cache': True, 'hash_workers': 2,
+    },
+    'stream_lazy_flush': {
+        'stream_archive': True, 'lazy_contents': True,
+        'flush_objects': True, 'background_send': True,
+        'send_queue_size': 1, 'content_packet_size': 2,
+        'directory_packet_size': 2, 'dedup_contents': True,
+        'hash_workers': 2, 'fetch_workers': 1,
+    },
+    'pipeline_filter_missing': {
+        'pipeline_archive': True, 'external_decompression': True,
+        'filter_missing_objects': True, 'dedup_contents': True,
+        'content_hash_cache': True,
+    },
+    'pipeline_flush': {
+        'pipeline_archive': True, 'lazy_contents': True,
+        'flush_objects': True, 'background_send': True,
+        'content_packet_size': 2, 'directory_packet_size': 2,
+        'hash_workers': 2, 'skip_large_contents': True,
+    },
+}
+
+
+class TestRemoteTarLoaderCombinations(PrepareDataForTestLoader):
+    """Test the main scenarios of the loaders with each combination of
+       their settings (cf. :class:`TestRemoteTarLoader` for the default
+       ones)
+
+    """
+    origin = {
+        'url': 'https://nowhere.org/sample-folder/',
+        'type': 'tar'
+    }
+    visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+    last_modified = '2018-12-05T12:35:23+00:00'
+
+    def make_loader(self, combination, loader_class=RemoteTarLoader,
+                    **config):
+        """Set up :attr:`loader` (and its new storage) with the settings
+           of the combination, overridden by config.
+
+        """
+        self.loader = loader_class(config={
+            **TEST_CONFIG, **CONFIG_COMBINATIONS[combination], **config})
+        self.storage = self.loader.storage
+
+    def load(self, url):
+        return self.loader.load(
+            origin={**self.origin, 'url': url}, visit_date=self.visit_date,
+            last_modified=self.last_modified)
+
+    def mock_remote(self, mock_requests, url, data):
+        mock_requests.get(url, content=data, headers={
+            'content-length': str(len(data))
+        })
+
+    def test_load_local(self):
+        """Load a local tarball"""
+        for combination in CONFIG_COMBINATIONS:
+            with self.subTest(combination=combination):
+                self.make_loader(combination)
+
+                r = self.load(self.repo_url)
+
+                self.assertEqual(r, {'status': 'eventful'})
+                self.assert_data_ok()
+
+    @requests_mock.Mocker()
+    def test_load_remote(self, mock_requests):
+        """Load a remote tarball, pipelined if set"""
+        local_url = self.repo_url.replace('file:///', '/')
+        url = 'https://nowhere.org/%s' % local_url
+        with open(local_url, 'rb') as f:
+            self.mock_remote(mock_requests, url, f.read())
+        for combination, config in CONFIG_COMBINATIONS.items():
+            with self.subTest(combination=combination):
+                self.make_loader(combination)
+
+                r = self.load(url)
+
+                self.assertEqual(r, {'status': 'eventful'})
+                self.assert_data_ok()
+                pipelined = config.get('pipeline_archive', False)
+                self.assertEqual('pipeline' in self.loader.metrics.phases,
+                                 pipelined)
+                self.assertEqual('download' in self.loader.metrics.phases,
+                                 not pipelined)
+
+    @requests_mock.Mocker()
+    def test_load_remote_compressed_file(self, mock_requests):
+        """Load a remote single compressed file"""
+        url = 'https://nowhere.org/NEWS.txt.gz'
+        self.mock_remote(mock_requests, url,
+                         gzip.compress(b'release notes\n'))
+        for combination in CONFIG_COMBINATIONS:
+            with self.subTest(combination=combination):
+                self.make_loader(combination)
+
+                r = self.load(url)
+
+                self.assertEqual(r, {'status': 'eventful'})
+                self.assertCountContents(1)
+                self.assertCountDirectories(1)
+                self.assertCountRevisions(1)
+
+    @requests_mock.Mocker()
+    def test_load_remote_download_failure(self, mock_requests):
+        """A truncated download fails the visit"""
+        local_url = self.repo_url.replace('file:///', '/')
+        url = 'https://nowhere.org/%s' % local_url
+        with open(local_url, 'rb') as f:
+            data = f.read()
+        mock_requests.get(url, content=data, headers={
+            'content-length': str(len(data) - 10)
+        })
+        for combination in CONFIG_COMBINATIONS:
+            with self.subTest(combination=combination):
+                self.make_loader(combination)
+
+                r = self.load(url)
+
+                self.assertEqual(r, {'status': 'failed'})
+                self.assertCountRevisions(0)
+                self.assertCountSnapshots(0)
+
+    def test_reuse_loader_after_failure(self):
+        """A loader reused after a failed visit sends all its objects"""
+        for combination in CONFIG_COMBINATIONS:
+            with self.subTest(combination=combination):
+                self.make_loader(combination)
+                with patch.object(self.storage, 'content_add',
+                                  side_effect=RuntimeError('failure')):
+                    r = self.load(self.repo_url)
+                self.assertEqual(r, {'status': 'failed'})
+
+                r = self.load(self.repo_url)
+
+                self.assertEqual(r, {'status': 'eventful'})
+                self.assert_data_ok()
+
+    def test_load_content_size_limit(self):
+        """The contents larger than the limit are skipped"""
+        for combination in CONFIG_COMBINATIONS:
+            with self.subTest(combination=combination):
+                self.make_loader(combination, content_size_limit=1)
+
+                r = self.load(self.repo_url)
+
+                self.assertEqual(r, {'status': 'eventful'})
+                self.assertLess(self.loader.counters['contents'], 8)
+                self.assertCountDirectories(6)
+                self.assertCountRevisions(1)
+
+    def test_load_archive_limits(self):
+        """Exceeding a limit of the archive aborts the visit"""
+        for combination in CONFIG_COMBINATIONS:
+            with self.subTest(combination=combination):
+                self.make_loader(combination, archive_max_members=2)
+
+                r = self.load(self.repo_url)
+
+                self.assertEqual(r['status'], 'aborted')
+                self.assertIn('members limit', r['reason'])
+                self.assertCountRevisions(0)
+                self.assertCountSnapshots(0)
+
+    def test_load_local_artifacts(self):
+        """Load many tarballs with the batch loader"""
+        local_path = self.repo_url.replace('file://', '')
+        tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_path)
+        copy_path = os.path.join(tmp_path, 'sample-folder-copy.tgz')
+        shutil.copy(local_path, copy_path)
+        artifacts = [
+            (self.repo_url, '2018-12-05T12:35:23+00:00'),
+            ('file://%s' % copy_path, '2019-01-05T12:35:23+00:00'),
+        ]
+        for combination in CONFIG_COMBINATIONS:
+            with self.subTest(combination=combination):
+                self.make_loader(combination, MultiRemoteTarLoader)
+
+                r = self.loader.load(origin=self.origin,
+                                     visit_date=self.visit_date,
+                                     artifacts=artifacts)
+
+                self.assertEqual(r, {'status': 'eventful'})
+                self.assertCountContents(8)
+                self.assertEqual(self.loader.counters['contents'], 8)
+                self.assertCountDirectories(6)
+                self.assertCountRevisions(2)
+                self.assertCountSnapshots(1)
+
+
+class FilterMissingRemoteTarLoaderForTest(RemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return {**TEST_CONFIG, 'filter_missing_objects': True}
+
+
+class TestFilterMissingRemoteTarLoader(PrepareDataForTestLoader):
+    """Test the remote loader only sending the missing objects
+
+    """
+    def setUp(self):
+        super().setUp()
+        self.loader = FilterMissingRemoteTarLoaderForTest()
+        self.storage = self.loader.storage
+
+    def test_load_queries_objects_once(self):
+        """Each object is only looked up once in the storage
+
+        """
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+
+        # when
+        with patch.object(self.storage, 'directory_missing',
+                          wraps=self.storage.directory_missing) as dirs, \
+                patch.object(self.storage, 'content_missing',
+                             wraps=self.storage.content_missing) as contents:
+            self.loader.load(origin=origin, visit_date=visit_date,
+                             last_modified=last_modified)
+
+        # then
+        self.assert_data_ok()
+        queried = [id for call in dirs.call_args_list for id in call[0][0]]
+        self.assertEqual(len(queried), len(set(queried)))
+        self.assertEqual(len(queried), 6)
+        queried = [c['sha1'] for call in contents.call_args_list
+                   for c in call[0][0]]
+        self.assertEqual(len(queried), len(set(queried)))
+
+
+class BackgroundSendRemoteTarLoaderForTest(RemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return {**TEST_CONFIG, 'stream_archive': True, 'lazy_contents': True,
+                'flush_objects': True, 'background_send': True,
+                'send_queue_size': 1, 'content_packet_size': 2,
+                'directory_packet_size': 2}
+
+
+class TestBackgroundSendRemoteTarLoader(PrepareDataForTestLoader):
+    """Test the remote loader sending the objects from a background thread
+       while the tree is being built
+
+    """
+    def setUp(self):
+        super().setUp()
+        self.loader = BackgroundSendRemoteTarLoaderForTest()
+        self.storage = self.loader.storage
+
+    def test_load_storage_failure(self):
+        """A failure of the background sender fails the visit
+
+        """
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+
+        # when
+        with patch.object(self.storage, 'directory_missing',
+                          side_effect=RuntimeError('storage failure')):
+            r = self.loader.load(origin=origin, visit_date=visit_date,
+                                 last_modified=last_modified)
+
+        # then
+        self.assertEqual(r, {'status': 'failed'})
+        self.assertCountRevisions(0)
+        self.assertCountSnapshots(0)
+        self.assertIsNone(self.loader.sender.error)
+
+    def test_load_fetch_failure_with_queued_packets(self):
+        """A failure while packets are queued stops the background sender
+           before the loader flushes its buffers
+
+        """
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+        sending = threading.Event()
+        resume = threading.Event()
+        sent = []
+        pending_at_flush = []
+
+        def send(objects):
+            sending.set()
+            resume.wait(10)
+            sent.append(objects)
+
+        def fetch_data():
+            self.loader.send_packet(send, ['sent'])
+            sending.wait(10)
+            self.loader.send_packet(send, ['queued'])
+            threading.Timer(0.1, resume.set).start()
+            raise RuntimeError('fetch failure')
+
+        def flush(loader):
+            pending_at_flush.append(loader.sender.queue.unfinished_tasks)
+
+        # when
+        with patch.object(self.loader, 'fetch_data',
+                          side_effect=fetch_data), \
+                patch.object(BufferedLoader, 'flush', autospec=True,
+                             side_effect=flush):
+            r = self.loader.load(origin=origin, visit_date=visit_date,
+                                 last_modified=last_modified)
+
+        # then
+        self.assertEqual(r, {'status': 'failed'})
+        self.assertEqual(pending_at_flush, [0])
+        self.assertEqual(sent, [['sent']])
+
+
+class PipelineSkipKnownRemoteTarLoaderForTest(RemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return {**TEST_CONFIG, 'pipeline_archive': True,
+                'skip_known_artifacts': True, 'keep_partial_downloads': True}
+
+
+class PipelineMultiRemoteTarLoaderForTest(MultiRemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return {**TEST_CONFIG, 'pipeline_archive': True,
+                'skip_known_artifacts': True}
+
+
+class TestPipelineConfig(unittest.TestCase):
+    """Test the settings which cannot be combined with the pipeline
+
+    """
+    def test_incompatible_config(self):
+        with self.assertRaisesRegex(
+                ValueError, 'skip_known_artifacts, keep_partial_downloads'):
+            PipelineSkipKnownRemoteTarLoaderForTest()
+
+    def test_incompatible_config_without_pipeline(self):
+        # the batch loader downloads the tarballs ahead
+        loader = PipelineMultiRemoteTarLoaderForTest()
+        self.assertFalse(loader.pipeline_archive)
+
+
+METRICS_DIR = os.path.join(TEST_CONFIG['working_dir'], 'metrics')
+
+
+class MetricsRemoteTarLoaderForTest(RemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return {**TEST_CONFIG, 'metrics_textfile_dir': METRICS_DIR}
+
+
+class TestMetricsRemoteTarLoader(PrepareDataForTestLoader):
+    """Test the remote loader reports the metrics of its visits
+
+    """
+    def setUp(self):
+        super().setUp()
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self.loader = MetricsRemoteTarLoaderForTest()
+        self.storage = self.loader.storage
+
+    def tearDown(self):
+        shutil.rmtree(METRICS_DIR)
+        super().tearDown()
+
+    def test_load_local(self):
+        """Loading a tarball reports the metrics of its phases
+
+        """
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+
+        with patch.object(self.loader.log, 'info') as log_info:
+            self.loader.load(origin=origin, visit_date=visit_date,
+                             last_modified=last_modified)
+
+        self.assert_data_ok()
+        metrics = log_info.call_args[1]['extra']['swh_metrics']
+        self.assertEqual(metrics['download']['bytes_in'], 555)
+        self.assertEqual(metrics['uncompress']['bytes_in'], 555)
+        self.assertEqual(metrics['collect']['objects'], 8 + 6)
+        self.assertEqual(metrics['store_contents']['objects'], 8)
+        self.assertIn('build', metrics)
+        self.assertIn('store_flush', metrics)
+
+        path = os.path.join(METRICS_DIR,
+                            'swh_loader_tar-%s.prom' % os.getpid())
+        with open(path) as f:
+            textfile = f.read()
+        self.assertIn('swh_loader_tar_bytes_in_total{phase="download"} 555',
+                      textfile)
+
+
+PROFILE_DIR = os.path.join(TEST_CONFIG['working_dir'], 'profiles')
+
+
+class ProfileRemoteTarLoaderForTest(RemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return {**TEST_CONFIG, 'profile_cpu': True, 'profile_memory': True,
+                'profile_dir': PROFILE_DIR}
+
+
+class TestProfileRemoteTarLoader(PrepareDataForTestLoader):
+    """Test the remote loader profiling its visits
+
+    """
+    def setUp(self):
+        super().setUp()
+        self.loader = ProfileRemoteTarLoaderForTest()
+        self.storage = self.loader.storage
+
+    def tearDown(self):
+        shutil.rmtree(PROFILE_DIR, ignore_errors=True)
+        super().tearDown()
+
+    def load(self):
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+        self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+        self.assert_data_ok()
+
+    def test_load_local(self):
+        self.load()
+
+        reports = sorted(os.listdir(PROFILE_DIR))
+        self.assertEqual(len(reports), 2)
+        self.assertTrue(reports[0].endswith('.prof'))
+        self.assertTrue(reports[1].endswith('.txt'))
+        with open(os.path.join(PROFILE_DIR, reports[1])) as f:
+            report = f.read()
+        self.assertTrue(report.startswith(
+            'Visit %s of %s (555 bytes of archives)' % (
+                self.loader.visit, self.repo_url)))
+        self.assertIn('Memory profile', report)
+
+    def test_load_below_thresholds(self):
+        self.loader.profile_min_duration = 3600
+        self.loader.profile_min_size = 1000
+        self.load()
+
+        self.assertFalse(os.path.exists(PROFILE_DIR))
+
+
+class SkipKnownRemoteTarLoaderForTest(RemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return {**TEST_CONFIG, 'skip_known_artifacts': True}
+
+
+class TestSkipKnownRemoteTarLoader(PrepareDataForTestLoader):
+    """Test the remote loader does not uncompress known artifacts again
+
+    """
+    def setUp(self):
+        super().setUp()
+        self.loader = SkipKnownRemoteTarLoaderForTest()
+        self.storage = self.loader.storage
+
+    def test_load_known_artifact(self):
+        """Loading an already archived tarball reuses its directory
+
+        """
+        origin = {
+            'url': self.repo_url,
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        last_modified = '2018-12-05T12:35:23+00:00'
+        self.loader.load(
+            origin=origin, visit_date=visit_date, last_modified=last_modified)
+        self.assertEqual(self.loader.counters['contents'], 8)
+
+        # when
+        loader = SkipKnownRemoteTarLoaderForTest()
+        loader.storage = self.storage
+        with patch.object(loader, 'build_directory') as build_directory:
+            r = loader.load(origin=origin, visit_date=visit_date,
+                            last_modified=last_modified)
+
+        # then
+        self.assertEqual(r, {'status': 'eventful'})
+        build_directory.assert_not_called()
+        self.assertEqual(loader.counters['contents'], 0)
+        self.assertEqual(loader.counters['directories'], 0)
+        self.assertCountRevisions(1)
+        self.assertCountSnapshots(2)
+        revision = list(loader.objects['revision'].values())[0]
+        self.assertEqual(hashutil.hash_to_hex(revision['id']),
+                         '67a7d7dda748f9a86b56a13d9218d16f5cc9ab3d')
+
+
+class MultiRemoteTarLoaderForTest(MultiRemoteTarLoader):
+    def parse_config_file(self, *args, **kwargs):
+        return dict(TEST_CONFIG)
+
+
+class TestMultiRemoteTarLoader(PrepareDataForTestLoader):
+    """Test the batch loader scenario
+
+    """
+    loader_class: Type[MultiRemoteTarLoader] = MultiRemoteTarLoaderForTest
+
+    def setUp(self):
+        super().setUp()
+        self.loader = self.loader_class()
+        self.storage = self.loader.storage
+
+    def test_load_local_artifacts(self):
+        """Load many tarballs should result in one visit with one branch per
+           tarball, the shared objects being sent once
+
+        """
+        # given
+        local_path = self.repo_url.replace('file://', '')
+        tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_path)
+        copy_path = os.path.join(tmp_path, 'sample-folder-copy.tgz')
+        shutil.copy(local_path, copy_path)
+        origin = {
+            'url': 'https://nowhere.org/sample-folder/',
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        artifacts = [
+            (self.repo_url, '2018-12-05T12:35:23+00:00'),
+            ('file://%s' % copy_path, '2019-01-05T12:35:23+00:00'),
+        ]
+
+        # when
+        r = self.loader.load(
+            origin=origin, visit_date=visit_date, artifacts=artifacts)
+
+        # then
+        self.assertEqual(r, {'status': 'eventful'})
+        self.assertCountContents(8)
+        self.assertEqual(self.loader.counters['contents'], 8)
+        self.assertCountDirectories(6)
+        self.assertCountRevisions(2)
+        self.assertCountSnapshots(1)
+
+        snapshot = list(self.loader.objects['snapshot'].values())[0]
+        self.assertEqual(
+            set(snapshot['branches']),
+            {b'sample-folder.tgz', b'sample-folder-copy.tgz'})
+        rev_id = snapshot['branches'][b'sample-folder.tgz']['target']
+        self.assertEqual(hashutil.hash_to_hex(rev_id),
+                         '67a7d7dda748f9a86b56a13d9218d16f5cc9ab3d')
+        revisions = self.loader.objects['revision']
+        self.assertEqual(
+            len({rev['directory'] for rev in revisions.values()}), 1)
+
+    def test_load_artifacts_sharing_a_name(self):
+        """Tarballs sharing a name are each given a branch, named after
+           their url
+
+        """
+        # given
+        local_path = self.repo_url.replace('file://', '')
+        tmp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_path)
+        copy_path = os.path.join(tmp_path, os.path.basename(local_path))
+        shutil.copy(local_path, copy_path)
+        origin = {
+            'url': 'https://nowhere.org/sample-folder/',
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        artifacts = [
+            (self.repo_url, '2018-12-05T12:35:23+00:00'),
+            ('file://%s' % copy_path, '2019-01-05T12:35:23+00:00'),
+        ]
+
+        # when
+        r = self.loader.load(
+            origin=origin, visit_date=visit_date, artifacts=artifacts)
+
+        # then
+        self.assertEqual(r, {'status': 'eventful'})
+        self.assertCountRevisions(2)
+        snapshot = list(self.loader.objects['snapshot'].values())[0]
+        self.assertEqual(
+            set(snapshot['branches']),
+            {self.repo_url.encode('utf-8'),
+             ('file://%s' % copy_path).encode('utf-8')})
+        self.assertEqual(
+            {branch['target'] for branch in snapshot['branches'].values()},
+            set(self.loader.objects['revision']))
+
+    def test_load_artifact_given_twice(self):
+        """An artifact given twice fails the visit"""
+        origin = {
+            'url': 'https://nowhere.org/sample-folder/',
+            'type': 'tar'
+        }
+        visit_date = 'Tue, 3 May 2016 17:16:32 +0200'
+        artifacts = [
+            (self.repo_url, '2018-12-05T12:35:23+00:00'),
+            (self.repo_url, '2019-01-05T12:35:23+00:00'),
+        ]
+
+        r = self.loader.load(
+            origin=origin, visit_date=visit_date, artifacts=artifacts)
+
+        self.assertEqual(r, {'status': 'failed'})
+        self.assertCountRevisions(0)
+
+
 class TarLoaderForTest(LegacyLocalTarLoader):
     def parse_config_file(self, *args, **kwargs):
-        return TEST_CONFIG
+        return dict(TEST_CONFIG)
 
 
 class TestTarLoader(PrepareDataForTestLoader):
@@ -0,0 +1,148 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import os
+import socket
+import subprocess
+import time
+
+import pytest
+
+from swh.loader.tar import metrics as metrics_module
+from swh.loader.tar.metrics import (
+    TextfileExporter, VisitMetrics, send_statsd, statsd_lines
+)
+
+
+def _metrics():
+    metrics = VisitMetrics()
+    for _ in range(2):
+        with metrics.phase('download') as phase:
+            phase.count(bytes_in=100)
+    with metrics.phase('store_contents') as phase:
+        phase.count(objects=3, bytes_out=42)
+    return metrics
+
+
+def test_phase():
+    metrics = VisitMetrics()
+    with metrics.phase('build') as phase:
+        time.sleep(0.01)
+        phase.count(objects=1)
+    with pytest.raises(ValueError):
+        with metrics.phase('build') as phase:
+            phase.count(objects=2)
+            raise ValueError()
+
+    metrics = metrics.to_dict()
+    assert list(metrics) == ['build']
+    assert metrics['build']['objects'] == 3
+    assert metrics['build']['wall_time'] >= 0.01
+    assert metrics['build']['cpu_time'] >= 0
+    assert metrics['build']['rss'] > 0
+
+
+def test_phase_peak_rss():
+    if not metrics_module.reset_peak_rss():
+        pytest.skip('the peak resident memory cannot be reset')
+    size = 200 * 1024 * 1024
+    metrics = VisitMetrics()
+    with metrics.phase('outer'):
+        with metrics.phase('large'):
+            data = bytearray(size)
+            del data
+    with metrics.phase('small'):
+        pass
+
+    metrics = metrics.to_dict()
+    assert metrics['large']['peak_rss'] >= size
+    assert metrics['outer']['peak_rss'] >= metrics['large']['peak_rss']
+    # the following phases do not report the peak of the previous ones
+    assert 0 < metrics['small']['peak_rss'] < size
+    assert metrics_module.peak_rss() >= metrics['large']['peak_rss']
+
+
+def test_summary():
+    summary = _metrics().summary()
+
+    assert summary.startswith('download=')
+    assert 'bytes_in=200' in summary
+    assert 'bytes_out=42 objects=3' in summary
+
+
+def test_statsd_lines():
+    lines = statsd_lines(_metrics())
+
+    assert 'swh_loader_tar.download.bytes_in:200|c' in lines
+    assert 'swh_loader_tar.store_contents.objects:3|c' in lines
+    assert any(line.startswith('swh_loader_tar.download.wall_time:') and
+               line.endswith('|ms') for line in lines)
+    assert lines[-1] == 'swh_loader_tar.visits:1|c'
+
+
+def test_send_statsd():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(5)
+        send_statsd('127.0.0.1:%s' % sock.getsockname()[1], _metrics())
+
+        data = sock.recv(65536).decode('utf-8')
+
+    assert data.split('\n') == statsd_lines(_metrics())[:len(
+        data.split('\n'))]
+
+
+def test_send_statsd_failure():
+    # failures are only logged
+    send_statsd('invalid-address', _metrics())
+
+
+def test_textfile_exporter(tmpdir):
+    exporter = TextfileExporter(str(tmpdir))
+    exporter.export(_metrics())
+    exporter.export(_metrics())
+
+    assert os.listdir(str(tmpdir)) == [
+        'swh_loader_tar-%s.prom' % os.getpid()]
+    with open(exporter.path) as f:
+        lines = f.read().splitlines()
+    pid = os.getpid()
+    assert 'swh_loader_tar_visits_total{pid="%s"} 2' % pid in lines
+    assert '# TYPE swh_loader_tar_bytes_in_total counter' in lines
+    assert 'swh_loader_tar_bytes_in_total{phase="download",pid="%s"} 400' % (
+        pid) in lines
+    assert 'swh_loader_tar_objects_total{phase="store_contents",pid="%s"} ' \
+        '6' % pid in lines
+    assert any(line.startswith(
+        'swh_loader_tar_rss_bytes{phase="download",pid="%s"} ' % pid)
+        for line in lines)
+    assert any(line.startswith(
+        'swh_loader_tar_peak_rss_bytes{phase="download",pid="%s"} ' % pid)
+        for line in lines)
+    assert any(line.startswith(
+        'swh_loader_tar_process_peak_rss_bytes{pid="%s"} ' % pid)
+        for line in lines)
+
+
+def test_textfile_exporter_removes_stale_files(tmpdir):
+    process = subprocess.Popen(['true'])
+    process.wait()
+    stale = tmpdir.join('swh_loader_tar-%s.prom' % process.pid)
+    stale.write('')
+    alive = tmpdir.join('swh_loader_tar-%s.prom' % os.getppid())
+    alive.write('')
+    exporter = TextfileExporter(str(tmpdir))
+
+    exporter.export(_metrics())
+
+    assert sorted(os.listdir(str(tmpdir))) == sorted([
+        alive.basename, os.path.basename(exporter.path)])
+
+
+def test_textfile_exporter_failure(tmpdir):
+    exporter = TextfileExporter(str(tmpdir.join('missing')))
+    # failures are only logged
+    exporter.export(_metrics())
+    assert exporter.visits == 1
@@ -0,0 +1,84 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import os
+
+import pytest
+
+from swh.model.hashutil import DEFAULT_ALGORITHMS
+
+from swh.loader.tar.missing import collect_missing
+from swh.loader.tar.stream import directory_from_tarball
+
+
+SAMPLE_TARBALL = os.path.join(
+    os.path.dirname(__file__), 'resources', 'sample-folder.tgz')
+
+
+class FakeStorage:
+    """Storage holding the given objects, recording the queries"""
+    def __init__(self, directories=(), contents=()):
+        self.directories = set(directories)
+        self.contents = set(contents)
+        self.queried_directories = []
+        self.queried_contents = []
+
+    def directory_missing(self, ids):
+        self.queried_directories.append(ids)
+        return [id for id in ids if id not in self.directories]
+
+    def content_missing(self, contents):
+        self.queried_contents.append(contents)
+        for content in contents:
+            assert set(content) == DEFAULT_ALGORITHMS
+        return [c['sha1'] for c in contents if c['sha1'] not in self.contents]
+
+
+@pytest.fixture
+def directory():
+    return directory_from_tarball(SAMPLE_TARBALL)
+
+
+def test_collect_missing_empty_storage(directory):
+    storage = FakeStorage()
+
+    objects = collect_missing(storage, directory)
+
+    assert objects == directory.collect()
+
+
+def test_collect_missing_archived_root(directory):
+    storage = FakeStorage(directories=[directory.hash])
+
+    objects = collect_missing(storage, directory)
+
+    assert objects == {'content': {}, 'directory': {}}
+    assert storage.queried_directories == [[directory.hash]]
+    assert storage.queried_contents == []
+
+
+def test_collect_missing_prunes_archived_subtrees(directory):
+    sample_folder = directory[b'sample-folder']
+    bar = sample_folder[b'bar']
+    quotes = sample_folder[b'foo'][b'quotes.md']
+    storage = FakeStorage(directories=[bar.hash],
+                          contents=[quotes.data['sha1']])
+
+    objects = collect_missing(storage, directory, directory_batch_size=2)
+
+    queried = [id for ids in storage.queried_directories for id in ids]
+    assert bar.hash in queried
+    assert bar[b'barfoo'].hash not in queried
+    assert all(len(ids) <= 2 for ids in storage.queried_directories)
+
+    assert set(objects['directory']) == {
+        directory.hash, sample_folder.hash, sample_folder[b'foo'].hash,
+        sample_folder[b'empty-folder'].hash,
+    }
+    # the contents are left to the filtering of the loader
+    assert storage.queried_contents == []
+    assert quotes.hash in objects['content']
+    assert bar[b'barfoo'][b'another-quote.org'].hash not in objects['content']
+    assert sample_folder[b'some-binary'].hash in objects['content']
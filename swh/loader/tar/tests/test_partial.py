@@ -0,0 +1,195 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import io
+import os
+import re
+
+import pytest
+import requests_mock
+
+from urllib3.exceptions import ProtocolError
+
+from swh.model.hashutil import MultiHash
+
+from swh.loader.tar.fetcher import ArchiveFetcher
+from swh.loader.tar.partial import (
+    PartialDownload, clean_partial_downloads, range_validator
+)
+
+
+URL = 'https://nowhere.org/some-tarball.tar.gz'
+DATA = b'0123456789' * 10000
+HEADERS = {'content-length': str(len(DATA)), 'ETag': '"v1"'}
+
+
+class BrokenBody(io.RawIOBase):
+    """Response body whose connection breaks after some bytes"""
+    def __init__(self, data, limit):
+        self.data = data[:limit]
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if self.position >= len(self.data):
+            raise ProtocolError('Connection broken')
+        n = min(len(buffer), len(self.data) - self.position)
+        buffer[:n] = self.data[self.position:self.position + n]
+        self.position += n
+        return n
+
+
+def _range_callback(request, context):
+    start = int(re.match(r'bytes=(\d+)-', request.headers['Range']).group(1))
+    context.status_code = 206
+    context.headers['Content-Range'] = 'bytes %s-%s/%s' % (
+        start, len(DATA) - 1, len(DATA))
+    return DATA[start:]
+
+
+def _check_download(filepath, hashes):
+    with open(filepath, 'rb') as f:
+        assert f.read() == DATA
+    assert hashes == {'length': len(DATA),
+                      **MultiHash.from_data(DATA).hexdigest()}
+
+
+def test_range_validator():
+    assert range_validator({'ETag': '"v1"', 'Last-Modified': 'lm'}) == '"v1"'
+    assert range_validator({'ETag': 'W/"v1"', 'Last-Modified': 'lm'}) == 'lm'
+    assert range_validator({}) is None
+
+
+def test_partial_download(tmpdir):
+    path = str(tmpdir.join('partial'))
+    partial = PartialDownload(path)
+    partial.start(URL, len(DATA), HEADERS)
+    partial.write(DATA[:100])
+
+    with pytest.raises(BlockingIOError):
+        PartialDownload(path)
+    partial.close()
+
+    partial = PartialDownload(path)
+    assert partial.size == 100
+    assert partial.metadata == {
+        'url': URL, 'length': len(DATA), 'validator': '"v1"'}
+    partial.finish(str(tmpdir.join('done')))
+    assert not os.path.exists(path + '.json')
+
+
+def test_clean_partial_downloads(tmpdir):
+    for name, mtime in (('old', 0), ('new', None)):
+        partial = PartialDownload(str(tmpdir.join(name)))
+        partial.start(URL, len(DATA), HEADERS)
+        partial.close()
+        if mtime is not None:
+            os.utime(partial.path, (mtime, mtime))
+
+    clean_partial_downloads(str(tmpdir), max_age=3600)
+
+    assert sorted(os.listdir(str(tmpdir))) == ['new', 'new.json']
+
+
+def test_fetcher_resumes_interrupted_download(tmpdir):
+    fetcher = ArchiveFetcher(temp_directory=str(tmpdir))
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(URL, [
+            {'body': BrokenBody(DATA, 50000), 'headers': HEADERS},
+            {'content': _range_callback},
+        ])
+
+        filepath, hashes = fetcher.download(URL)
+
+        assert mock_requests.call_count == 2
+        last_headers = mock_requests.last_request.headers
+        assert last_headers['If-Range'] == '"v1"'
+        assert last_headers['Range'].startswith('bytes=')
+
+    _check_download(filepath, hashes)
+    assert os.listdir(str(tmpdir)) == ['some-tarball.tar.gz']
+
+
+def test_fetcher_restarts_without_range_support(tmpdir):
+    fetcher = ArchiveFetcher(temp_directory=str(tmpdir))
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(URL, [
+            {'body': BrokenBody(DATA, 50000), 'headers': HEADERS},
+            {'content': DATA, 'headers': HEADERS},
+            {'content': DATA, 'headers': HEADERS},
+        ])
+
+        filepath, hashes = fetcher.download(URL)
+
+        assert mock_requests.call_count == 3
+
+    _check_download(filepath, hashes)
+
+
+def test_fetcher_gives_up(tmpdir):
+    fetcher = ArchiveFetcher(temp_directory=str(tmpdir), max_resumes=0)
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(URL, body=BrokenBody(DATA, 50000), headers=HEADERS)
+
+        with pytest.raises(ValueError, match='Fail to download'):
+            fetcher.download(URL)
+
+
+def test_fetcher_resumes_interrupted_stream():
+    fetcher = ArchiveFetcher()
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(URL, [
+            {'body': BrokenBody(DATA, 50000), 'headers': HEADERS},
+            {'content': _range_callback},
+        ])
+
+        chunks, length = fetcher.stream(URL)
+
+        assert length == len(DATA)
+        assert b''.join(chunks) == DATA
+        assert mock_requests.call_count == 2
+        assert mock_requests.last_request.headers['If-Range'] == '"v1"'
+
+
+def test_fetcher_stream_without_range_support():
+    fetcher = ArchiveFetcher()
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(URL, [
+            {'body': BrokenBody(DATA, 50000), 'headers': HEADERS},
+            {'content': DATA, 'headers': HEADERS},
+        ])
+
+        chunks, length = fetcher.stream(URL)
+
+        with pytest.raises(ValueError, match='Fail to resume'):
+            b''.join(chunks)
+
+
+def test_fetcher_resumes_previous_attempt(tmpdir):
+    partial_directory = str(tmpdir.mkdir('partial'))
+    with requests_mock.Mocker() as mock_requests:
+        mock_requests.get(URL, [
+            {'body': BrokenBody(DATA, 50000), 'headers': HEADERS},
+            {'content': _range_callback},
+        ])
+
+        fetcher = ArchiveFetcher(temp_directory=str(tmpdir.mkdir('first')),
+                                 partial_directory=partial_directory,
+                                 max_resumes=0)
+        with pytest.raises(ValueError, match='Fail to download'):
+            fetcher.download(URL)
+
+        fetcher = ArchiveFetcher(temp_directory=str(tmpdir.mkdir('second')),
+                                 partial_directory=partial_directory,
+                                 max_resumes=0)
+        filepath, hashes = fetcher.download(URL)
+
+        assert mock_requests.call_count == 2
+        assert mock_requests.last_request.headers['If-Range'] == '"v1"'
+
+    _check_download(filepath, hashes)
+    assert os.listdir(partial_directory) == []
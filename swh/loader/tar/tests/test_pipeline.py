@@ -0,0 +1,107 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import bz2
+import gzip
+import io
+import lzma
+import os
+import zipfile
+
+import pytest
+
+from swh.model.hashutil import MultiHash
+
+from swh.loader.tar import pipeline
+from swh.loader.tar.stream import directory_from_tarball
+
+
+SAMPLE_TARBALL = os.path.join(
+    os.path.dirname(__file__), 'resources', 'sample-folder.tgz')
+
+
+def _chunks(data, size=7):
+    for i in range(0, len(data), size):
+        yield data[i:i+size]
+
+
+@pytest.fixture
+def raw_tarball():
+    with open(SAMPLE_TARBALL, 'rb') as f:
+        return gzip.decompress(f.read())
+
+
+@pytest.mark.parametrize('compress', [
+    lambda data: data,
+    gzip.compress,
+    bz2.compress,
+    lzma.compress,
+    lambda data: gzip.compress(data[:5000]) + gzip.compress(data[5000:]),
+])
+def test_directory_from_chunks(tmpdir, raw_tarball, compress):
+    data = compress(raw_tarball)
+    filepath = str(tmpdir.join('archive'))
+
+    hashes, directory = pipeline.directory_from_chunks(
+        _chunks(data), length=len(data), filepath=filepath, queue_size=2)
+
+    assert directory.hash == directory_from_tarball(SAMPLE_TARBALL).hash
+    assert hashes == {
+        'length': len(data),
+        **MultiHash.from_data(data).hexdigest(),
+    }
+    assert not os.path.exists(filepath)
+
+
+def test_directory_from_chunks_wrong_length(tmpdir, raw_tarball):
+    data = gzip.compress(raw_tarball)
+
+    with pytest.raises(ValueError, match='Error when checking size'):
+        pipeline.directory_from_chunks(
+            _chunks(data), length=len(data) + 1,
+            filepath=str(tmpdir.join('archive')))
+
+
+def test_directory_from_chunks_truncated(tmpdir, raw_tarball):
+    data = lzma.compress(raw_tarball)[:-30]
+
+    with pytest.raises(ValueError, match='Problem during streaming'):
+        pipeline.directory_from_chunks(
+            _chunks(data), length=len(data),
+            filepath=str(tmpdir.join('archive')))
+
+
+def test_directory_from_chunks_not_streamable(tmpdir):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as z:
+        z.writestr('some-file', 'some data')
+    data = buf.getvalue()
+    filepath = str(tmpdir.join('archive.zip'))
+
+    hashes, directory = pipeline.directory_from_chunks(
+        _chunks(data), length=len(data), filepath=filepath)
+
+    assert directory is None
+    assert hashes['length'] == len(data)
+    with open(filepath, 'rb') as f:
+        assert f.read() == data
+
+
+@pytest.mark.parametrize('compress', [
+    gzip.compress,
+    bz2.compress,
+    lzma.compress,
+])
+def test_directory_from_chunks_compressed_file(tmpdir, compress):
+    data = compress(b'some data, not a tarball\n' * 100)
+    filepath = str(tmpdir.join('archive'))
+
+    hashes, directory = pipeline.directory_from_chunks(
+        _chunks(data), length=len(data), filepath=filepath)
+
+    assert directory is None
+    assert hashes['length'] == len(data)
+    with open(filepath, 'rb') as f:
+        assert f.read() == data
@@ -0,0 +1,75 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import os
+
+import pytest
+
+from swh.loader.tar.pool import LoaderPool
+
+
+class Loader:
+    pass
+
+
+class OtherLoader(Loader):
+    pass
+
+
+def test_reuse():
+    pool = LoaderPool()
+    with pool.loader(Loader) as loader:
+        pass
+    with pool.loader(Loader) as loader2:
+        pass
+
+    assert loader2 is loader
+    with pool.loader(OtherLoader) as other_loader:
+        assert isinstance(other_loader, OtherLoader)
+
+
+def test_concurrent_use():
+    pool = LoaderPool()
+    with pool.loader(Loader) as loader:
+        with pool.loader(Loader) as loader2:
+            assert loader2 is not loader
+    with pool.loader(Loader) as loader3:
+        with pool.loader(Loader) as loader4:
+            assert {loader3, loader4} == {loader, loader2}
+
+
+def test_failure():
+    pool = LoaderPool()
+    with pytest.raises(ValueError):
+        with pool.loader(Loader) as loader:
+            raise ValueError()
+
+    with pool.loader(Loader) as loader2:
+        # the failed loader was dropped
+        assert loader2 is not loader
+
+
+def test_fork(monkeypatch):
+    pool = LoaderPool()
+    with pool.loader(Loader) as loader:
+        pass
+
+    pid = os.getpid()
+    monkeypatch.setattr(os, 'getpid', lambda: pid + 1)
+    with pool.loader(Loader) as loader2:
+        # the loaders of the parent process are not reused
+        assert loader2 is not loader
+    with pool.loader(Loader) as loader3:
+        assert loader3 is loader2
+
+
+def test_clear():
+    pool = LoaderPool()
+    with pool.loader(Loader) as loader:
+        pass
+    pool.clear()
+
+    with pool.loader(Loader) as loader2:
+        assert loader2 is not loader
@@ -0,0 +1,74 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import os
+import pstats
+import tracemalloc
+
+from swh.loader.tar.profiling import VisitProfiler, report_prefix
+
+
+def allocate():
+    return [bytes(1000) for _ in range(1000)]
+
+
+def test_profile(tmpdir):
+    profiler = VisitProfiler(cpu=True, memory=True)
+    with profiler.profile():
+        data = allocate()
+        profiler.checkpoint()
+        del data
+    assert not tracemalloc.is_tracing()
+
+    prefix = str(tmpdir.join('visit'))
+    paths = profiler.write_reports(prefix, header='Visit 1 of origin')
+
+    assert paths == [prefix + '.prof', prefix + '.txt']
+    stats = pstats.Stats(paths[0])
+    assert any(function == 'allocate'
+               for _, _, function in stats.stats)
+    with open(paths[1]) as f:
+        report = f.read()
+    assert report.startswith('Visit 1 of origin\nDuration: ')
+    assert 'CPU profile:' in report
+    assert 'Memory profile: ' in report
+    # the allocations alive at the checkpoint are reported
+    assert 'bytes(1000)' in report
+    assert profiler.memory_snapshot[0] >= 1000 * 1000
+
+
+def test_profile_cpu_only(tmpdir):
+    profiler = VisitProfiler(cpu=True)
+    with profiler.profile():
+        allocate()
+
+    prefix = str(tmpdir.join('visit'))
+    paths = profiler.write_reports(prefix, header='Visit')
+
+    assert paths == [prefix + '.prof', prefix + '.txt']
+    with open(paths[1]) as f:
+        assert 'Memory profile' not in f.read()
+
+
+def test_profile_memory_already_traced(tmpdir):
+    tracemalloc.start()
+    try:
+        profiler = VisitProfiler(memory=True)
+        with profiler.profile():
+            allocate()
+        # the tracing of the memory allocations is left untouched
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
+    assert profiler.memory_snapshot is None
+
+
+def test_report_prefix(tmpdir):
+    prefix = report_prefix(str(tmpdir), 'https://ftp.gnu.org/gnu/8sync/', 3)
+
+    name = os.path.basename(prefix)
+    assert os.path.dirname(prefix) == str(tmpdir)
+    assert name.startswith('visit-3-8sync-')
+    assert name.endswith('-%s' % os.getpid())
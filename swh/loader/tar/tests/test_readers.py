@@ -0,0 +1,184 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import gzip
+import lzma
+import os
+import shutil
+import zipfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from swh.model.from_disk import Directory
+from swh.model.hashutil import MultiHash
+
+from swh.loader.tar import readers
+
+
+SAMPLE_TARBALL = os.path.join(
+    os.path.dirname(__file__), 'resources', 'sample-folder.tgz')
+
+
+def _make_zip(path):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('top/', b'')
+        archive.writestr('top/empty/', b'')
+        archive.writestr('top/README', b'read me\n')
+        archive.writestr('top/src/main.c', b'int main() { return 0; }\n')
+        archive.writestr('top/src/big.bin', os.urandom(300000))
+        link = zipfile.ZipInfo('top/link')
+        link.external_attr = 0o120777 << 16
+        archive.writestr(link, 'README')
+        archive.writestr('../outside', b'ignored')
+        archive.writestr('/absolute', b'ignored')
+
+
+def _from_unpacked(archive_path, tmpdir):
+    extracted = str(tmpdir.join('extracted'))
+    shutil.unpack_archive(archive_path, extracted, format='zip')
+    for dirpath, _, fnames in os.walk(extracted):
+        for fname in fnames:
+            os.chmod(os.path.join(dirpath, fname), 0o644)
+    return Directory.from_disk(path=extracted.encode('utf-8'))
+
+
+def test_find_reader(tmpdir):
+    zippath = str(tmpdir.join('archive.zip'))
+    _make_zip(zippath)
+    gzpath = str(tmpdir.join('file.txt.gz'))
+    with gzip.open(gzpath, 'wb') as f:
+        f.write(b'some text\n')
+    plain = str(tmpdir.join('file.txt'))
+    with open(plain, 'wb') as f:
+        f.write(b'some text\n')
+
+    assert readers.find_reader(SAMPLE_TARBALL)[0] == 'tar'
+    assert readers.find_reader(zippath)[0] == 'zip'
+    assert readers.find_reader(gzpath)[0] == 'gz'
+    assert readers.find_reader(plain) == (None, None)
+
+
+def test_broken_tarball_is_not_a_compressed_file(tmpdir):
+    tgzpath = str(tmpdir.join('broken.tar.gz'))
+    with gzip.open(tgzpath, 'wb') as f:
+        f.write(b'not a tarball')
+
+    assert readers.find_reader(tgzpath) == (None, None)
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_directory_from_zipfile_same_as_unpacked(tmpdir, workers):
+    zippath = str(tmpdir.join('archive.zip'))
+    _make_zip(zippath)
+    expected = _from_unpacked(zippath, tmpdir)
+
+    if workers:
+        with ThreadPoolExecutor(workers) as executor:
+            actual = readers.directory_from_zipfile(zippath,
+                                                    executor=executor)
+    else:
+        actual = readers.directory_from_zipfile(zippath)
+
+    assert actual.hash == expected.hash
+    objects = actual.collect()
+    assert len(objects['content']) == 4
+    assert len(objects['directory']) == 4
+
+
+def test_directory_from_zipfile_sinks(tmpdir):
+    zippath = str(tmpdir.join('archive.zip'))
+    _make_zip(zippath)
+    contents, directories = [], []
+
+    with ThreadPoolExecutor(2) as executor:
+        directory = readers.directory_from_zipfile(
+            zippath, executor=executor, content_sink=contents.append,
+            directory_sink=directories.append)
+
+    assert len(contents) == 4
+    assert directories[-1]['id'] == directory.hash
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_directory_from_zipfile_max_content_size(tmpdir, workers):
+    zippath = str(tmpdir.join('archive.zip'))
+    _make_zip(zippath)
+    expected = readers.directory_from_zipfile(zippath)
+    contents = []
+
+    executor = ThreadPoolExecutor(workers) if workers else None
+    actual = readers.directory_from_zipfile(
+        zippath, executor=executor, max_content_size=1000,
+        content_sink=contents.append)
+    if executor:
+        executor.shutdown()
+
+    assert actual.hash == expected.hash
+    skipped = [c for c in contents if c.get('status') == 'absent']
+    assert [c['length'] for c in skipped] == [300000]
+    assert 'data' not in skipped[0]
+
+
+def test_directory_from_zipfile_broken(tmpdir):
+    zippath = str(tmpdir.join('archive.zip'))
+    _make_zip(zippath)
+    with open(zippath, 'r+b') as f:
+        f.truncate(100)
+
+    with pytest.raises(ValueError, match='Problem during reading'):
+        readers.directory_from_zipfile(zippath)
+
+
+@pytest.mark.parametrize('extension,open_compressed', [
+    ('.gz', gzip.open), ('.xz', lzma.open)])
+def test_directory_from_compressed_file(tmpdir, monkeypatch, extension,
+                                        open_compressed):
+    # spooled to disk
+    monkeypatch.setattr(readers, 'SPOOL_SIZE', 1000)
+    data = os.urandom(5000)
+    path = str(tmpdir.join('data.bin' + extension))
+    with open_compressed(path, 'wb') as f:
+        f.write(data)
+
+    nature, reader = readers.find_reader(path)
+    directory = reader.directory(path)
+
+    entries = {entry['name']: entry
+               for entry in directory.get_data()['entries']}
+    assert list(entries) == [b'data.bin']
+    content = MultiHash.from_data(data).digest()
+    assert entries[b'data.bin']['target'] == content['sha1_git']
+    assert entries[b'data.bin']['perms'] == 0o100644
+    assert directory[b'data.bin'].data['data'] == data
+    assert not reader.extractable
+    assert os.listdir(str(tmpdir)) == [os.path.basename(path)]
+
+
+def test_directory_from_compressed_file_truncated(tmpdir):
+    path = str(tmpdir.join('data.txt.gz'))
+    with gzip.open(path, 'wb') as f:
+        f.write(os.urandom(5000))
+    with open(path, 'r+b') as f:
+        f.truncate(100)
+
+    with pytest.raises(ValueError, match='Problem during uncompressing'):
+        readers.directory_from_compressed_file(path)
+
+
+def test_register_reader(tmpdir, monkeypatch):
+    monkeypatch.setattr(readers, 'READERS', list(readers.READERS))
+    path = str(tmpdir.join('archive.custom'))
+    with open(path, 'wb') as f:
+        f.write(b'custom')
+    reader = readers.ArchiveReader(
+        detect=lambda path, external: 'custom' if path.endswith(
+            '.custom') else None,
+        directory=None, lazy=False, extractable=False)
+
+    readers.register_reader(reader, first=True)
+
+    assert readers.find_reader(path) == ('custom', reader)
@@ -0,0 +1,84 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import io
+import os
+import tarfile
+
+import pytest
+
+from swh.loader.tar.extract import extract_tarball
+from swh.loader.tar.limits import ArchiveLimitExceeded
+from swh.loader.tar.scratch import MemoryScratch, ScratchFull, ScratchLimits
+
+
+@pytest.fixture
+def scratch(tmpdir):
+    memory = tmpdir.mkdir('memory')
+    return MemoryScratch(str(memory), str(tmpdir.join('budget.json')), 1000)
+
+
+def test_reserve_and_discard(scratch):
+    path = scratch.reserve(600)
+
+    assert os.path.isdir(path)
+    assert path.startswith(scratch.directory)
+    assert scratch.budget.used() == 600
+    assert scratch.reserve(600) is None
+
+    scratch.discard(path)
+
+    assert not os.path.exists(path)
+    assert scratch.budget.used() == 0
+    assert scratch.reserve(600) is not None
+
+
+def test_reserve_larger_than_budget(scratch):
+    assert scratch.reserve(1001) is None
+    assert scratch.budget.used() == 0
+
+
+def test_reserve_unusable_directory(tmpdir):
+    scratch = MemoryScratch(str(tmpdir.join('missing')),
+                            str(tmpdir.join('budget.json')), 1000)
+
+    assert scratch.reserve(10) is None
+    assert scratch.budget.used() == 0
+
+
+def test_release(scratch):
+    paths = [scratch.reserve(100), scratch.reserve(200)]
+
+    scratch.release()
+
+    assert not any(os.path.exists(path) for path in paths)
+    assert os.listdir(scratch.directory) == []
+    assert scratch.budget.used() == 0
+
+
+def test_scratch_limits():
+    limits = ScratchLimits(100, max_members=2)
+
+    limits.add_member(b'a', 100)
+    with pytest.raises(ScratchFull):
+        limits.add_member(b'b', 1)
+    with pytest.raises(ArchiveLimitExceeded):
+        limits.add_member(b'c')
+
+
+def test_extract_tarball_spills(tmpdir, scratch):
+    tarpath = str(tmpdir.join('archive.tar'))
+    with tarfile.open(tarpath, 'w') as tar:
+        for name in ('a', 'b'):
+            info = tarfile.TarInfo(name)
+            info.size = 500
+            tar.addfile(info, io.BytesIO(b'\0' * 500))
+    path = scratch.reserve(800)
+
+    with pytest.raises(ScratchFull):
+        extract_tarball(tarpath, path, limits=ScratchLimits(800))
+
+    # the members not fitting in the reservation are not extracted
+    assert os.listdir(path) == ['a']
@@ -0,0 +1,85 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import threading
+
+import pytest
+
+from swh.loader.tar.sender import BackgroundSender
+
+
+def test_background_sender_in_order():
+    sent = []
+    sender = BackgroundSender(max_pending=2)
+    main_thread = threading.current_thread()
+
+    def send(objects):
+        assert threading.current_thread() is not main_thread
+        sent.append(objects)
+
+    for i in range(10):
+        sender.submit(send, [i])
+    sender.join()
+
+    assert sent == [[i] for i in range(10)]
+
+
+def test_background_sender_bounded():
+    release = threading.Event()
+    sender = BackgroundSender(max_pending=1)
+    sender.submit(lambda objects: release.wait(), [])
+    # the first packet is being sent, the second one waits in the queue
+    sender.submit(lambda objects: None, [])
+
+    submitted = threading.Event()
+
+    def submit():
+        sender.submit(lambda objects: None, [])
+        submitted.set()
+
+    thread = threading.Thread(target=submit)
+    thread.start()
+    assert not submitted.wait(0.2)
+
+    release.set()
+    thread.join()
+    sender.join()
+    assert submitted.is_set()
+
+
+def test_background_sender_error():
+    sent = []
+
+    def fail(objects):
+        raise RuntimeError('storage failure')
+
+    sender = BackgroundSender()
+    sender.submit(fail, [1])
+    sender.submit(sent.append, [2])
+
+    with pytest.raises(RuntimeError, match='storage failure'):
+        sender.join()
+    # the packets following the failure were dropped
+    assert sent == []
+
+    # the sender can be used again
+    sender.submit(sent.append, [3])
+    sender.join()
+    assert sent == [[3]]
+
+
+def test_background_sender_discard():
+    release = threading.Event()
+    sent = []
+    sender = BackgroundSender(max_pending=4)
+    sender.submit(lambda objects: release.wait(), [])
+    for i in range(3):
+        sender.submit(sent.append, [i])
+
+    release.set()
+    sender.discard()
+
+    assert sent == []
+    sender.check()
@@ -0,0 +1,215 @@
+# Copyright (C) 2019  The Software Heritage developers
+# See the AUTHORS file at the top-level directory of this distribution
+# License: GNU General Public License version 3, or any later version
+# See top-level LICENSE file for more information
+
+import io
+import os
+import tarfile
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from swh.core import tarball
+from swh.model.from_disk import Directory
+
+from swh.loader.tar import stream
+from swh.loader.tar.decompress import external_command
+from swh.loader.tar.hashing import directory_from_disk
+
+
+SAMPLE_TARBALL = os.path.join(
+    os.path.dirname(__file__), 'resources', 'sample-folder.tgz')
+
+
+def _add_member(tar, name, data=None, **kwargs):
+    info = tarfile.TarInfo(name)
+    for k, v in kwargs.items():
+        setattr(info, k, v)
+    if data is not None:
+        info.size = len(data)
+        tar.addfile(info, io.BytesIO(data))
+    else:
+        tar.addfile(info)
+
+
+def test_normalize_name():
+    assert stream.normalize_name('./foo//bar/') == b'foo/bar'
+    assert stream.normalize_name('/foo/./bar') == b'foo/bar'
+    assert stream.normalize_name('.') == b''
+    assert stream.normalize_name('foo/../../etc/passwd') is None
+
+
+def test_directory_from_tarball_same_as_from_disk(tmpdir):
+    tarball.uncompress(SAMPLE_TARBALL, str(tmpdir))
+    expected = Directory.from_disk(path=str(tmpdir).encode('utf-8'))
+
+    actual = stream.directory_from_tarball(SAMPLE_TARBALL)
+
+    assert actual.hash == expected.hash
+    objects = actual.collect()
+    assert len(objects['content']) == 8
+    assert len(objects['directory']) == 6
+
+
+def test_directory_from_tarball_hardlink_and_implicit_dirs(tmpdir):
+    tarpath = str(tmpdir.join('archive.tar'))
+    with tarfile.open(tarpath, 'w') as tar:
+        _add_member(tar, 'top/sub/file', b'some data\n', mode=0o755)
+        _add_member(tar, 'top/hardlink', type=tarfile.LNKTYPE,
+                    linkname='top/sub/file', mode=0o755)
+
+    extracted = tmpdir.join('extracted')
+    tarball.uncompress(tarpath, str(extracted))
+    expected = Directory.from_disk(path=str(extracted).encode('utf-8'))
+
+    actual = stream.directory_from_tarball(tarpath)
+
+    assert actual.hash == expected.hash
+
+
+def test_directory_from_tarball_same_perms_as_extracted(tmpdir):
+    tarpath = str(tmpdir.join('archive.tar'))
+    with tarfile.open(tarpath, 'w') as tar:
+        _add_member(tar, 'top/group-exec', b'group\n', mode=0o654)
+        _add_member(tar, 'top/other-exec', b'other\n', mode=0o601)
+        _add_member(tar, 'top/owner-exec', b'owner\n', mode=0o700)
+        _add_member(tar, 'top/hardlink', type=tarfile.LNKTYPE,
+                    linkname='top/group-exec', mode=0o654)
+
+    extracted = tmpdir.join('extracted')
+    tarball.uncompress(tarpath, str(extracted))
+    expected = directory_from_disk(str(extracted).encode('utf-8'))
+
+    actual = stream.directory_from_tarball(tarpath)
+
+    assert actual.hash == expected.hash
+    assert {name: actual[b'top/' + name].data['perms']
+            for name in (b'group-exec', b'other-exec', b'owner-exec',
+                         b'hardlink')} == {
+        b'group-exec': 0o100644,
+        b'other-exec': 0o100644,
+        b'owner-exec': 0o100755,
+        b'hardlink': 0o100644,
+    }
+
+
+def test_directory_from_tarball_conflicting_members(tmpdir):
+    tarpath = str(tmpdir.join('archive.tar'))
+    with tarfile.open(tarpath, 'w') as tar:
+        _add_member(tar, 'top/entry', b'data')
+        _add_member(tar, 'top/entry/file', b'data')
+
+    with pytest.raises(ValueError, match='Conflicting'):
+        stream.directory_from_tarball(tarpath)
+
+
+def test_directory_from_tarball_not_a_tarball(tmpdir):
+    path = tmpdir.join('not-a-tarball')
+    path.write('not a tarball')
+
+    with pytest.raises(ValueError, match='Problem during streaming'):
+        stream.directory_from_tarball(str(path))
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_directory_from_tarball_sinks(workers):
+    expected = stream.directory_from_tarball(SAMPLE_TARBALL)
+    contents = []
+    directories = []
+
+    executor = ThreadPoolExecutor(workers) if workers else None
+    actual = stream.directory_from_tarball(
+        SAMPLE_TARBALL, executor=executor, content_sink=contents.append,
+        directory_sink=directories.append)
+    if executor:
+        executor.shutdown()
+
+    assert actual.hash == expected.hash
+    assert len(contents) == 8
+    assert all('data' in content for content in contents)
+    # the directories are handed over bottom-up
+    assert len(directories) == 6
+    assert directories[-1]['id'] == actual.hash
+    # only the hashes of the contents are kept
+    for content in actual.collect()['content'].values():
+        assert 'data' not in content
+
+
+def test_directory_from_tarball_lazy():
+    expected = stream.directory_from_tarball(SAMPLE_TARBALL)
+    expected_contents = {
+        c['sha1']: c for c in expected.collect()['content'].values()
+    }
+
+    actual = stream.directory_from_tarball(SAMPLE_TARBALL, lazy=True)
+    assert actual.hash == expected.hash
+
+    lazy_contents = [
+        c for c in actual.collect()['content'].values()
+        if 'archive_offset' in c
+    ]
+    # the 3 regular files, symlinks are still held in memory
+    assert len(lazy_contents) == 3
+    assert not any('data' in c for c in lazy_contents)
+
+    reader = stream.ContentReader(SAMPLE_TARBALL)
+    contents = list(reader.read(reversed(lazy_contents)))
+
+    assert len(contents) == 3
+    for content in contents:
+        assert 'archive_offset' not in content
+        assert content == expected_contents[content['sha1']]
+
+
+@pytest.mark.skipif(not external_command('gz'), reason='gzip not installed')
+def test_directory_from_tarball_external_decompression():
+    expected = stream.directory_from_tarball(SAMPLE_TARBALL, lazy=True)
+    actual = stream.directory_from_tarball(
+        SAMPLE_TARBALL, lazy=True, external_decompression=True)
+    assert actual.hash == expected.hash
+
+    lazy_contents = [
+        c for c in actual.collect()['content'].values()
+        if 'archive_offset' in c
+    ]
+    reader = stream.ContentReader(SAMPLE_TARBALL,
+                                  external_decompression=True)
+    contents = list(reader.read(lazy_contents))
+    assert len(contents) == 3
+    assert all(len(c['data']) == c['length'] for c in contents)
+
+
+def test_is_tarball(tmpdir):
+    path = tmpdir.join('not-a-tarball')
+    path.write('not a tarball')
+
+    assert stream.is_tarball(SAMPLE_TARBALL)
+    assert not stream.is_tarball(str(path))
+
+
+@pytest.mark.parametrize('workers', [0, 2])
+def test_directory_from_tarball_max_content_size(tmpdir, workers):
+    tarpath = str(tmpdir.join('archive.tar'))
+    large = b'large data\n' * 1000
+    with tarfile.open(tarpath, 'w') as tar:
+        _add_member(tar, 'top/small', b'small data\n', mode=0o644)
+        _add_member(tar, 'top/disk.img', large, mode=0o644)
+    expected = stream.directory_from_tarball(tarpath)
+    contents = []
+
+    executor = ThreadPoolExecutor(workers) if workers else None
+    actual = stream.directory_from_tarball(
+        tarpath, executor=executor, lazy=True, max_content_size=1000,
+        content_sink=contents.append)
+    if executor:
+        executor.shutdown()
+
+    assert actual.hash == expected.hash
+    skipped = [c for c in contents if c.get('status') == 'absent']
+    assert len(skipped) == 1
+    assert skipped[0]['length'] == len(large)
+    assert skipped[0]['reason'] == 'Content too large'
+    # neither the data nor its offset are kept
+    assert not any(key in skipped[0] for key in stream.DATA_KEYS)
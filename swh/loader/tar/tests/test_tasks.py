@@ -3,7 +3,14 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from swh.loader.tar.admission import AdmissionControl
+from swh.loader.tar.loader import RemoteTarLoader
+from swh.loader.tar.pool import loaders
+from swh.loader.tar.tasks import admit_and_load
 
 
 @patch('swh.loader.tar.loader.RemoteTarLoader.load')
@@ -25,3 +32,115 @@ def test_tar_loader_task(mock_loader, swh_app, celery_session_worker):
     mock_loader.assert_called_once_with(
         origin='origin', visit_date='visit_date',
         last_modified='last_modified')
+
+
+@patch('swh.loader.tar.loader.MultiRemoteTarLoader.load')
+def test_tar_artifacts_loader_task(mock_loader, swh_app,
+                                   celery_session_worker):
+    mock_loader.return_value = {'status': 'eventful'}
+    artifacts = [['url-1', 'last_modified-1'], ['url-2', 'last_modified-2']]
+
+    res = swh_app.send_task(
+        'swh.loader.tar.tasks.LoadTarArtifacts',
+        ('origin', 'visit_date', artifacts))
+    assert res
+    res.wait()
+    assert res.successful()
+
+    assert res.result == {'status': 'eventful'}
+
+    mock_loader.assert_called_once_with(
+        origin='origin', visit_date='visit_date', artifacts=artifacts)
+
+
+@patch('swh.loader.tar.loader.RemoteTarLoader.load')
+def test_tar_loader_task_reuses_loader(mock_loader, swh_app,
+                                       celery_session_worker):
+    mock_loader.return_value = {'status': 'eventful'}
+    loaders.clear()
+
+    for _ in range(2):
+        res = swh_app.send_task(
+            'swh.loader.tar.tasks.LoadTarRepository',
+            ('origin', 'visit_date', 'last_modified'))
+        res.wait()
+        assert res.successful()
+
+    assert mock_loader.call_count == 2
+    assert len(loaders.idle[RemoteTarLoader]) == 1
+
+
+class Retry(Exception):
+    pass
+
+
+class AdmittedLoader:
+    admission = None
+
+    def load(self, **kwargs):
+        self.used_budget = self.admission.budget.used()
+        return {'status': 'eventful'}
+
+
+@pytest.fixture
+def admitted_loader(tmpdir):
+    AdmittedLoader.admission = AdmissionControl(
+        str(tmpdir.join('budget.json')), budget=100, large_size=1000,
+        large_queue='large', retry_delay=10)
+    loaders.clear()
+    yield AdmittedLoader
+    loaders.clear()
+
+
+def _task(routing_key='default'):
+    task = MagicMock()
+    task.request.delivery_info = {'routing_key': routing_key}
+    task.request.args = ('origin',)
+    task.retry.return_value = Retry()
+    return task
+
+
+def test_admit_and_load(admitted_loader):
+    task = _task()
+
+    result = admit_and_load(task, admitted_loader, lambda: [], 60,
+                            origin='origin')
+
+    assert result == {'status': 'eventful'}
+    loader = loaders.idle[admitted_loader][0]
+    assert loader.used_budget == 60
+    assert admitted_loader.admission.budget.used() == 0
+
+
+def test_admit_and_load_over_budget(admitted_loader):
+    task = _task()
+
+    with admitted_loader.admission.reserve(50):
+        with pytest.raises(Retry):
+            admit_and_load(task, admitted_loader, lambda: [], 60,
+                           origin='origin')
+
+    task.retry.assert_called_once_with(countdown=10, max_retries=None)
+    # the loader was given back to the pool
+    assert len(loaders.idle[admitted_loader]) == 1
+
+
+def test_admit_and_load_large(admitted_loader):
+    task = _task()
+
+    admit_and_load(task, admitted_loader, lambda: [], 1000, origin='origin')
+
+    task.signature.assert_called_once_with(
+        ('origin',), task.request.kwargs, queue='large')
+    task.replace.assert_called_once_with(task.signature.return_value)
+
+
+def test_admit_and_load_large_queue(admitted_loader):
+    task = _task(routing_key='large')
+
+    result = admit_and_load(task, admitted_loader, lambda: [], 1000,
+                            origin='origin')
+
+    # loaded from the queue of the large artifacts
+    assert result == {'status': 'eventful'}
+    task.replace.assert_not_called()
@@ -41,3 +41,45 @@ class UtilsLib(unittest.TestCase):
         _input = [(i, i+1) for i in range(0, 9)]
         actual_data = utils.random_blocks(_input, 2)
         self.assert_ok(actual_data, expected_data=_input)
+
+
+class PacketBufferTest(unittest.TestCase):
+
+    def test_packets_per_count(self):
+        packets = []
+        buffer = utils.PacketBuffer(packets.append, max_count=2)
+
+        for i in range(5):
+            buffer.add({'id': i, 'length': 1})
+        buffer.flush()
+        buffer.flush()
+
+        self.assertEqual([[o['id'] for o in p] for p in packets],
+                         [[0, 1], [2, 3], [4]])
+
+    def test_packets_per_size(self):
+        packets = []
+        buffer = utils.PacketBuffer(packets.append, max_count=10,
+                                    max_size=100)
+
+        buffer.add({'id': 0, 'length': 60})
+        buffer.add({'id': 1, 'length': 60})
+        buffer.add({'id': 2, 'length': 10})
+
+        self.assertEqual([[o['id'] for o in p] for p in packets],
+                         [[0, 1]])
+        buffer.flush()
+        self.assertEqual([[o['id'] for o in p] for p in packets],
+                         [[0, 1], [2]])
+
+    def test_clear(self):
+        packets = []
+        buffer = utils.PacketBuffer(packets.append, max_count=2,
+                                    max_size=100)
+
+        buffer.add({'id': 0, 'length': 60})
+        buffer.clear()
+        buffer.add({'id': 1, 'length': 60})
+        buffer.flush()
+
+        self.assertEqual([[o['id'] for o in p] for p in packets], [[1]])
@@ -3,6 +3,7 @@
 # License: GNU General Public License version 3, or any later version
 # See top-level LICENSE file for more information
 
+import os
 import random
 
 from swh.core.utils import grouper
@@ -33,3 +34,54 @@ def random_blocks(iterable, block=100):
         random.shuffle(lst)
         for e in lst:
             yield e
+
+
+def is_alive(pid):
+    """Return whether the process pid is running."""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class PacketBuffer:
+    """Buffer objects and send them by packets.
+
+    A packet is sent as soon as it holds max_count objects, or objects
+    whose total length reaches max_size bytes.
+
+    Args:
+        send (callable): called with the list of objects of each packet
+        max_count (int): maximum number of objects per packet
+        max_size (int): maximum size of a packet, computed from the
+          objects' `length` (no limit if None)
+
+    """
+    def __init__(self, send, *, max_count, max_size=None):
+        self.send = send
+        self.max_count = max_count
+        self.max_size = max_size
+        self.objects = []
+        self.size = 0
+
+    def add(self, obj):
+        """Buffer obj, sending the current packet if it is full"""
+        self.objects.append(obj)
+        self.size += obj.get('length', 0)
+        if len(self.objects) >= self.max_count or \
+           (self.max_size is not None and self.size >= self.max_size):
+            self.flush()
+
+    def flush(self):
+        """Send the buffered objects, if any"""
+        if self.objects:
+            objects, self.objects, self.size = self.objects, [], 0
+            self.send(objects)
+
+    def clear(self):
+        """Drop the buffered objects, without sending them"""
+        self.objects = []
+        self.size = 0